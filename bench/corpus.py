@@ -0,0 +1,120 @@
+import os
+import argparse
+from typing import Dict, Iterator, List
+
+import faiss
+import numpy as np
+
+# Synthetic course material for the benchmarks: lecture documents with headings and
+# paragraphs, chunk records shaped like the chunk store's, clustered embedding vectors
+# and student questions. Everything is seeded, so every run sees the same corpus.
+
+TOPICS = [
+    "anchoring", "availability", "representativeness", "framing", "loss aversion", "prospect theory",
+    "expected utility", "bounded rationality", "satisficing", "decision trees", "risk", "uncertainty",
+    "heuristics", "biases", "overconfidence", "sunk costs", "mental accounting", "nudges",
+    "group decisions", "game theory", "negotiation", "forecasting", "base rates", "probability",
+]
+
+WORDS = (
+    "decision manager option outcome probability value estimate judgement evidence choice model "
+    "strategy market customer cost benefit information preference alternative criterion weight "
+    "scenario analysis intuition rule effect study experiment result error example case firm team "
+    "policy plan budget time quality process behaviour reference point gain loss signal noise"
+).split()
+
+QUESTION_FORMS = [
+    "What is {}?", "Can you explain {}?", "How does {} affect decisions?", "Give an example of {}.",
+    "Why does {} matter for managers?", "What is the difference between {} and {}?",
+]
+
+
+def sentence(rng: np.random.Generator, topic: str) -> str:
+    words = list(rng.choice(WORDS, int(rng.integers(8, 20))))
+    words.insert(int(rng.integers(0, len(words))), topic)
+    return " ".join(words).capitalize() + "."
+
+
+def make_document(rng: np.random.Generator, sections: int, paragraphs_per_section: int = 4) -> List[str]:
+    """Sections of one lecture: a heading and paragraphs of 3 to 7 sentences each."""
+    result = []
+    for _ in range(sections):
+        topic = str(rng.choice(TOPICS))
+        blocks = [f"# {topic.title()}"]
+        for _ in range(paragraphs_per_section):
+            blocks.append(" ".join(sentence(rng, topic) for _ in range(int(rng.integers(3, 8)))))
+        result.append("\n\n".join(blocks))
+    return result
+
+
+def write_corpus(directory: str, documents: int, sections: int, seed: int = 0) -> None:
+    """Writes `documents` lectures of `sections` sections each as .txt files, as input for prepare_documents.py."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    for i in range(documents):
+        with open(os.path.join(directory, f"lecture_{i:04d}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(make_document(rng, sections)))
+
+
+def iter_chunk_records(count: int, words_per_chunk: int = 250, seed: int = 0) -> Iterator[Dict[str, object]]:
+    """
+    `count` chunk records as create_final_data.py stores them, with chunk ids
+    1..count; the text is built from a fixed pool of sentences, so generating
+    a million of them stays fast.
+    """
+    rng = np.random.default_rng(seed)
+    pool = [sentence(rng, topic) for topic in TOPICS for _ in range(40)]
+    sentences_per_chunk = max(1, words_per_chunk // 15)
+    for chunk_id in range(1, count + 1):
+        picks = rng.integers(0, len(pool), sentences_per_chunk)
+        filename = f"lecture_{(chunk_id - 1) // 200:04d}.txt"
+        chunk_index = (chunk_id - 1) % 200
+        page = chunk_index // 4 + 1
+        yield {
+            "chunk_id": chunk_id,
+            "filename": filename,
+            "chunk_index": chunk_index,
+            "chunk_text": " ".join(pool[p] for p in picks),
+            "page": page,
+            "page_end": page,
+            "sources": [{"filename": filename, "chunk_index": chunk_index, "chunk_id": chunk_id, "page": page}],
+        }
+
+
+def make_vectors(count: int, dimension: int, seed: int = 0) -> np.ndarray:
+    """Unit vectors drawn around random topic centres, like scripts/benchmark_index.py --synthetic."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((max(1, count // 100), dimension)).astype(np.float32)
+    vectors = np.empty((count, dimension), dtype=np.float32)
+    # Drawn in blocks, so a million vectors need no float64 temporaries of the full size
+    for start in range(0, count, 65536):
+        end = min(count, start + 65536)
+        topics = rng.integers(0, len(centres), end - start)
+        block = centres[topics] + 0.5 * rng.standard_normal((end - start, dimension)).astype(np.float32)
+        faiss.normalize_L2(block)
+        vectors[start:end] = block
+    return vectors
+
+
+def make_questions(count: int, seed: int = 0) -> List[str]:
+    """Student questions about the course topics; like real ones, some repeat."""
+    rng = np.random.default_rng(seed)
+    questions = []
+    for i in range(count):
+        form = QUESTION_FORMS[i % len(QUESTION_FORMS)]
+        questions.append(form.format(*rng.choice(TOPICS, form.count("{}"), replace=False)))
+    return questions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic course corpus of .txt lectures.")
+    parser.add_argument("directory", help="output folder")
+    parser.add_argument("--documents", type=int, default=50, help="number of lecture files")
+    parser.add_argument("--sections", type=int, default=20, help="sections per lecture")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_corpus(args.directory, args.documents, args.sections, args.seed)
+    print(f"Wrote {args.documents} lectures of {args.sections} sections to {args.directory}")
+
+if __name__ == "__main__":
+    main()
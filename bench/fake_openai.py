@@ -0,0 +1,213 @@
+import argparse
+import base64
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# A local stand-in for the OpenAI API, for benchmarks on a machine without network.
+# It serves /v1/embeddings and /v1/chat/completions (including streams) with
+# deterministic output after a configurable latency. Point the app at it with
+# OPENAI_BASE_URL=http://127.0.0.1:<port>/v1 and any OPENAI_API_KEY. With
+# answered=False every answer fails verification, which exercises the retry path.
+
+ANSWER_WORDS = (
+    "The course material explains this with an example from management practice: the decision "
+    "maker compares the options, weighs the evidence and the probabilities, and notices how the "
+    "framing of the problem changes the choice."
+).split()
+
+
+def fake_embedding(text: str, dimension: int) -> np.ndarray:
+    """A unit vector seeded by the text, so the same text always gets the same embedding."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def count_words(messages) -> int:
+    return sum(len(str(message.get("content", "")).split()) for message in messages)
+
+
+def fake_reply(request: dict, answer_words: int, answered: bool = True) -> str:
+    """
+    A reply in the shape the pipeline expects from each kind of request.
+    `answered` is the verdict of self-assessments and of the verifier.
+    """
+    messages = request.get("messages", [])
+    text = " ".join(str(message.get("content", "")) for message in messages)
+    if (request.get("response_format") or {}).get("type") == "json_object":
+        if "is_syllabus" in text:
+            return json.dumps({"is_syllabus": False, "is_followup": False})
+        return json.dumps({"answer": fake_answer(text, answer_words), "answered": answered})
+    # The Yes/No classifiers and the verifier ask for a few tokens only
+    if (request.get("max_tokens") or 1000) <= 5:
+        return "No" if not answered and "Attendant" in text else "Yes"
+    return fake_answer(text, answer_words)
+
+
+def fake_answer(prompt: str, words: int) -> str:
+    offset = int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:2], "little")
+    return " ".join(ANSWER_WORDS[(offset + i) % len(ANSWER_WORDS)] for i in range(words))
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        if self.path.endswith("/embeddings"):
+            time.sleep(server.embedding_latency)
+            self.send_json(self.embeddings(request))
+        elif self.path.endswith("/chat/completions"):
+            time.sleep(server.latency)
+            if request.get("stream"):
+                self.stream_chat(request)
+            else:
+                self.send_json(self.chat(request))
+        else:
+            self.send_json({"error": {"message": f"Unknown path {self.path}"}}, status=404)
+
+    def send_json(self, body: dict, status: int = 200) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def embeddings(self, request: dict) -> dict:
+        inputs = request.get("input", [])
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        data = []
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(str(text), self.server.dimension)
+            if request.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(len(str(text).split()) for text in inputs)
+        return {"object": "list", "data": data, "model": request.get("model"),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+    def chat(self, request: dict) -> dict:
+        content = fake_reply(request, self.server.answer_words, self.server.answered)
+        prompt_tokens = count_words(request.get("messages", []))
+        completion_tokens = len(content.split())
+        return {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def stream_chat(self, request: dict) -> None:
+        # Server-sent events until the connection closes, like the real streaming API
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        content = fake_reply(request, self.server.answer_words, self.server.answered)
+        base = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": request.get("model")}
+        pieces = [{"role": "assistant", "content": ""}] + [{"content": word + " "} for word in content.split()]
+        for delta in pieces:
+            self.send_event(dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}]))
+            if self.server.token_delay:
+                time.sleep(self.server.token_delay)
+        self.send_event(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            prompt_tokens = count_words(request.get("messages", []))
+            completion_tokens = len(content.split())
+            self.send_event(dict(base, choices=[], usage={
+                "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def send_event(self, body: dict) -> None:
+        self.wfile.write(b"data: " + json.dumps(body).encode("utf-8") + b"\n\n")
+        self.wfile.flush()
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """
+    The fake API server. latency and embedding_latency are the seconds every
+    chat and embeddings request waits before answering; token_delay spaces
+    out streamed tokens. Embeddings have `dimension` components. answered=False
+    makes every answer fail verification; it can be changed while serving.
+    """
+
+    daemon_threads = True
+    # Many concurrent benchmark clients connect at once
+    request_queue_size = 1024
+
+    def __init__(self, address, latency: float = 0.0, embedding_latency: float = 0.0, token_delay: float = 0.0,
+                 dimension: int = 384, answer_words: int = 120, answered: bool = True):
+        super().__init__(address, FakeOpenAIHandler)
+        self.latency = latency
+        self.embedding_latency = embedding_latency
+        self.token_delay = token_delay
+        self.dimension = dimension
+        self.answer_words = answer_words
+        self.answered = answered
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0, **options) -> FakeOpenAIServer:
+    """Starts a FakeOpenAIServer in a daemon thread (port 0 picks a free port) and returns it."""
+    server = FakeOpenAIServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds before each chat completion")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="seconds before each embeddings reply")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed tokens")
+    parser.add_argument("--dimension", type=int, default=384, help="embedding dimension")
+    parser.add_argument("--answer-words", type=int, default=120, help="words per answer")
+    parser.add_argument("--fail-verification", action="store_true",
+                        help="make every answer fail verification, so each question is retried")
+
+
+def server_options(args: argparse.Namespace) -> dict:
+    return dict(latency=args.latency, embedding_latency=args.embedding_latency, token_delay=args.token_delay,
+                dimension=args.dimension, answer_words=args.answer_words, answered=not args.fail_verification)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a deterministic fake of the OpenAI API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    server = FakeOpenAIServer((args.host, args.port), **server_options(args))
+    print(f"Fake OpenAI API at {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
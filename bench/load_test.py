@@ -0,0 +1,181 @@
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import httpx
+import numpy as np
+
+# Make the project root importable so the shared "src", "scripts" and "bench" modules resolve.
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from bench.corpus import make_questions
+from bench.fake_openai import add_server_arguments
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url: str, timeout: float, process: subprocess.Popen) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(process.args)} exited with status {process.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise TimeoutError(f"{url} did not come up within {timeout:.0f} s")
+
+
+async def run_user(client, user, questions, next_request, total, stream, results):
+    """One simulated student: asks questions in turn, with its own session, until `total` requests were sent."""
+    session_id = f"bench-user-{user:08d}"
+    while next_request[0] < total:
+        question = questions[next_request[0] % len(questions)]
+        next_request[0] += 1
+        body = {"query": question, "session_id": session_id}
+        start = time.perf_counter()
+        first_token = None
+        try:
+            if stream:
+                async with client.stream("POST", "/api/chat/stream", json=body) as response:
+                    failed = response.status_code != 200
+                    async for line in response.aiter_lines():
+                        if first_token is None and line.startswith("event: token"):
+                            first_token = time.perf_counter() - start
+                        failed = failed or line.startswith("event: error")
+            else:
+                response = await client.post("/api/chat", json=body)
+                failed = response.status_code != 200 or "error" in response.json()
+        except httpx.HTTPError:
+            failed = True
+        results.append((time.perf_counter() - start, first_token, failed))
+
+
+async def run_load(url, questions, concurrency, total, stream, timeout):
+    results = []
+    next_request = [0]
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            run_user(client, user, questions, next_request, total, stream, results) for user in range(concurrency)
+        ])
+        seconds = time.perf_counter() - start
+    return results, seconds
+
+
+def report(results, seconds) -> dict:
+    latencies = np.array([latency for latency, _, failed in results if not failed]) * 1000
+    first_tokens = np.array([t for _, t, failed in results if not failed and t is not None]) * 1000
+    summary = {
+        "requests": len(results),
+        "errors": sum(1 for *_, failed in results if failed),
+        "seconds": seconds,
+        "throughput": len(results) / seconds,
+    }
+    for name, values in (("latency_ms", latencies), ("first_token_ms", first_tokens)):
+        if len(values):
+            summary[name] = {f"p{q}": float(np.percentile(values, q)) for q in (50, 95, 99)}
+            summary[name]["max"] = float(values.max())
+    return summary
+
+
+def start_stack(args, workspace, processes):
+    """Builds a workspace and serves it with gunicorn and the fake OpenAI API (added to processes). Returns the url."""
+    from bench.workspace import build_data, workspace_env, write_settings
+
+    overrides = dict(setting.split("=", 1) for setting in args.setting)
+    overrides["server_mode"] = args.server_mode
+    settings = write_settings(workspace, overrides)
+    print(f"Building a synthetic index of {args.chunks} chunks in {workspace}...")
+    build_data(workspace, settings, args.chunks, args.dimension)
+
+    api_port = free_port()
+    fake_api = subprocess.Popen([
+        sys.executable, os.path.join(project_root, "bench", "fake_openai.py"), "--port", str(api_port),
+        "--latency", str(args.latency), "--embedding-latency", str(args.embedding_latency),
+        "--token-delay", str(args.token_delay), "--dimension", str(args.dimension),
+        "--answer-words", str(args.answer_words),
+    ] + (["--fail-verification"] if args.fail_verification else []))
+    processes.append(fake_api)
+    wait_for(f"http://127.0.0.1:{api_port}/", 30, fake_api)
+
+    port = free_port()
+    env = dict(os.environ, **workspace_env(workspace), WEB_CONCURRENCY=str(args.workers),
+               OPENAI_BASE_URL=f"http://127.0.0.1:{api_port}/v1", OPENAI_API_KEY="bench")
+    # gunicorn.conf.py in the project root picks the app for server_mode
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}"],
+                              cwd=project_root, env=env)
+    processes.append(server)
+    url = f"http://127.0.0.1:{port}"
+    wait_for(url + "/api/stats", 300, server)
+    return url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test /api/chat and report throughput and latency percentiles.")
+    parser.add_argument("--url", help="server to test; by default a gunicorn server is started on a synthetic index "
+                                      "with a fake OpenAI API")
+    parser.add_argument("--concurrency", type=int, default=50, help="simultaneous students")
+    parser.add_argument("--requests", type=int, default=1000, help="questions to ask in total")
+    parser.add_argument("--questions", type=int, default=200, help="question pool size (smaller means more repeats)")
+    parser.add_argument("--stream", action="store_true", help="use /api/chat/stream and also report time to first token")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds per request")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    started = parser.add_argument_group("started server (without --url)")
+    started.add_argument("--chunks", type=int, default=10000, help="chunks in the synthetic index")
+    started.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    started.add_argument("--server-mode", choices=("async", "sync"), default="async")
+    started.add_argument("--setting", action="append", default=[], metavar="KEY=VALUE",
+                         help="override a settings.txt entry, e.g. --setting answer_cache=no")
+    add_server_arguments(started)
+    args = parser.parse_args()
+
+    questions = make_questions(args.questions)
+    workspace = None
+    processes = []
+    url = args.url
+    try:
+        if url is None:
+            workspace = tempfile.mkdtemp(prefix="rag-bench-")
+            url = start_stack(args, workspace, processes)
+        print(f"{args.requests} requests from {args.concurrency} students against {url}...")
+        results, seconds = asyncio.run(
+            run_load(url.rstrip("/"), questions, args.concurrency, args.requests, args.stream, args.timeout)
+        )
+        summary = report(results, seconds)
+        stats = httpx.get(url.rstrip("/") + "/api/stats", timeout=10).json()
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+        if workspace:
+            shutil.rmtree(workspace)
+
+    print(f"{summary['requests']} requests, {summary['errors']} errors in {summary['seconds']:.1f} s: "
+          f"{summary['throughput']:.1f} requests/s")
+    for name in ("latency_ms", "first_token_ms"):
+        if name in summary:
+            r = summary[name]
+            print(f"  {name:<15} p50 {r['p50']:8.1f}  p95 {r['p95']:8.1f}  p99 {r['p99']:8.1f}  max {r['max']:8.1f}")
+    # /api/stats describes the one worker that answered it
+    print("  one worker:", json.dumps({key: stats.get(key) for key in ("answer_cache", "single_flight", "openai")}))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(dict(summary, worker_stats=stats), f, indent=2)
+
+if __name__ == "__main__":
+    main()
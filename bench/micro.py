@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import time
+import argparse
+import shutil
+import tempfile
+
+import numpy as np
+
+# Make the project root importable so the shared "src", "scripts" and "bench" modules resolve.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCHMARKS = ("chunk", "build", "load", "query")
+
+
+def percentiles(latencies_ms):
+    return {f"p{q}": float(np.percentile(latencies_ms, q)) for q in (50, 95, 99)}
+
+
+def bench_chunking(size: int, chunk_size: int, overlap: int) -> dict:
+    """chunk_pages() over synthetic lectures until `size` chunks have been produced."""
+    from bench.corpus import make_document
+    from src.chunking import chunk_pages
+
+    rng = np.random.default_rng(0)
+    chunks = 0
+    seconds = 0.0
+    while chunks < size:
+        document = ["\n\n".join(make_document(rng, 20))]
+        start = time.perf_counter()
+        chunks += len(chunk_pages(document, chunk_size=chunk_size, overlap=overlap, paginated=False))
+        seconds += time.perf_counter() - start
+    return {"chunks": chunks, "seconds": seconds, "chunks_per_second": chunks / seconds}
+
+
+def bench_query(engine, dimension: int, num_queries: int) -> dict:
+    """get_context_from_query() with precomputed query embeddings: search, BM25 fusion and context assembly."""
+    from bench.corpus import make_questions
+
+    questions = make_questions(num_queries, seed=1)
+    rng = np.random.default_rng(1)
+    embeddings = rng.standard_normal((num_queries, dimension)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    # The first searches fault the memory-mapped index and chunk store in; they are not timed
+    for question, embedding in zip(questions[:5], embeddings[:5]):
+        engine.get_context_from_query(question, query_embedding=embedding)
+    latencies = []
+    for question, embedding in zip(questions, embeddings):
+        start = time.perf_counter()
+        engine.get_context_from_query(question, query_embedding=embedding)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return percentiles(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Micro-benchmarks of chunking, index building, index loading and retrieval on synthetic data."
+    )
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="comma-separated chunk counts")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help="comma-separated subset of " + ",".join(BENCHMARKS))
+    parser.add_argument("--dimension", type=int, default=384, help="embedding dimension")
+    parser.add_argument("--queries", type=int, default=200, help="queries per retrieval benchmark")
+    parser.add_argument("--workspace", help="folder for the synthetic index (default: a temporary folder)")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+    selected = set(args.only.split(","))
+
+    workspace = args.workspace or tempfile.mkdtemp(prefix="rag-bench-")
+    # src.settings reads these when it is first imported, so they are set before anything imports it
+    # (bench.workspace.workspace_env() for this process)
+    os.environ["RAG_SETTINGS"] = os.path.join(workspace, "settings.txt")
+    os.environ["RAG_DATA_DIR"] = os.path.join(workspace, "data")
+    from bench.fake_openai import start_server
+    # The engine probes the embedding dimension once through the API
+    fake_api = start_server(dimension=args.dimension)
+    os.environ["OPENAI_BASE_URL"] = fake_api.base_url
+    os.environ["OPENAI_API_KEY"] = "bench"
+
+    from bench.workspace import build_data, write_settings
+    settings = write_settings(workspace)
+    from src import main as rag
+    print(f"Workspace {workspace}: {settings.get('index_type', 'flat')} index, dimension {args.dimension}, "
+          f"hybrid search {'on' if rag.hybrid_search else 'off'}")
+
+    results = []
+    for size in sizes:
+        result = {"size": size}
+        if "chunk" in selected:
+            result["chunk_pages"] = bench_chunking(size, int(settings.get("chunk_size", "240")),
+                                                   int(settings.get("chunk_overlap", "40")))
+        if selected & {"build", "load", "query"}:
+            timings = build_data(workspace, settings, size, args.dimension)
+            result["build_faiss_index"] = {"seconds": timings["build_faiss_index"]}
+            result["build_other"] = {name: seconds for name, seconds in timings.items() if name != "build_faiss_index"}
+        if selected & {"load", "query"}:
+            start = time.perf_counter()
+            index, chunk_store = rag.load_faiss_resources()
+            result["load_faiss_resources"] = {"ms": (time.perf_counter() - start) * 1000}
+            if "query" in selected:
+                engine = rag.RAGEngine(index, chunk_store, rag.load_index_info(), rag.load_bm25_index())
+                result["get_context_from_query"] = bench_query(engine, args.dimension, args.queries)
+                del engine
+            del index, chunk_store
+        results.append(result)
+        print_result(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    fake_api.shutdown()
+    if not args.workspace:
+        shutil.rmtree(workspace)
+
+
+def print_result(result: dict) -> None:
+    print(f"\n{result['size']} chunks")
+    if "chunk_pages" in result:
+        r = result["chunk_pages"]
+        print(f"  chunk_pages             {r['seconds']:9.2f} s   {r['chunks_per_second']:10.0f} chunks/s")
+    if "build_faiss_index" in result:
+        print(f"  build_faiss_index       {result['build_faiss_index']['seconds']:9.2f} s")
+    if "load_faiss_resources" in result:
+        print(f"  load_faiss_resources    {result['load_faiss_resources']['ms']:9.2f} ms")
+    if "get_context_from_query" in result:
+        r = result["get_context_from_query"]
+        print(f"  get_context_from_query  p50 {r['p50']:.2f} ms  p95 {r['p95']:.2f} ms  p99 {r['p99']:.2f} ms")
+
+if __name__ == "__main__":
+    main()
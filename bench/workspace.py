@@ -0,0 +1,97 @@
+import os
+import sys
+import json
+import time
+from typing import Dict, Optional
+
+import faiss
+import numpy as np
+
+# Make the project root importable so the shared "src" and "scripts" modules resolve.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.corpus import iter_chunk_records, make_vectors
+from scripts.create_final_data import build_faiss_index
+from src.bm25 import write_bm25_index
+from src.chunk_store import write_chunk_store
+from src.settings import project_root, read_settings
+from src.vector_index import build_params, index_config_from_settings
+
+# A benchmark workspace is a folder with its own settings.txt and data/ folder, so
+# benchmarks never touch the course index. Processes use it through the
+# RAG_SETTINGS and RAG_DATA_DIR environment variables (see src/settings.py).
+
+# Embedding model of the workspace indexes; the fake OpenAI server embeds for any model name
+BENCH_EMBEDDING_MODEL = "bench-embedding"
+
+# Settings every workspace overrides: embeddings come from the fake server, the
+# cross-encoder (a local model download) is off, and nothing persists between runs
+BENCH_SETTINGS = {
+    "embedding_method": "openai",
+    "openai_embedding_model": BENCH_EMBEDDING_MODEL,
+    "reranker": "no",
+    "embedding_cache_persist": "no",
+    "session_store_persist": "no",
+    "request_log": "no",
+}
+
+
+def workspace_env(path: str) -> Dict[str, str]:
+    """Environment variables that point a process at the workspace."""
+    return {"RAG_SETTINGS": os.path.join(path, "settings.txt"), "RAG_DATA_DIR": os.path.join(path, "data")}
+
+
+def write_settings(path: str, overrides: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """The project's settings.txt with BENCH_SETTINGS and `overrides` applied, written to the workspace."""
+    settings = read_settings(os.path.join(project_root, "settings.txt"))
+    settings.update(BENCH_SETTINGS)
+    settings.update(overrides or {})
+    os.makedirs(os.path.join(path, "data"), exist_ok=True)
+    with open(os.path.join(path, "settings.txt"), "w", encoding="utf-8") as f:
+        for key, value in settings.items():
+            f.write(f"{key}={value}\n")
+    return settings
+
+
+def build_data(path: str, settings: Dict[str, str], num_chunks: int, dimension: int,
+               words_per_chunk: int = 250) -> Dict[str, float]:
+    """
+    Writes the data a server needs for `num_chunks` synthetic chunks: the FAISS
+    index, the chunk store, the BM25 index and index_info.json. Returns the
+    seconds spent per step.
+    """
+    data_dir = os.path.join(path, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    config = index_config_from_settings(settings)
+    timings = {}
+
+    start = time.perf_counter()
+    vectors = make_vectors(num_chunks, dimension)
+    timings["vectors"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ids = np.arange(1, num_chunks + 1, dtype=np.int64)
+    index = build_faiss_index(vectors, np.arange(num_chunks, dtype=np.int64), ids, config,
+                              int(settings.get("index_block_size", "65536")))
+    timings["build_faiss_index"] = time.perf_counter() - start
+    del vectors
+
+    index_path = os.path.join(data_dir, "faiss_index.bin")
+    faiss.write_index(index, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
+    del index
+
+    start = time.perf_counter()
+    write_chunk_store(os.path.join(data_dir, "chunk_store"), iter_chunk_records(num_chunks, words_per_chunk))
+    timings["chunk_store"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    write_bm25_index(os.path.join(data_dir, "bm25_index.npz"), (
+        (record["chunk_id"], record["chunk_text"]) for record in iter_chunk_records(num_chunks, words_per_chunk)
+    ))
+    timings["bm25_index"] = time.perf_counter() - start
+
+    with open(os.path.join(data_dir, "index_info.json"), "w", encoding="utf-8") as f:
+        json.dump({"embedding_model": f"openai:{BENCH_EMBEDDING_MODEL}", "dimension": dimension,
+                   "index": build_params(config)}, f, indent=2)
+    return timings
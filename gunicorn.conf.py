@@ -0,0 +1,33 @@
+# Gunicorn settings, picked up automatically when gunicorn is started from the project root.
+import os
+
+from src.settings import read_settings
+
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+
+# server_mode=sync serves the Flask app (src/app.py) with one request per worker thread;
+# server_mode=async serves src/asgi.py on gunicorn's asyncio worker, where each worker
+# handles up to worker_connections chats at once while they wait on OpenAI.
+server_mode = read_settings().get("server_mode", "sync").lower()
+if server_mode == "async":
+    wsgi_app = "src.asgi:app"
+    worker_class = "asgi"
+    worker_connections = int(os.environ.get("WORKER_CONNECTIONS", "500"))
+else:
+    wsgi_app = "src.app:app"
+
+# Import the app in the master process before forking, so workers inherit the
+# already-opened FAISS index and chunk store instead of each loading its own.
+preload_app = True
+
+def when_ready(server):
+    # Runs in the master after the app is preloaded and before any worker is forked.
+    try:
+        if server_mode == "async":
+            from src.asgi import preload_engine
+            preload_engine()
+        else:
+            from src.app import get_engine
+            get_engine()
+    except Exception as e:
+        server.log.warning("RAG engine not preloaded: %s", e)
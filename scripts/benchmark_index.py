@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+import argparse
+import faiss
+import numpy as np
+
+# Make the project root importable so the shared "src" modules resolve.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.pipeline_data import embeddings_exist, open_embeddings
+from src.settings import data_dir, read_settings
+from src.vector_index import INDEX_TYPES, build_index, index_config_from_settings, index_size_bytes, normalize_queries
+
+def load_vectors(data_dir: str, synthetic: int, dimension: int) -> np.ndarray:
+    """
+    Embeddings from data/embeddings.npy or, when requested, `synthetic` unit vectors
+    drawn around random topic centres (real embeddings are clustered, uniform noise is not).
+    """
+    if synthetic:
+        rng = np.random.default_rng(0)
+        centres = rng.standard_normal((max(1, synthetic // 100), dimension)).astype(np.float32)
+        topics = rng.integers(0, len(centres), synthetic)
+        vectors = centres[topics] + 0.5 * rng.standard_normal((synthetic, dimension)).astype(np.float32)
+        faiss.normalize_L2(vectors)
+        return vectors
+    return np.array(open_embeddings(data_dir)[0])
+
+def make_queries(vectors: np.ndarray, num_queries: int) -> np.ndarray:
+    """Perturbed copies of random indexed vectors, standing in for real queries."""
+    rng = np.random.default_rng(1)
+    rows = rng.choice(len(vectors), min(num_queries, len(vectors)), replace=False)
+    queries = vectors[rows] + rng.normal(0, 0.01, (len(rows), vectors.shape[1])).astype(np.float32)
+    return queries.astype(np.float32)
+
+def time_search(index, queries: np.ndarray, k: int):
+    """Searches one query at a time, like the web app does. Returns (ids, per-query latencies in ms)."""
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    latencies = np.empty(len(queries))
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, ids[i:i + 1] = index.search(queries[i:i + 1], k)
+        latencies[i] = (time.perf_counter() - start) * 1000
+    return ids, latencies
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    """Fraction of the exact top-k neighbours that the index returned."""
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare FAISS index types against exact search.")
+    parser.add_argument("--types", default=",".join(INDEX_TYPES), help="comma-separated index types")
+    parser.add_argument("--metric", choices=("l2", "cosine"), help="override index_metric from settings.txt")
+    parser.add_argument("--k", type=int, default=8, help="neighbours per query (recall@k)")
+    parser.add_argument("--queries", type=int, default=500, help="number of queries")
+    parser.add_argument("--synthetic", type=int, default=0, help="benchmark N random vectors instead of data/embeddings.npy")
+    parser.add_argument("--dimension", type=int, default=1536, help="dimension of synthetic vectors")
+    args = parser.parse_args()
+
+    if not args.synthetic and not embeddings_exist(data_dir):
+        print(f"Embeddings not found in {data_dir}. Run the embedding script or pass --synthetic N.")
+        sys.exit(0)
+
+    settings = read_settings()
+    if args.metric:
+        settings['index_metric'] = args.metric
+    vectors = load_vectors(data_dir, args.synthetic, args.dimension)
+    ids = np.arange(len(vectors), dtype=np.int64)
+    queries = make_queries(vectors, args.queries)
+    print(f"{len(vectors)} vectors of dimension {vectors.shape[1]}, {len(queries)} queries, k={args.k}")
+
+    # Exact search with the same metric is the ground truth
+    flat_config = index_config_from_settings(dict(settings, index_type='flat'))
+    queries = normalize_queries(queries, flat_config['metric'])
+    truth, _ = time_search(build_index(vectors, ids, flat_config), queries, args.k)
+
+    print(f"{'index':<10} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8} {'size MB':>9} {'build s':>8}")
+    for index_type in args.types.split(','):
+        config = index_config_from_settings(dict(settings, index_type=index_type))
+        start = time.perf_counter()
+        index = build_index(vectors, ids, config)
+        build_seconds = time.perf_counter() - start
+        found, latencies = time_search(index, queries, args.k)
+        print(f"{index_type:<10} {recall_at_k(found, truth):>9.3f} {np.percentile(latencies, 50):>8.3f} "
+              f"{np.percentile(latencies, 95):>8.3f} {index_size_bytes(index) / 1e6:>9.2f} {build_seconds:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,68 +1,201 @@
 import os
-import pickle
 import faiss
 import numpy as np
 import json
 import sys
-from typing import List, Dict, Any, Tuple
+import hashlib
+from array import array
+from typing import List, Dict, Any, Iterable, Iterator, Tuple
 
-def build_faiss_index(embedded_data: List[Dict[str, Any]], embedding_dim: int) -> Tuple[faiss.IndexFlatL2, List[Dict[str, Any]]]:
+# Make the project root importable so the shared "src" modules resolve.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.bm25 import write_bm25_index
+from src.chunk_store import ChunkStore, chunk_store_exists, write_chunk_store
+from src.context_builder import chunk_body
+from src.pipeline_data import embeddings_exist, iter_chunks, open_embeddings
+from src.settings import data_dir, read_settings
+from src.vector_index import add_vectors, build_index, build_params, index_config_from_settings
+
+def make_metadata(record: Dict[str, Any], chunk_id: int, sources: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Metadata kept for each indexed chunk."""
+    return {
+        'chunk_id': chunk_id,
+        'filename': record['filename'],
+        'chunk_index': record['chunk_index'],
+        'chunk_text': record['chunk_text'],
+        'page': record['page'],
+        'page_end': record['page_end'],
+        'sources': sources
+    }
+
+def content_id(text: str) -> int:
+    """Stable, positive 63-bit FAISS id derived from chunk content."""
+    return int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'big') & ((1 << 63) - 1)
+
+def source_of(record: Dict[str, Any]) -> Dict[str, Any]:
+    return {'filename': record['filename'], 'chunk_index': record['chunk_index'],
+            'chunk_id': record['chunk_id'], 'page': record['page']}
+
+def collapse_duplicates(chunks: Iterable[Dict[str, Any]], embedding_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray, Dict[int, list]]:
+    """
+    Finds chunks with identical content (e.g. repeated across lecture revisions
+    or duplicated handouts), which share one vector under a content id. The
+    first occurrence provides the text and vector. Streams the chunks and
+    returns (rows of first occurrences, their content ids, {content id: sources
+    of the later occurrences}). Raises ValueError if the chunks no longer match
+    the rows of the embeddings file.
+    """
+    first_rows = array('q')
+    ids = array('q')
+    seen = set()
+    duplicates = {}
+    row = -1
+    for row, record in enumerate(chunks):
+        if row >= len(embedding_ids) or embedding_ids[row] != record['chunk_id']:
+            raise ValueError("chopped_text.csv changed since the embeddings were written. Re-run embed_documents.py.")
+        cid = content_id(chunk_body(record))
+        if cid in seen:
+            duplicates.setdefault(cid, []).append(source_of(record))
+        else:
+            seen.add(cid)
+            first_rows.append(row)
+            ids.append(cid)
+    if row + 1 != len(embedding_ids):
+        raise ValueError("chopped_text.csv changed since the embeddings were written. Re-run embed_documents.py.")
+    return np.array(first_rows, dtype=np.int64), np.array(ids, dtype=np.int64), duplicates
+
+def iter_metadata(chunks: Iterable[Dict[str, Any]], first_rows: np.ndarray, ids: np.ndarray,
+                  duplicates: Dict[int, list]) -> Iterator[Dict[str, Any]]:
+    """Streams the metadata records of the distinct chunks, in row order."""
+    is_first = np.zeros(first_rows[-1] + 1 if len(first_rows) else 0, dtype=bool)
+    is_first[first_rows] = True
+    position = 0
+    for row, record in enumerate(chunks):
+        if row < len(is_first) and is_first[row]:
+            cid = int(ids[position])
+            position += 1
+            yield make_metadata(record, cid, [source_of(record)] + duplicates.get(cid, []))
+
+def build_faiss_index(vectors: np.ndarray, first_rows: np.ndarray, ids: np.ndarray, config: Dict[str, Any], block_size: int):
+    """
+    Builds a FAISS index of the configured type (flat, IVF-Flat, IVF-PQ or HNSW;
+    L2 or cosine) from the given rows of the memory-mapped embeddings, adding
+    them block_size rows at a time.
+    Vectors are stored under their stable chunk ids, so later runs can update the index in place.
     """
-    Builds a FAISS index (using L2 distance) from the embedded data.
-    Returns:
-      - A FAISS index containing all embeddings.
-      - A metadata list with each record's 'filename', 'chunk_index', and 'chunk_text'.
+    return build_index(vectors, ids, config, rows=first_rows, block_size=block_size)
+
+def update_faiss_index(index: Any, old_ids: np.ndarray, vectors: np.ndarray, first_rows: np.ndarray,
+                       ids: np.ndarray, config: Dict[str, Any], block_size: int) -> Any:
+    """
+    Upserts the embedded chunks into an existing index: chunks that disappeared
+    are removed and new ones are added. Ids are derived from chunk content, so
+    a kept id always has the same vector. Raises RuntimeError for index types
+    that cannot remove vectors (HNSW).
+    """
+    stale = np.setdiff1d(old_ids, ids)
+    fresh = ~np.isin(ids, old_ids)
+    if len(stale):
+        index.remove_ids(stale)
+    if fresh.any():
+        add_vectors(index, vectors, ids[fresh], config['metric'], rows=first_rows[fresh], block_size=block_size)
+    print(f"Removed {len(stale)} and added {int(fresh.sum())} vectors.")
+    return index
+
+def load_existing_index(faiss_index_path: str, chunk_store_prefix: str, index_info_path: str,
+                        embedding_model: str, embedding_dim: int, config: Dict[str, Any]):
+    """
+    Returns (index, chunk ids) of the previous build if it can be updated in place,
+    i.e. it was built with the same embedding model and index parameters; else None.
     """
-    vectors = []
-    metadata = []
-    for record in embedded_data:
-        # Convert the embedding to a float32 numpy array for FAISS
-        embedding = np.array(record['embedding'], dtype=np.float32)
-        vectors.append(embedding)
-        metadata.append({
-            'filename': record['filename'],
-            'chunk_index': record['chunk_index'],
-            'chunk_text': record['chunk_text']
-        })
-    vectors_np = np.vstack(vectors)
-    index = faiss.IndexFlatL2(embedding_dim)
-    index.add(vectors_np)
-    return index, metadata
+    if not os.path.exists(faiss_index_path) or not os.path.exists(index_info_path):
+        return None
+    if not chunk_store_exists(chunk_store_prefix):
+        return None
+    with open(index_info_path, 'r', encoding='utf-8') as f:
+        info = json.load(f)
+    if info.get('embedding_model') != embedding_model or info.get('dimension') != embedding_dim:
+        return None
+    if info.get('index') != build_params(config):
+        return None
+    index = faiss.read_index(faiss_index_path)
+    if not isinstance(index, (faiss.IndexIDMap, faiss.IndexIVF)):
+        return None
+    return index, np.array(ChunkStore(chunk_store_prefix).ids)
 
 def main():
-    # Define paths assuming this script is inside the 'scripts/' folder.
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    data_dir = os.path.join(base_dir, 'data')
-    embedded_data_path = os.path.join(data_dir, 'embedded_data.pkl')
+    # Data folder of the project, or RAG_DATA_DIR
+    chopped_csv_path = os.path.join(data_dir, 'chopped_text.csv')
     faiss_index_path = os.path.join(data_dir, 'faiss_index.bin')
-    metadata_path = os.path.join(data_dir, 'faiss_metadata.json')
+    chunk_store_prefix = os.path.join(data_dir, 'chunk_store')
+    legacy_metadata_path = os.path.join(data_dir, 'faiss_metadata.json')
+    index_info_path = os.path.join(data_dir, 'index_info.json')
+    bm25_index_path = os.path.join(data_dir, 'bm25_index.npz')
 
-    if not os.path.exists(embedded_data_path):
-        print(f"Embedded data not found at {embedded_data_path}. Please run the embedding script first.")
+    settings = read_settings()
+    config = index_config_from_settings(settings)
+    # Vectors are read from the memory-mapped embeddings and added to the index this many at a time
+    block_size = int(settings.get("index_block_size", "65536"))
+
+    # Pass --full to rebuild the index from scratch instead of updating it in place.
+    full_rebuild = '--full' in sys.argv[1:]
+
+    if not embeddings_exist(data_dir) or not os.path.exists(chopped_csv_path):
+        print(f"Embeddings not found in {data_dir}. Please run the embedding script first.")
         sys.exit(0)
 
-    # Load the embedded data
-    with open(embedded_data_path, 'rb') as f:
-        embedded_data = pickle.load(f)
-    if not embedded_data:
+    # Memory-map the embeddings; rows are only read when they are added to the index
+    vectors, embedding_ids, embeddings_info = open_embeddings(data_dir)
+    if not len(vectors):
         print("No embedded data found. Exiting.")
         sys.exit(0)
-
-    # Determine the embedding dimension from the first record
-    first_embedding = embedded_data[0]['embedding']
-    embedding_dim = len(first_embedding)
+    embedding_dim = embeddings_info['dimension']
+    embedding_model = embeddings_info['embedding_model']
     print("Detected embedding dimension:", embedding_dim)
 
-    # Build the FAISS index and generate metadata
-    faiss_index, metadata_list = build_faiss_index(embedded_data, embedding_dim)
-    print(f"FAISS index built with {len(metadata_list)} vectors.")
+    # Collapse duplicate chunks into a single vector
+    try:
+        first_rows, ids, duplicates = collapse_duplicates(iter_chunks(chopped_csv_path), embedding_ids)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    print(f"{len(vectors)} chunks, {len(ids)} after collapsing duplicates.")
 
-    # Save the FAISS index and metadata to the data folder
-    faiss.write_index(faiss_index, faiss_index_path)
-    with open(metadata_path, 'w', encoding='utf-8') as f:
-        json.dump(metadata_list, f, ensure_ascii=False, indent=2)
+    # Build the FAISS index, updating the previous index when possible
+    existing = None
+    if not full_rebuild:
+        existing = load_existing_index(faiss_index_path, chunk_store_prefix, index_info_path,
+                                       embedding_model, embedding_dim, config)
+    faiss_index = None
+    if existing is not None:
+        try:
+            faiss_index = update_faiss_index(existing[0], existing[1], vectors, first_rows, ids, config, block_size)
+            print(f"FAISS index updated to {faiss_index.ntotal} vectors.")
+        except RuntimeError as e:
+            print(f"Cannot update the {config['type']} index in place ({e}); rebuilding.")
+    if faiss_index is None:
+        faiss_index = build_faiss_index(vectors, first_rows, ids, config, block_size)
+        print(f"FAISS {config['type']} index built with {faiss_index.ntotal} vectors.")
+
+    # Save the FAISS index and the memory-mappable chunk store to the data folder
+    # Write to a temporary file and rename, so serving processes that memory-map the old index are unaffected
+    faiss.write_index(faiss_index, faiss_index_path + '.tmp')
+    os.replace(faiss_index_path + '.tmp', faiss_index_path)
+    # The metadata streams from the CSV into the chunk store and the BM25 index
+    write_chunk_store(chunk_store_prefix, iter_metadata(iter_chunks(chopped_csv_path), first_rows, ids, duplicates))
+    # The BM25 inverted index is cheap to build, so it is always rebuilt from the full chunk list
+    write_bm25_index(bm25_index_path, (
+        (record['chunk_id'], record['chunk_text'])
+        for record in iter_metadata(iter_chunks(chopped_csv_path), first_rows, ids, duplicates)
+    ))
+    if os.path.exists(legacy_metadata_path):
+        os.remove(legacy_metadata_path)
+    with open(index_info_path, 'w', encoding='utf-8') as f:
+        json.dump({'embedding_model': embedding_model, 'dimension': embedding_dim,
+                   'index': build_params(config)}, f, indent=2)
 
     print("FAISS index and metadata saved successfully!")
-    
+
 if __name__ == "__main__":
     main()
@@ -1,105 +1,227 @@
 import os
-import csv
-import pickle
 import sys
 import time
+import random
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
 import openai
 import numpy as np
 from dotenv import load_dotenv
 
-def read_chopped_csv(csv_path: str):
+# Make the project root importable so the shared "src" modules resolve.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.context_builder import chunk_body
+from src.embeddings import OpenAIEmbedder, get_embedder
+from src.pipeline_data import EmbeddingsWriter, count_chunks, iter_chunks
+from src.settings import data_dir, read_settings
+from src.tokens import count_tokens
+
+class EmbeddingStore:
+    """
+    Persistent embedding store keyed by a hash of the embedding model and the
+    chunk content, so identical chunks are embedded only once across files and
+    across runs. Content excludes the document-title prefix: a handout copied
+    under another name reuses the vector embedded for its first title, which is
+    also the vector create_final_data.py keeps when collapsing duplicates.
+    """
+
+    def __init__(self, sqlite_path: str, model_name: str):
+        self.model_name = model_name
+        self.db = sqlite3.connect(sqlite_path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x00{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, keys) -> dict:
+        """Returns {key: embedding} for the keys present in the store."""
+        found = {}
+        keys = list(keys)
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, items) -> None:
+        self.db.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+            [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items],
+        )
+        self.db.commit()
+
+class TokenBucket:
     """
-    Reads chunked data from a CSV file.
-    Returns a list of dicts, each with keys:
-      'filename', 'chunk_index', 'chunk_text'
+    Token-bucket rate limiter: allows tokens_per_minute tokens per minute,
+    with bursts of up to one minute's worth.
     """
-    data = []
-    with open(csv_path, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            data.append({
-                'filename': row['filename'],
-                'chunk_index': int(row['chunk_index']),
-                'chunk_text': row['chunk_text']
-            })
-    return data
-
-def embed_with_openai(texts, model: str, max_tokens_per_batch: int):
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> None:
+        """Blocks until `tokens` tokens are available and takes them."""
+        tokens = min(float(tokens), self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.available >= tokens:
+                    self.available -= tokens
+                    return
+                wait = (tokens - self.available) / self.rate
+            time.sleep(wait)
+
+def make_batches(texts, max_tokens_per_batch: int, max_inputs_per_batch: int = 2048):
     """
-    Batches texts based on a simple token count (words) and sends them to OpenAI's API.
-    Uses openai.embeddings.create with the new API.
+    Groups texts into batches of at most max_tokens_per_batch model tokens
+    (and max_inputs_per_batch inputs). Yields (start_index, batch_texts, token_count).
     """
-    def count_tokens(text: str) -> int:
-        return len(text.split())
-    
-    embeddings = []
     batch = []
+    start = 0
     current_tokens = 0
-    for text in texts:
+    for i, text in enumerate(texts):
         tokens = count_tokens(text)
-        if current_tokens + tokens > max_tokens_per_batch:
-            response = openai.embeddings.create(model=model, input=batch)
-            # Access the embedding attribute from each item
-            embeddings.extend([item.embedding for item in response.data])
+        if batch and (current_tokens + tokens > max_tokens_per_batch or len(batch) >= max_inputs_per_batch):
+            yield start, batch, current_tokens
             batch = []
+            start = i
             current_tokens = 0
-            print("Waiting 60 seconds before sending next batch...")
-            time.sleep(60)
         batch.append(text)
         current_tokens += tokens
     if batch:
-        response = openai.embeddings.create(model=model, input=batch)
-        embeddings.extend([item.embedding for item in response.data])
-    return embeddings
+        yield start, batch, current_tokens
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+def embed_batch(client: openai.OpenAI, batch, model: str, max_retries: int = 8, base_delay: float = 1.0):
+    """
+    Embeds one batch, retrying 429s and transient errors with exponential backoff
+    and jitter. The client must not retry on its own (max_retries=0), or every
+    attempt here would hide up to three requests that bypass the backoff.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            response = client.embeddings.create(model=model, input=batch)
+            return [item.embedding for item in response.data]
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = min(60.0, base_delay * 2 ** attempt) * (0.5 + random.random())
+            print(f"{type(e).__name__}; retrying batch in {delay:.1f}s")
+            time.sleep(delay)
+
+def embed_with_openai(client: openai.OpenAI, texts, model: str, max_tokens_per_batch: int, bucket: TokenBucket,
+                      max_in_flight: int = 4):
+    """
+    Embeds texts with OpenAI's API using up to max_in_flight concurrent requests.
+    Batches are sized with the model's tokenizer and throttled by `bucket`; the
+    caller shares both with the client across calls. Returns a float32 matrix in
+    input order.
+    """
+    parts = {}
+
+    def run(start, batch, tokens):
+        bucket.acquire(tokens)
+        parts[start] = np.array(embed_batch(client, batch, model), dtype=np.float32)
+        return len(batch)
+
+    done = 0
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        futures = [pool.submit(run, *batch) for batch in make_batches(texts, max_tokens_per_batch)]
+        for future in as_completed(futures):
+            done += future.result()
+            print(f"Embedded {done}/{len(texts)} chunks ({time.monotonic() - started:.1f}s)")
+    return np.concatenate([parts[start] for start in sorted(parts)])
 
 def main():
     # Load environment variables from .env
     load_dotenv()
-    openai.api_key = os.getenv("OPENAI_API_KEY")
-    if not openai.api_key:
-        print("OPENAI_API_KEY not found in .env file. Exiting.")
-        sys.exit(1)
+    settings = read_settings()
+    embedder = get_embedder(settings)
+    if isinstance(embedder, OpenAIEmbedder):
+        openai.api_key = os.getenv("OPENAI_API_KEY")
+        if not openai.api_key:
+            print("OPENAI_API_KEY not found in .env file. Exiting.")
+            sys.exit(1)
     
-    # Define directories (assumes this script is placed in the 'scripts/' folder)
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    data_dir = os.path.join(base_dir, "data")
+    # Data folder of the project, or RAG_DATA_DIR
     chopped_csv_path = os.path.join(data_dir, "chopped_text.csv")
-    output_pickle_path = os.path.join(data_dir, "embedded_data.pkl")
+    legacy_pickle_path = os.path.join(data_dir, "embedded_data.pkl")
     
     if not os.path.exists(chopped_csv_path):
         print(f"Chopped CSV file not found: {chopped_csv_path}. Exiting.")
         sys.exit(0)
     
-    # Read the chopped text data from CSV
-    data = read_chopped_csv(chopped_csv_path)
-    if not data:
+    total = count_chunks(chopped_csv_path)
+    if not total:
         print("No data found in CSV. Exiting.")
         sys.exit(0)
     
-    texts = [d['chunk_text'] for d in data]
-    
-    # Set embedding parameters
-    model_name = "text-embedding-ada-002"
-    max_tokens_per_batch = 100000
-    
-    print("Generating embeddings using OpenAI model:", model_name)
-    embeddings = embed_with_openai(texts, model=model_name, max_tokens_per_batch=max_tokens_per_batch)
+    # Chunks stream from the CSV in blocks; each block's vectors go straight into data/embeddings.npy
+    block_size = int(settings.get("embedding_block_size", "10000"))
+    store = EmbeddingStore(os.path.join(data_dir, "embedding_store.sqlite"), embedder.name)
+    writer = EmbeddingsWriter(data_dir, total, embedder.dimension)
+    print("Generating embeddings using", embedder.name)
     
-    # Attach embeddings back to the data records
-    for i, emb in enumerate(embeddings):
-        data[i]['embedding'] = emb
+    # One rate limit for the whole run, however many blocks it takes. The client's own retries
+    # are off: embed_batch retries with backoff that respects the rate limit instead.
+    bucket = TokenBucket(int(settings.get("embedding_tokens_per_minute", "1000000")))
+    client = openai.OpenAI(api_key=openai.api_key, max_retries=0) if isinstance(embedder, OpenAIEmbedder) else None
+    chunks = iter_chunks(chopped_csv_path)
+    start = 0
+    embedded = 0
+    while True:
+        block = list(islice(chunks, block_size))
+        if not block:
+            break
+        # Identical chunk contents (across files and runs) are looked up in the store and embedded at most once
+        keys = [store.key(chunk_body(record)) for record in block]
+        known = store.get_many(set(keys))
+        pending = {}
+        for key, record in zip(keys, block):
+            if key not in known:
+                pending.setdefault(key, record['chunk_text'])
+        texts = list(pending.values())
+        if texts:
+            if isinstance(embedder, OpenAIEmbedder):
+                vectors = embed_with_openai(
+                    client,
+                    texts,
+                    model=embedder.model,
+                    max_tokens_per_batch=int(settings.get("max_tokens_per_batch", "250000")),
+                    bucket=bucket,
+                    max_in_flight=int(settings.get("embedding_max_in_flight", "4")),
+                )
+            else:
+                # Local models encode in batches of embedding_batch_size in a single call
+                vectors = embedder.embed(texts)
+            store.put_many(zip(pending.keys(), vectors))
+            known.update(zip(pending.keys(), vectors))
+            embedded += len(texts)
+        writer.write(start, np.stack([known[key] for key in keys]), [record['chunk_id'] for record in block])
+        start += len(block)
+        print(f"{start}/{total} chunks written, {embedded} newly embedded")
     
-    # Save the resulting data to a pickle file
-    os.makedirs(data_dir, exist_ok=True)
-    with open(output_pickle_path, 'wb') as f:
-        pickle.dump(data, f)
+    writer.close(embedder.name)
+    # embedded_data.pkl held the same vectors as Python lists before data/embeddings.npy replaced it
+    if os.path.exists(legacy_pickle_path):
+        os.remove(legacy_pickle_path)
     
-    print(f"Successfully wrote embeddings to {output_pickle_path}")
-    print("Sample record:", data[0])
+    print(f"Successfully wrote {total} embeddings to {os.path.join(data_dir, 'embeddings.npy')}")
     print("Done!")
 
 if __name__ == "__main__":
     main()
-
-
-
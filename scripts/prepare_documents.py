@@ -1,59 +1,259 @@
 import os
-import re
 import csv
 import glob
 import sys
+import json
+import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 import PyPDF2
 import docx
 
-def extract_text_from_pdf(pdf_path: str) -> str:
-    """Extract text from a PDF file using PyPDF2."""
-    text_content = []
+# Make the project root importable so the shared "src" modules resolve.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.chunking import chunk_pages
+from src.embeddings import get_embedder
+from src.settings import data_dir, read_settings
+
+def extract_pdf_pages(pdf_path: str, start: int = 0, end: int = None) -> list:
+    """Extract the text of pages [start, end) of a PDF file using PyPDF2, one string per page."""
     with open(pdf_path, 'rb') as file:
         reader = PyPDF2.PdfReader(file)
-        for page in reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text_content.append(page_text)
-    return "\n".join(text_content)
+        pages = reader.pages[start:end] if end is not None else reader.pages[start:]
+        return [page.extract_text() or "" for page in pages]
+
+def count_pdf_pages(pdf_path: str) -> int:
+    with open(pdf_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
 
 def extract_text_from_docx(docx_path: str) -> str:
-    """Extract text from a DOCX file using python-docx."""
+    """
+    Extract text from a DOCX file using python-docx. Paragraphs are separated
+    by blank lines and headings are marked Markdown-style ("## Title"), so the
+    chunker can see the document's structure.
+    """
     doc = docx.Document(docx_path)
-    paragraphs = [para.text for para in doc.paragraphs if para.text]
-    return "\n".join(paragraphs)
+    paragraphs = []
+    for para in doc.paragraphs:
+        if not para.text.strip():
+            continue
+        style = para.style.name if para.style is not None else ""
+        level = style[len("Heading "):] if style.startswith("Heading ") else ""
+        if level.isdigit():
+            paragraphs.append("#" * min(int(level), 6) + " " + para.text.strip())
+        elif style == "Title":
+            paragraphs.append("# " + para.text.strip())
+        else:
+            paragraphs.append(para.text)
+    return "\n\n".join(paragraphs)
 
 def extract_text_from_txt(txt_path: str) -> str:
     """Extract text from a TXT file."""
     with open(txt_path, 'r', encoding='utf-8', errors='ignore') as f:
         return f.read()
 
-def chunk_text(text: str, chunk_size: int = 200, overlap: int = 100, title: str = "") -> list:
+def chunk_document(pages: list, filename: str, chunk_size: int, overlap: int, embedder) -> list:
     """
-    Splits text into overlapping chunks.
-    Each chunk is optionally prefixed with the document title.
+    Splits a document's pages into chunks of about chunk_size tokens of the
+    embedding model (see src/chunking.py). Each chunk is prefixed with the
+    document title, and chunks are kept short enough that the prefixed text
+    fits the model's input. Returns (chunk_text, page, page_end) tuples; pages
+    are blank for files without pages.
     """
-    words = text.split()
+    paginated = os.path.splitext(filename)[1].lower() == '.pdf'
+    prefix = f"Document: {filename}. "
+    chunk_size = max(1, min(chunk_size, embedder.max_tokens - embedder.count_tokens(prefix)))
     chunks = []
-    start = 0
-    while start < len(words):
-        chunk_words = words[start:start + chunk_size]
-        chunk = " ".join(chunk_words)
-        if title:
-            chunk = f"Document: {title}. " + chunk
-        chunks.append(chunk)
-        start += chunk_size - overlap
+    for chunk in chunk_pages(pages, chunk_size=chunk_size, overlap=min(overlap, chunk_size // 2),
+                             paginated=paginated, count=embedder.count_tokens):
+        page = chunk["page"] if chunk["page"] is not None else ""
+        page_end = chunk["page_end"] if chunk["page_end"] is not None else ""
+        chunks.append((prefix + chunk["text"], page, page_end))
     return chunks
 
+def file_sha256(path: str) -> str:
+    """Content hash of a file, used to detect changed documents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def make_chunk_id(rel_path: str, chunk_index: int) -> int:
+    """Stable, positive 63-bit FAISS id for a chunk of a document."""
+    digest = hashlib.sha1(f"{rel_path}:{chunk_index}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') & ((1 << 63) - 1)
+
+def load_manifest(manifest_path: str) -> dict:
+    """
+    Loads the document manifest: the chunking parameters of the last run and,
+    per document path, its content hash.
+    """
+    if not os.path.exists(manifest_path):
+        return {"chunking": None, "files": {}}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def extract_pages(fpath: str, start: int = 0, end: int = None) -> list:
+    """
+    Extract the text of a PDF, DOCX or TXT file as a list of pages. Only PDFs
+    have pages; [start, end) selects a page range of a PDF. DOCX and TXT files
+    are returned as a single page.
+    """
+    ext = os.path.splitext(fpath)[1].lower()
+    if ext == '.pdf':
+        return extract_pdf_pages(fpath, start, end)
+    if ext == '.docx':
+        return [extract_text_from_docx(fpath)]
+    if ext == '.txt':
+        return [extract_text_from_txt(fpath)]
+    return []
+
+def run_extraction_task(task: tuple) -> tuple:
+    """
+    Extracts one (path, start, end) task, in a worker process or inline.
+    Returns (path, start, pages, error, seconds); errors are returned rather
+    than raised, so one corrupt file does not abort the run.
+    """
+    fpath, start, end = task
+    started = time.perf_counter()
+    try:
+        return fpath, start, extract_pages(fpath, start, end), None, time.perf_counter() - started
+    except Exception as e:
+        return fpath, start, None, f"{type(e).__name__}: {e}", time.perf_counter() - started
+
+def make_extraction_tasks(fpath: str, pages_per_task: int) -> list:
+    """Splits large PDFs into page ranges that are extracted in parallel; other files are one task."""
+    if os.path.splitext(fpath)[1].lower() != '.pdf':
+        return [(fpath, 0, None)]
+    num_pages = count_pdf_pages(fpath)
+    if num_pages <= pages_per_task:
+        return [(fpath, 0, None)]
+    return [(fpath, start, min(start + pages_per_task, num_pages)) for start in range(0, num_pages, pages_per_task)]
+
+def extract_documents(paths: list, workers: int, pages_per_task: int, on_document) -> dict:
+    """
+    Extracts the pages of every path, using a pool of worker processes when
+    workers > 1, and prints progress. on_document(path, pages) is called as
+    soon as all pages of a document are in, so finished documents are not
+    kept in memory. Returns {path: error} for the documents that failed.
+    """
+    tasks = []
+    errors = {}
+    for fpath in paths:
+        try:
+            tasks.extend(make_extraction_tasks(fpath, pages_per_task))
+        except Exception as e:
+            errors[fpath] = f"{type(e).__name__}: {e}"
+            print(f"Failed: {fpath} ({errors[fpath]})")
+    if not tasks:
+        return errors
+
+    parts = {}
+    tasks_per_file = {}
+    for fpath, _, _ in tasks:
+        tasks_per_file[fpath] = tasks_per_file.get(fpath, 0) + 1
+    split_files = {fpath for fpath, count in tasks_per_file.items() if count > 1}
+    started = time.perf_counter()
+    def record(result, done):
+        fpath, start, pages, error, seconds = result
+        if error is not None:
+            errors.setdefault(fpath, error)
+            parts.pop(fpath, None)
+            print(f"[{done}/{len(tasks)}] Failed: {fpath} ({error})")
+            return
+        page_range = f" pages {start + 1}-{start + len(pages)}" if fpath in split_files else ""
+        print(f"[{done}/{len(tasks)}] Extracted: {fpath}{page_range} in {seconds:.1f}s")
+        if fpath in errors:
+            return
+        parts.setdefault(fpath, {})[start] = pages
+        if len(parts[fpath]) == tasks_per_file[fpath]:
+            by_start = parts.pop(fpath)
+            on_document(fpath, [page for start in sorted(by_start) for page in by_start[start]])
+
+    if workers > 1 and len(tasks) > 1:
+        done = 0
+        pending = tasks
+        pool_size = min(workers, len(tasks))
+        while pending:
+            # A worker that dies (e.g. killed for running out of memory) breaks its pool, and every
+            # task not finished by then comes back as BrokenProcessPool
+            unfinished = set()
+            with ProcessPoolExecutor(max_workers=pool_size) as pool:
+                futures = {pool.submit(run_extraction_task, task): task for task in pending}
+                for future in as_completed(futures):
+                    task = futures[future]
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        unfinished.add(task)
+                        continue
+                    except Exception as e:
+                        result = (task[0], task[1], None, f"{type(e).__name__}: {e}", 0.0)
+                    done += 1
+                    record(result, done)
+            pending = [task for task in pending if task in unfinished]
+            if not pending:
+                break
+            if pool_size > 1:
+                # Any of the running tasks may have killed the worker, so the rest run one at a time
+                print(f"A worker process died; extracting the remaining {len(pending)} task(s) one at a time")
+                pool_size = 1
+            else:
+                # With a single worker tasks run in order, so the first unfinished one killed it
+                fpath, start, _ = pending.pop(0)
+                done += 1
+                record((fpath, start, None, "BrokenProcessPool: the worker process died", 0.0), done)
+    else:
+        for done, task in enumerate(tasks, start=1):
+            record(run_extraction_task(task), done)
+    print(f"Extracted {len(tasks)} tasks from {len(paths)} documents in {time.perf_counter() - started:.1f}s "
+          f"with {workers if workers > 1 else 1} worker(s)")
+    return errors
+
+# Bumped whenever extraction output changes, so older cached text is extracted again
+EXTRACTION_VERSION = 2
+
+def load_cached_pages(cache_dir: str, digest: str):
+    """Pages extracted from a file with this content hash in an earlier run, or None."""
+    path = os.path.join(cache_dir, f"{digest}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        cached = json.load(f)
+    if cached.get("version") != EXTRACTION_VERSION:
+        return None
+    return cached["pages"]
+
+def save_cached_pages(cache_dir: str, digest: str, pages: list) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{digest}.json")
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({"version": EXTRACTION_VERSION, "pages": pages}, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+
 def main():
     # Set directories relative to the project base directory.
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     documents_dir = os.path.join(base_dir, "documents")
-    output_csv_path = os.path.join(base_dir, "data", "chopped_text.csv")
+    output_csv_path = os.path.join(data_dir, "chopped_text.csv")
+    # Extracted text is cached per content hash, so re-chunking never re-reads unchanged documents
+    extraction_cache_dir = os.path.join(data_dir, "extracted")
+
+    # extraction_workers=0 uses every core; 1 extracts in this process
+    settings = read_settings()
+    workers = int(settings.get("extraction_workers", "0")) or os.cpu_count() or 1
+    pages_per_task = int(settings.get("pdf_pages_per_task", "50"))
 
-    # Define chunking parameters.
-    chunk_size = 200
-    overlap = 100
+    # Chunk size and overlap in tokens of the embedding model, which must read a whole chunk
+    chunk_size = int(settings.get("chunk_size", "240"))
+    overlap = int(settings.get("chunk_overlap", "40"))
+    embedder = get_embedder(settings)
+    if chunk_size > embedder.max_tokens:
+        print(f"Warning: chunk_size={chunk_size} exceeds the {embedder.max_tokens}-token input of "
+              f"{embedder.name}; chunks are capped at {embedder.max_tokens} tokens.")
 
     # Gather PDF, DOCX, and TXT files recursively from the documents directory.
     file_patterns = [
@@ -69,36 +269,76 @@ def main():
         print(f"No documents found in {documents_dir}. Exiting.")
         sys.exit(0)
 
-    # Process each file and chunk its text.
-    all_chunks = []  # Stores tuples: (filename, chunk_index, chunk_text)
+    # The manifest records what the last run chunked, so removed documents can be reported. Every
+    # document is re-chunked on each run; reruns are incremental because unchanged documents are
+    # read from the extraction cache, and chunking the cached text is cheap.
+    manifest_path = os.path.join(data_dir, "manifest.json")
+    manifest = load_manifest(manifest_path)
+    chunking = {"chunker": "structured", "tokenizer": embedder.name, "chunk_size": chunk_size, "overlap": overlap}
+
+    # Hash every document and extract the ones whose text is not cached yet.
+    files = sorted(files)
+    digests = {}
+    to_extract = []
+    failed = {}
     for fpath in files:
-        ext = os.path.splitext(fpath)[1].lower()
-        print(f"Processing: {fpath}")
-        text = ""
-        if ext == '.pdf':
-            text = extract_text_from_pdf(fpath)
-        elif ext == '.docx':
-            text = extract_text_from_docx(fpath)
-        elif ext == '.txt':
-            text = extract_text_from_txt(fpath)
-        else:
+        try:
+            digests[fpath] = file_sha256(fpath)
+        except OSError as e:
+            failed[fpath] = str(e)
+            print(f"Failed: {fpath} ({e})")
             continue
+        if load_cached_pages(extraction_cache_dir, digests[fpath]) is None:
+            to_extract.append(fpath)
+    failed.update(extract_documents(
+        to_extract, workers, pages_per_task,
+        lambda fpath, pages: save_cached_pages(extraction_cache_dir, digests[fpath], pages),
+    ))
 
-        # Normalize whitespace.
-        text = re.sub(r'\s+', ' ', text).strip()
-        filename_only = os.path.basename(fpath)
-        chunks = chunk_text(text, chunk_size=chunk_size, overlap=overlap, title=filename_only)
-        for i, chunk in enumerate(chunks):
-            all_chunks.append((filename_only, i, chunk))
-
-    # Ensure the output directory exists and write all chunks to CSV.
+    # Chunk one document at a time from the cached text and stream the chunks to the CSV.
     os.makedirs(os.path.dirname(output_csv_path), exist_ok=True)
-    with open(output_csv_path, 'w', encoding='utf-8', newline='') as csvfile:
+    files_manifest = {}
+    total_chunks = 0
+    with open(output_csv_path + '.tmp', 'w', encoding='utf-8', newline='') as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerow(["filename", "chunk_index", "chunk_text"])
-        writer.writerows(all_chunks)
+        writer.writerow(["chunk_id", "filename", "chunk_index", "chunk_text", "page", "page_end"])
+        for fpath in files:
+            if fpath not in digests or fpath in failed:
+                # The document is left out and retried on the next run
+                continue
+            rel_path = os.path.relpath(fpath, documents_dir)
+            digest = digests[fpath]
+            print(f"Processing: {fpath}")
+            filename_only = os.path.basename(fpath)
+            pages = load_cached_pages(extraction_cache_dir, digest)
+            chunks = chunk_document(pages, filename_only, chunk_size, overlap, embedder)
+            for i, (chunk, page, page_end) in enumerate(chunks):
+                writer.writerow((make_chunk_id(rel_path, i), filename_only, i, chunk, page, page_end))
+            total_chunks += len(chunks)
+            # Chunk ids are derived from the path and index, so they need no record here
+            files_manifest[rel_path] = {"sha256": digest}
+    os.replace(output_csv_path + '.tmp', output_csv_path)
+
+    failed_paths = {os.path.relpath(fpath, documents_dir) for fpath in failed}
+    for rel_path in sorted(set(manifest["files"]) - set(files_manifest) - failed_paths):
+        print(f"Removed: {rel_path}")
+
+    # Drop cached text of documents that no longer exist in this form
+    if os.path.isdir(extraction_cache_dir):
+        current = {f"{digest}.json" for digest in digests.values()}
+        for name in os.listdir(extraction_cache_dir):
+            if name not in current:
+                os.remove(os.path.join(extraction_cache_dir, name))
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({"chunking": chunking, "files": files_manifest}, f, ensure_ascii=False, indent=2)
 
-    print(f"Done! Wrote {len(all_chunks)} chunks to {output_csv_path}")
+    print(f"Done! Wrote {total_chunks} chunks of {len(files_manifest)} documents to {output_csv_path} "
+          f"({len(set(to_extract) - set(failed))} extracted, the rest read from the cache)")
+    if failed:
+        print(f"{len(failed)} document(s) could not be extracted:")
+        for fpath, error in sorted(failed.items()):
+            print(f"  {fpath}: {error}")
 
 if __name__ == "__main__":
     main()
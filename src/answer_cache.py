@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+
+class AnswerCache:
+    """
+    Semantic cache of verified replies. Entries are stored with the embedding
+    of the question in a small FAISS index of their own; a lookup returns the
+    reply of the nearest cached question with the same question_type when it
+    lies within max_distance (squared L2) and was answered against the same
+    version of the course index. Entries expire after ttl seconds and the
+    least recently used ones are evicted beyond max_size.
+    """
+
+    def __init__(self, max_distance: float = 0.05, max_size: int = 1000, ttl: float = 86400.0, search_k: int = 5):
+        self.max_distance = max_distance
+        self.max_size = max_size
+        self.ttl = ttl
+        self.search_k = search_k
+        self.hits = 0
+        self.misses = 0
+        self.index_version = None
+        self._index = None
+        self._entries = OrderedDict()  # id -> (question_type, reply, context, created_at)
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _check_version(self, index_version):
+        # A rebuilt course index invalidates every cached reply.
+        if index_version != self.index_version:
+            self._clear()
+            self.index_version = index_version
+
+    def _clear(self):
+        if self._index is not None:
+            self._index.reset()
+        self._entries.clear()
+
+    def _remove(self, ids):
+        for entry_id in ids:
+            self._entries.pop(entry_id, None)
+        self._index.remove_ids(np.array(ids, dtype=np.int64))
+
+    def lookup(self, query_embedding, question_type: str, index_version):
+        """Returns (reply, context) of a matching entry, or None."""
+        with self._lock:
+            self._check_version(index_version)
+            if not self._entries:
+                self.misses += 1
+                return None
+            query = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+            distances, ids = self._index.search(query, min(self.search_k, len(self._entries)))
+            now = time.time()
+            expired = []
+            result = None
+            for distance, entry_id in zip(distances[0], ids[0]):
+                entry_id = int(entry_id)
+                if entry_id < 0 or distance > self.max_distance:
+                    break
+                entry_type, reply, context, created_at = self._entries[entry_id]
+                if now - created_at > self.ttl:
+                    expired.append(entry_id)
+                    continue
+                if entry_type == question_type:
+                    self._entries.move_to_end(entry_id)
+                    result = (reply, context)
+                    break
+            if expired:
+                self._remove(expired)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return result
+
+    def store(self, query_embedding, question_type: str, reply: str, context: str, index_version) -> None:
+        vector = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+        with self._lock:
+            self._check_version(index_version)
+            if self._index is None:
+                self._index = faiss.IndexIDMap(faiss.IndexFlatL2(vector.shape[1]))
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+            self._entries[entry_id] = (question_type, reply, context, time.time())
+            if len(self._entries) > self.max_size:
+                oldest = list(self._entries)[:len(self._entries) - self.max_size]
+                self._remove(oldest)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -1,51 +1,100 @@
 import os
-import subprocess
-from flask import Flask, render_template, request, jsonify
+import sys
+import threading
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+
+# Make the project root importable so "src.main" resolves when run as a script.
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from src.main import RAGEngine
+from src.web import (
+    METRICS_CONTENT_TYPE, SESSION_COOKIE, batch_results, metrics_text, parse_batch_request, parse_chat_request,
+    server_stats, session_id_for, sse_event, with_session_cookie,
+)
 
 # Configure Flask to look for templates in the project root's "templates" folder.
 template_dir = os.path.join(os.path.dirname(__file__), '..', 'templates')
 static_dir = os.path.join(os.path.dirname(__file__), '..', 'static')
 app = Flask(__name__, static_folder=static_dir, template_folder=template_dir)
 
+# One engine per worker process; the FAISS index and metadata are loaded on first use.
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = RAGEngine()
+    return _engine
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.route('/api/stats')
+def stats_api():
+    return jsonify(server_stats())
+
+@app.route('/metrics')
+def metrics_api():
+    # Prometheus scrape target; like /api/stats it covers only the worker that serves the request
+    return Response(metrics_text(), content_type=METRICS_CONTENT_TYPE)
+
 @app.route('/api/chat', methods=['POST'])
 def chat_api():
-    data = request.get_json()
-    query = data.get('query')
-    if not query:
-        return jsonify({'error': 'No query provided'}), 400
+    data = request.get_json() or {}
+    try:
+        query, question_type = parse_chat_request(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    session_id, is_new = session_id_for(data, request.cookies.get(SESSION_COOKIE))
 
     try:
-        # Locate main.py in the current directory.
-        main_py_path = os.path.join(os.path.dirname(__file__), 'main.py')
-
-        # Run main.py as a subprocess, feeding the query as input.
-        proc = subprocess.run(
-            ['python', main_py_path],
-            input=query.encode('utf-8'),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            timeout=60
-        )
-        stdout = proc.stdout.decode('utf-8')
-        stderr = proc.stderr.decode('utf-8')
-
-        if stderr:
-            return jsonify({'error': stderr.strip()}), 500
-
-        # Extract the final answer from the output.
-        parts = stdout.split("Final Answer:")
-        if len(parts) > 1:
-            reply = parts[1].strip()
-        else:
-            reply = stdout.strip()
-
-        return jsonify({'response': reply})
+        reply = get_engine().answer(query, question_type, session_id)
+        return with_session_cookie(jsonify({'response': reply}), session_id, is_new, request.is_secure)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/retrieve/batch', methods=['POST'])
+def retrieve_batch_api():
+    """
+    Retrieval only, for evaluation runs and cache pre-warming: takes
+    {"queries": [...], "k": 8} (k defaults to num_chunks) and returns the top-k chunks for every query.
+    """
+    try:
+        queries, k = parse_batch_request(request.get_json() or {})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        results = get_engine().retrieve_batch(queries, k)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify(batch_results(queries, results))
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream_api():
+    data = request.get_json() or {}
+    try:
+        query, question_type = parse_chat_request(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    session_id, is_new = session_id_for(data, request.cookies.get(SESSION_COOKIE))
+
+    def generate():
+        try:
+            for event, data in get_engine().answer_stream(query, question_type, session_id):
+                yield sse_event(event, data)
+        except Exception as e:
+            yield sse_event('error', str(e))
+
+    # Disable proxy buffering so tokens reach the browser as they are produced.
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+    return with_session_cookie(response, session_id, is_new, request.is_secure)
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,135 @@
+import asyncio
+import contextlib
+import os
+import sys
+
+from jinja2 import Environment, FileSystemLoader
+from starlette.applications import Starlette
+from starlette.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+
+# Async serving mode: the same API as src/app.py on an event loop, for server_mode=async
+# (gunicorn's asgi worker, see gunicorn.conf.py). Each worker serves many chats at once.
+
+# Make the project root importable so "src.main" resolves when run as a script.
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from src.async_engine import AsyncRAGEngine, flights
+from src.main import openai_clients
+from src.web import (
+    METRICS_CONTENT_TYPE, SESSION_COOKIE, batch_results, metrics_text, parse_batch_request, parse_chat_request,
+    server_stats, session_id_for, sse_event, with_session_cookie,
+)
+
+template_dir = os.path.join(project_root, 'templates')
+static_dir = os.path.join(project_root, 'static')
+
+# index.html is a Flask template; its url_for('static', filename=...) calls map onto /static here
+templates = Environment(loader=FileSystemLoader(template_dir), autoescape=True)
+templates.globals['url_for'] = lambda endpoint, filename: f'/{endpoint}/{filename}'
+
+# One engine per worker process; the FAISS index and metadata are loaded on first use.
+_engine = None
+_engine_lock = asyncio.Lock()
+
+async def get_engine():
+    global _engine
+    if _engine is None:
+        async with _engine_lock:
+            if _engine is None:
+                _engine = await asyncio.to_thread(AsyncRAGEngine)
+    return _engine
+
+def preload_engine():
+    """Creates the engine outside the event loop, e.g. in the gunicorn master before workers fork."""
+    global _engine
+    if _engine is None:
+        _engine = AsyncRAGEngine()
+    return _engine
+
+async def read_json(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+async def index(request):
+    return HTMLResponse(templates.get_template('index.html').render())
+
+async def stats_api(request):
+    # The async app coalesces requests with its own single-flight
+    return JSONResponse(dict(server_stats(), single_flight=flights.stats()))
+
+async def metrics_api(request):
+    return Response(metrics_text(single_flight=flights.stats()), media_type=METRICS_CONTENT_TYPE)
+
+async def chat_api(request):
+    data = await read_json(request)
+    try:
+        query, question_type = parse_chat_request(data)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    session_id, is_new = session_id_for(data, request.cookies.get(SESSION_COOKIE))
+
+    try:
+        engine = await get_engine()
+        reply = await engine.aanswer(query, question_type, session_id)
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+    return with_session_cookie(JSONResponse({'response': reply}), session_id, is_new, request.url.scheme == 'https')
+
+async def retrieve_batch_api(request):
+    try:
+        queries, k = parse_batch_request(await read_json(request))
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    try:
+        engine = await get_engine()
+        results = await engine.aretrieve_batch(queries, k)
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+    return JSONResponse(batch_results(queries, results))
+
+async def chat_stream_api(request):
+    data = await read_json(request)
+    try:
+        query, question_type = parse_chat_request(data)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    session_id, is_new = session_id_for(data, request.cookies.get(SESSION_COOKIE))
+
+    async def generate():
+        try:
+            engine = await get_engine()
+            async for event, data in engine.aanswer_stream(query, question_type, session_id):
+                yield sse_event(event, data)
+        except Exception as e:
+            yield sse_event('error', str(e))
+
+    # Disable proxy buffering so tokens reach the browser as they are produced.
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    response = StreamingResponse(generate(), media_type='text/event-stream', headers=headers)
+    return with_session_cookie(response, session_id, is_new, request.url.scheme == 'https')
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    # Close the pooled upstream connections of this worker
+    await openai_clients.aclose()
+
+app = Starlette(
+    routes=[
+        Route('/', index),
+        Route('/api/stats', stats_api),
+        Route('/metrics', metrics_api),
+        Route('/api/chat', chat_api, methods=['POST']),
+        Route('/api/retrieve/batch', retrieve_batch_api, methods=['POST']),
+        Route('/api/chat/stream', chat_stream_api, methods=['POST']),
+        Mount('/static', app=StaticFiles(directory=static_dir), name='static'),
+    ],
+    lifespan=lifespan,
+)
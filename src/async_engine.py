@@ -0,0 +1,384 @@
+import asyncio
+import logging
+
+import numpy as np
+
+from src.context_builder import build_context
+from src.embeddings import OpenAIEmbedder
+from src.main import (
+    CANNOT_ANSWER, RAGEngine, answer_cacheable, build_messages, classifier_mode, coalesce_question, coalesce_routed,
+    coalesce_wait_timeout, completion_request, context_max_tokens, embedder, embedding_cache, execution_mode,
+    finish_prepare, flight_key, followup_question, followup_request, is_yes, needs_retrieval, num_chunks,
+    openai_clients, own_embedding, parse_completion, parse_route, reranker, route_candidates, route_choice,
+    route_request, sessions, stream_request, syllabus_request, tracer, verification_mode, verify_request,
+)
+from src.metrics import note, stage
+from src.single_flight import ABANDONED, AsyncSingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Single-flight of the async app; its followers wait on the event loop instead of in threads
+flights = AsyncSingleFlight(on_shared=lambda: note(coalesced=True), timeout=coalesce_wait_timeout)
+
+
+# The in-memory EmbeddingCache, SessionStore and AnswerCache only hold a lock for a dictionary
+# or small FAISS operation and are called on the event loop directly. With a sqlite_path
+# (embedding_cache_persist / session_store_persist) the embedding cache and session store read
+# and write a database file that other workers may have locked, so those calls run in a thread.
+async def on_store(store, fn, *args):
+    if store.sqlite_path is None:
+        return fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+def cache_get_many(queries):
+    return [embedding_cache.get(embedder.name, q) for q in queries]
+
+def cache_put_many(queries, vectors):
+    for query, vector in zip(queries, vectors):
+        embedding_cache.put(embedder.name, query, vector)
+
+# embed_queries() for the event loop: OpenAI is called with the async client, local models run in a thread
+async def aembed_queries(queries):
+    queries = list(queries)
+    vectors = await on_store(embedding_cache, cache_get_many, queries)
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if missing:
+        texts = [queries[i] for i in missing]
+        with stage("embed"):
+            if isinstance(embedder, OpenAIEmbedder):
+                new_vectors = await embedder.aembed(texts, openai_clients.aembeddings)
+            else:
+                new_vectors = await asyncio.to_thread(embedder.embed, texts)
+        for i, vector in zip(missing, new_vectors):
+            vectors[i] = vector
+        await on_store(embedding_cache, cache_put_many, texts, new_vectors)
+    return np.vstack(vectors)
+
+async def aembed_query(query):
+    return (await aembed_queries([query]))[0]
+
+async def averify_answer(original_question, answer):
+    return is_yes(await openai_clients.achat(**verify_request(original_question, answer)))
+
+async def acheck_syllabus(question):
+    return is_yes(await openai_clients.achat(**syllabus_request(question)))
+
+async def acheck_followup(new_question, previous_context):
+    return is_yes(await openai_clients.achat(**followup_request(new_question, previous_context)))
+
+async def aclassify(question, previous_context):
+    """(is_syllabus, is_followup) from the combined router or the two separate classifiers."""
+    if classifier_mode == "combined":
+        verdict = parse_route(await openai_clients.achat(**route_request(question, previous_context)), previous_context)
+        if verdict is not None:
+            return verdict
+    if not previous_context:
+        return await acheck_syllabus(question), False
+    is_syllabus, is_followup = await asyncio.gather(
+        acheck_syllabus(question), acheck_followup(question, previous_context)
+    )
+    return is_syllabus, is_followup
+
+async def acomplete(messages, self_assessment=False):
+    return parse_completion(await openai_clients.achat(**completion_request(messages, self_assessment)), self_assessment)
+
+def discard(task):
+    """Cancels a task whose result is no longer needed, without an unretrieved-exception warning."""
+    task.cancel()
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+class AsyncRAGEngine(RAGEngine):
+    """
+    RAGEngine for the async app (src/asgi.py). The pipeline is the same, but
+    every OpenAI call is awaited on the shared AsyncOpenAI client, so one
+    worker keeps serving other students while a request waits on the API.
+    FAISS, BM25 and reranker work is CPU-bound and runs in the default
+    thread pool instead of on the event loop.
+    """
+
+    async def _aroute(self, user_input, previous_context, lookup=None):
+        """
+        Classifies the question; in parallel mode the embeddings of all its
+        possible rewrites are computed at the same time, and lookup is consulted
+        with the question's own embedding, as in _route_parallel. Returns (hit, routed).
+        """
+        candidates = route_candidates(user_input, previous_context)
+        embeddings_task = None
+        if execution_mode == "parallel":
+            embeddings_task = asyncio.ensure_future(aembed_queries(candidates))
+        classify_task = None
+        try:
+            with stage("classify"):
+                classify_task = asyncio.ensure_future(aclassify(user_input, previous_context))
+                if lookup is not None and embeddings_task is not None:
+                    hit = lookup((await embeddings_task)[0])
+                    if hit is not None:
+                        discard(classify_task)
+                        return hit, None
+                is_syllabus, is_followup = await classify_task
+        except BaseException:
+            for task in (embeddings_task, classify_task):
+                if task is not None:
+                    discard(task)
+            raise
+
+        choice = route_choice(is_syllabus, is_followup)
+        if choice is None:
+            if embeddings_task is not None:
+                discard(embeddings_task)
+            return None, (followup_question(user_input, previous_context), None, True)
+        if embeddings_task is None:
+            return None, (candidates[choice], None, is_followup)
+        return None, (candidates[choice], (await embeddings_task)[choice], is_followup)
+
+    async def aget_context_from_query(self, query, k=None, query_embedding=None, max_tokens=None):
+        if query_embedding is None:
+            query_embedding = await aembed_query(query)
+        hits = await asyncio.to_thread(self.retrieve, [query], np.atleast_2d(query_embedding), k or num_chunks)
+        return build_context(hits[0], max_tokens or context_max_tokens)
+
+    async def aretrieve_batch(self, queries, k=None):
+        if not queries:
+            return []
+        return await asyncio.to_thread(self.retrieve, queries, await aembed_queries(queries), k or num_chunks)
+
+    async def _aroute_question(self, user_input, question_type, previous_context):
+        if question_type != "normal":
+            return user_input, None, False
+        return (await self._aroute(user_input, previous_context))[1]
+
+    async def _aroute_new(self, user_input, question_type):
+        """Async _route_new(): (cached, routed) for a question asked without previous context."""
+        if not answer_cacheable(question_type):
+            return None, await self._aroute_question(user_input, question_type, None)
+        if execution_mode == "parallel" and question_type == "normal":
+            return await self._aroute(
+                user_input, None, lambda embedding: self._cached_answer(user_input, question_type, embedding)
+            )
+        cached = await self._acached_answer(user_input, question_type)
+        if cached is not None:
+            return cached, None
+        return None, await self._aroute_question(user_input, question_type, None)
+
+    async def _aprepare(self, user_input, question_type, previous_context, routed):
+        original_question, query_embedding, is_followup = routed
+        context = None
+        if needs_retrieval(question_type, is_followup):
+            context = await self.aget_context_from_query(original_question, query_embedding=query_embedding)
+            logger.info("Retrieved context from course materials.")
+        return finish_prepare(user_input, question_type, previous_context, original_question, is_followup, context)
+
+    async def _acached_answer(self, user_input, question_type, query_embedding=None):
+        if not answer_cacheable(question_type):
+            return None
+        if query_embedding is None:
+            query_embedding = await aembed_query(user_input)
+        return self._cached_answer(user_input, question_type, query_embedding)
+
+    async def _acache_answer(self, user_input, question_type, reply, context, query_embedding=None):
+        if answer_cacheable(question_type):
+            if query_embedding is None:
+                query_embedding = await aembed_query(user_input)
+            self._cache_answer(user_input, question_type, reply, context, query_embedding)
+
+    async def _aretry(self, original_question, context, prompt_instructions, final_query, self_assessment=False):
+        if reranker is not None:
+            return CANNOT_ANSWER
+        logger.info("Attempting follow-up query with extended context.")
+        alt_context = await self.aget_context_from_query(
+            original_question + " " + context, k=2 * num_chunks, max_tokens=2 * context_max_tokens
+        )
+        followup_reply, followup_verified = await acomplete(
+            build_messages(prompt_instructions, alt_context, final_query), self_assessment
+        )
+        if followup_verified is None:
+            followup_verified = await averify_answer(original_question, followup_reply)
+        if followup_verified:
+            return followup_reply
+        return CANNOT_ANSWER
+
+    async def _acomplete_answer(self, user_input, question_type, previous_context, routed):
+        original_question, context, prompt_instructions, final_query, is_followup = await self._aprepare(
+            user_input, question_type, previous_context, routed
+        )
+
+        self_assessment = verification_mode == "self_assessment" and question_type != "multiple_choice"
+        logger.info("Sending query to OpenAI...")
+        with stage("completion"):
+            reply, verified = await acomplete(build_messages(prompt_instructions, context, final_query), self_assessment)
+
+        if question_type != "multiple_choice":
+            if verified is None:
+                with stage("verify"):
+                    verified = await averify_answer(original_question, reply)
+            logger.info("Answer verification: %s", "Yes" if verified else "No")
+            note(verified=verified)
+            if not verified and question_type != "answer_check":
+                note(retried=True)
+                with stage("retry"):
+                    reply = await self._aretry(
+                        original_question, context, prompt_instructions, final_query, self_assessment
+                    )
+                verified = reply != CANNOT_ANSWER
+            if verified and not is_followup:
+                await self._acache_answer(
+                    user_input, question_type, reply, context, own_embedding(user_input, routed)
+                )
+
+        return reply, context
+
+    async def _aanswer_new(self, user_input, question_type):
+        cached, routed = await self._aroute_new(user_input, question_type)
+        if cached is not None:
+            return cached
+        return await self._acomplete_answer(user_input, question_type, None, routed)
+
+    async def _aanswer_in_session(self, user_input, question_type, previous_context):
+        routed = await self._aroute_question(user_input, question_type, previous_context)
+        is_followup = routed[2]
+
+        async def run():
+            cached = None if is_followup else await self._acached_answer(
+                user_input, question_type, own_embedding(user_input, routed)
+            )
+            return cached or await self._acomplete_answer(user_input, question_type, previous_context, routed)
+
+        if not coalesce_routed(question_type, is_followup):
+            return await run()
+        return await flights.run(flight_key("routed", routed[0], question_type), run)
+
+    async def aanswer(self, query, question_type="normal", session_id=None):
+        """Async answer()."""
+        user_input = query.strip()
+        async with tracer.arequest(question_type, user_input):
+            previous_context = await on_store(sessions, sessions.get, session_id)
+            if previous_context:
+                reply, context = await self._aanswer_in_session(user_input, question_type, previous_context)
+            elif coalesce_question(question_type, previous_context):
+                reply, context = await flights.run(
+                    flight_key("question", user_input, question_type),
+                    lambda: self._aanswer_new(user_input, question_type),
+                )
+            else:
+                reply, context = await self._aanswer_new(user_input, question_type)
+
+            if question_type != "answer_check":
+                await on_store(sessions, sessions.put, session_id, context)
+        return reply
+
+    # Async generators cannot return a value, so the streaming helpers below
+    # store their (reply, context) result in the `out` list instead.
+
+    async def _astream_answer(self, out, user_input, question_type, previous_context, routed):
+        original_question, context, prompt_instructions, final_query, is_followup = await self._aprepare(
+            user_input, question_type, previous_context, routed
+        )
+
+        logger.info("Streaming query to OpenAI...")
+        pieces = []
+        with stage("completion"):
+            messages = build_messages(prompt_instructions, context, final_query)
+            stream = await openai_clients.achat(**stream_request(messages))
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content
+                if token:
+                    pieces.append(token)
+                    yield "token", token
+        reply = "".join(pieces).strip()
+
+        if question_type != "multiple_choice":
+            with stage("verify"):
+                verified = await averify_answer(original_question, reply)
+            logger.info("Answer verification: %s", "Yes" if verified else "No")
+            note(verified=verified)
+            if not verified and question_type != "answer_check":
+                note(retried=True)
+                with stage("retry"):
+                    reply = await self._aretry(original_question, context, prompt_instructions, final_query)
+                verified = reply != CANNOT_ANSWER
+                yield "correction", reply
+            if verified and not is_followup:
+                await self._acache_answer(
+                    user_input, question_type, reply, context, own_embedding(user_input, routed)
+                )
+
+        out.append((reply, context))
+
+    async def _astream_coalesced(self, out, key, make_stream):
+        """Async _stream_coalesced(); make_stream(out) is an async generator storing its result in out."""
+        flight, leader = flights.join(key)
+        if not leader:
+            result = await flights.wait(flight)
+            if result is not None:
+                yield "token", result[0]
+                out.append(result)
+                return
+            async for event in make_stream(out):
+                yield event
+            return
+        try:
+            async for event in make_stream(out):
+                yield event
+        except ABANDONED:
+            flights.finish(key, flight, abandoned=True)
+            raise
+        except BaseException as e:
+            flights.finish(key, flight, error=e)
+            raise
+        flights.finish(key, flight, result=out[-1])
+
+    async def _astream_new(self, out, user_input, question_type):
+        cached, routed = await self._aroute_new(user_input, question_type)
+        if cached is not None:
+            yield "token", cached[0]
+            out.append(cached)
+            return
+        async for event in self._astream_answer(out, user_input, question_type, None, routed):
+            yield event
+
+    async def _astream_in_session(self, out, user_input, question_type, previous_context):
+        routed = await self._aroute_question(user_input, question_type, previous_context)
+        is_followup = routed[2]
+
+        async def make_stream(out):
+            cached = None if is_followup else await self._acached_answer(
+                user_input, question_type, own_embedding(user_input, routed)
+            )
+            if cached is not None:
+                yield "token", cached[0]
+                out.append(cached)
+                return
+            async for event in self._astream_answer(out, user_input, question_type, previous_context, routed):
+                yield event
+
+        stream = make_stream(out)
+        if coalesce_routed(question_type, is_followup):
+            stream = self._astream_coalesced(out, flight_key("routed", routed[0], question_type), make_stream)
+        async for event in stream:
+            yield event
+
+    async def aanswer_stream(self, query, question_type="normal", session_id=None):
+        """Async answer_stream(): an async generator of the same (event, data) pairs."""
+        user_input = query.strip()
+        async with tracer.arequest(question_type, user_input):
+            previous_context = await on_store(sessions, sessions.get, session_id)
+            out = []
+            if previous_context:
+                stream = self._astream_in_session(out, user_input, question_type, previous_context)
+            elif coalesce_question(question_type, previous_context):
+                stream = self._astream_coalesced(
+                    out, flight_key("question", user_input, question_type),
+                    lambda out: self._astream_new(out, user_input, question_type),
+                )
+            else:
+                stream = self._astream_new(out, user_input, question_type)
+            async for event in stream:
+                yield event
+
+            reply, context = out[-1]
+            if question_type != "answer_check":
+                await on_store(sessions, sessions.put, session_id, context)
+        yield "done", None
@@ -0,0 +1,123 @@
+import os
+import re
+from array import array
+from collections import Counter
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+# \w is Unicode-aware, so Cyrillic words, Latin words and numbers all become tokens
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.casefold())
+
+
+def write_bm25_index(path: str, documents: Iterable[Tuple[int, str]]) -> int:
+    """
+    Builds the inverted index of (chunk_id, text) documents and saves it as a
+    single .npz file: the sorted vocabulary (a UTF-8 blob with byte offsets,
+    like the chunk store, so one long token does not widen every entry),
+    CSR-style postings (document row and term frequency per term) and document
+    lengths. Documents may come from
+    a generator; postings are collected in compact typed arrays rather than
+    per-posting Python objects. Returns the number of documents. The file is
+    replaced atomically.
+    """
+    term_ids = {}
+    posting_terms = array("i")
+    posting_rows = array("i")
+    posting_tfs = array("H")
+    doc_ids = array("q")
+    doc_lens = array("i")
+    for row, (chunk_id, text) in enumerate(documents):
+        counts = Counter(tokenize(text))
+        doc_ids.append(chunk_id)
+        doc_lens.append(sum(counts.values()))
+        for term, tf in counts.items():
+            posting_terms.append(term_ids.setdefault(term, len(term_ids)))
+            posting_rows.append(row)
+            posting_tfs.append(min(tf, 0xFFFF))
+
+    # Renumber the terms in sorted order and group the postings by term; the
+    # stable sort keeps each term's postings in document order
+    terms = sorted(term_ids)
+    rank = np.empty(len(terms), dtype=np.int64)
+    rank[[term_ids[term] for term in terms]] = np.arange(len(terms))
+    posting_terms = rank[np.asarray(posting_terms, dtype=np.int64)]
+    order = np.argsort(posting_terms, kind="stable")
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(posting_terms, minlength=len(terms)), out=offsets[1:])
+    encoded = [term.encode("utf-8") for term in terms]
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=term_offsets[1:])
+
+    # np.savez appends ".npz" to names without it, so the temporary name keeps that suffix
+    tmp_path = path[:-len(".npz")] + ".tmp.npz"
+    np.savez(
+        tmp_path,
+        term_blob=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        term_offsets=term_offsets,
+        offsets=offsets,
+        rows=np.asarray(posting_rows, dtype=np.int32)[order],
+        tfs=np.asarray(posting_tfs, dtype=np.uint16)[order],
+        doc_ids=np.asarray(doc_ids, dtype=np.int64),
+        doc_lens=np.asarray(doc_lens, dtype=np.int32),
+    )
+    os.replace(tmp_path, path)
+    return len(doc_ids)
+
+
+def _load_terms(data) -> List[str]:
+    if "terms" in data.files:
+        # Indexes written before the vocabulary became a blob hold a fixed-width string array
+        return data["terms"].tolist()
+    blob = data["term_blob"].tobytes()
+    ends = data["term_offsets"].tolist()
+    return [blob[start:end].decode("utf-8") for start, end in zip(ends, ends[1:])]
+
+
+class BM25Index:
+    """
+    Okapi BM25 over the chunk texts, loaded from the file written by
+    write_bm25_index. search() scores only the postings of the query terms.
+    """
+
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        with np.load(path) as data:
+            terms = _load_terms(data)
+            self.offsets = data["offsets"]
+            self.rows = data["rows"]
+            self.tfs = data["tfs"].astype(np.float32)
+            self.doc_ids = data["doc_ids"]
+            doc_lens = data["doc_lens"].astype(np.float32)
+        self.term_rows = {term: i for i, term in enumerate(terms)}
+        num_docs = len(self.doc_ids)
+        doc_freqs = np.diff(self.offsets).astype(np.float32)
+        self.idf = np.log(1.0 + (num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5))
+        avg_len = doc_lens.mean() if num_docs else 1.0
+        self.length_norm = k1 * (1.0 - b + b * doc_lens / max(avg_len, 1.0))
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the chunk ids and scores of the k best-matching chunks, best first."""
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            i = self.term_rows.get(term)
+            if i is None:
+                continue
+            start, end = self.offsets[i], self.offsets[i + 1]
+            rows = self.rows[start:end]
+            tfs = self.tfs[start:end]
+            scores[rows] += self.idf[i] * tfs * (self.k1 + 1.0) / (tfs + self.length_norm[rows])
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return self.doc_ids[matched], scores[matched]
@@ -0,0 +1,127 @@
+import json
+import mmap
+import os
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+# A chunk store is three files sharing a prefix (e.g. data/chunk_store):
+#   <prefix>.bin          UTF-8 blob of compact JSON records, one after another
+#   <prefix>_offsets.npy  int64 byte offsets of the records in the blob (n + 1 entries)
+#   <prefix>_ids.npy      int64 chunk ids, sorted; record i belongs to ids[i]
+
+
+def chunk_store_exists(prefix: str) -> bool:
+    return all(os.path.exists(prefix + suffix) for suffix in (".bin", "_offsets.npy", "_ids.npy"))
+
+
+def write_chunk_store(prefix: str, records: Iterable[Dict[str, Any]]) -> int:
+    """
+    Writes records (each with an integer 'chunk_id') as a chunk store and
+    returns the number written. Records may come in any order from a
+    generator: they are streamed to a scratch file and then copied in id
+    order, so only their ids and lengths are held in memory. Files are
+    replaced atomically, so processes that still map the previous store keep
+    reading a consistent copy.
+    """
+    ids = array("q")
+    lengths = array("q")
+    scratch_path = prefix + ".unsorted.tmp"
+    with open(scratch_path, "wb") as scratch:
+        for record in records:
+            data = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            scratch.write(data)
+            ids.append(record["chunk_id"])
+            lengths.append(len(data))
+    ids = np.frombuffer(ids, dtype=np.int64) if ids else np.zeros(0, dtype=np.int64)
+    lengths = np.frombuffer(lengths, dtype=np.int64) if lengths else np.zeros(0, dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+    order = np.argsort(ids, kind="stable")
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum(lengths[order], out=offsets[1:])
+
+    with open(scratch_path, "rb") as scratch, open(prefix + ".bin.tmp", "wb") as blob:
+        # mmap cannot map an empty file
+        source = mmap.mmap(scratch.fileno(), 0, access=mmap.ACCESS_READ) if offsets[-1] else b""
+        for row in order:
+            blob.write(source[starts[row]:starts[row] + lengths[row]])
+        if offsets[-1]:
+            source.close()
+    os.remove(scratch_path)
+    # np.save appends ".npy" to names without it, so the temporary names keep that suffix
+    np.save(prefix + "_offsets.tmp.npy", offsets)
+    np.save(prefix + "_ids.tmp.npy", ids[order])
+    os.replace(prefix + "_offsets.tmp.npy", prefix + "_offsets.npy")
+    os.replace(prefix + "_ids.tmp.npy", prefix + "_ids.npy")
+    os.replace(prefix + ".bin.tmp", prefix + ".bin")
+    return len(ids)
+
+
+class ChunkStore:
+    """
+    Read-only, memory-mapped chunk metadata. Opening the store reads no
+    record data; get() binary-searches the id array and decodes only the
+    requested record, and the mapped pages are shared through the OS page
+    cache by every process that opens the same files.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.ids = np.load(prefix + "_ids.npy", mmap_mode="r")
+        self.offsets = np.load(prefix + "_offsets.npy", mmap_mode="r")
+        with open(prefix + ".bin", "rb") as f:
+            # mmap cannot map an empty file
+            self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _row(self, row: int) -> Dict[str, Any]:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(self._blob[start:end].decode("utf-8"))
+
+    def get(self, chunk_id: int) -> Optional[Dict[str, Any]]:
+        row = int(np.searchsorted(self.ids, chunk_id))
+        if row < len(self.ids) and self.ids[row] == chunk_id:
+            return self._row(row)
+        return None
+
+    def get_many(self, chunk_ids: Iterable[int]) -> List[Optional[Dict[str, Any]]]:
+        """get() for several ids, with one vectorized search of the id array."""
+        chunk_ids = np.fromiter(chunk_ids, dtype=np.int64)
+        if not len(self.ids):
+            return [None] * len(chunk_ids)
+        rows = np.searchsorted(self.ids, chunk_ids)
+        found = self.ids[np.minimum(rows, len(self.ids) - 1)] == chunk_ids
+        return [self._row(int(row)) if hit else None for row, hit in zip(rows, found)]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for row in range(len(self.ids)):
+            yield self._row(row)
+
+
+class InMemoryChunkStore:
+    """
+    ChunkStore interface over a list of metadata dicts, for indexes built
+    before the chunk store existed (faiss_metadata.json) and for tests.
+    Records without a 'chunk_id' are addressed by their position.
+    """
+
+    def __init__(self, records: List[Dict[str, Any]]):
+        if records and "chunk_id" in records[0]:
+            self._records = {record["chunk_id"]: record for record in records}
+        else:
+            self._records = dict(enumerate(records))
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def get(self, chunk_id: int) -> Optional[Dict[str, Any]]:
+        return self._records.get(int(chunk_id))
+
+    def get_many(self, chunk_ids: Iterable[int]) -> List[Optional[Dict[str, Any]]]:
+        return [self.get(chunk_id) for chunk_id in chunk_ids]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self._records.values())
@@ -0,0 +1,137 @@
+import re
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from src.tokens import count_tokens
+
+_BLANK_LINE_RE = re.compile(r"\n\s*\n")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+")
+# Markdown headings (DOCX headings are extracted as these) and all-caps lines
+_HEADING_RE = re.compile(r"^(#{1,6}\s+\S.*|(?=.*[A-ZА-Я])[^a-zа-я]{3,})$")
+# Numbered section titles ("2.1 Expected utility"): the section number and the first word of the title
+_NUMBERED_RE = re.compile(r"^\d+(\.\d+)*\.?\s+(\S+)")
+MAX_NUMBERED_HEADING_WORDS = 12
+# Line endings after which a new line starts a new sentence
+_SENTENCE_ENDINGS = ".!?…:"
+
+
+class Unit(NamedTuple):
+    """A sentence or heading of a document, the smallest piece a chunk boundary can fall between."""
+    text: str
+    page: Optional[int]
+    tokens: int
+    heading: bool
+    starts_paragraph: bool
+
+
+def is_heading(line: str, after_break: bool = True) -> bool:
+    """
+    Short lines that look like section titles; they never end in punctuation.
+    A numbered title must start with a capitalised word and come after a
+    break (the start of a block, a heading or a finished sentence), so a
+    wrapped line that happens to start with a number stays in its paragraph.
+    """
+    if len(line) > 100 or line[-1] in ".,;:!?":
+        return False
+    if _HEADING_RE.match(line):
+        return True
+    match = _NUMBERED_RE.match(line)
+    return (match is not None and after_break and match.group(2)[0].isupper()
+            and len(line.split()) <= MAX_NUMBERED_HEADING_WORDS)
+
+
+def split_sentences(paragraph: str, max_tokens: int, count: Callable[[str], int] = count_tokens) -> List[str]:
+    """Sentences of a paragraph; sentences longer than max_tokens are cut into word windows."""
+    pieces = []
+    for sentence in _SENTENCE_END_RE.split(paragraph):
+        if count(sentence) <= max_tokens:
+            pieces.append(sentence)
+            continue
+        window, window_tokens = [], 0
+        for word in sentence.split():
+            tokens = count(" " + word)
+            if window and window_tokens + tokens > max_tokens:
+                pieces.append(" ".join(window))
+                window, window_tokens = [], 0
+            window.append(word)
+            window_tokens += tokens
+        if window:
+            pieces.append(" ".join(window))
+    return pieces
+
+
+def split_units(pages: Sequence[str], max_tokens: int, paginated: bool = True,
+                count: Callable[[str], int] = count_tokens) -> List[Unit]:
+    """
+    Splits pages into units. Blank lines separate paragraphs, the wrapped
+    lines of a paragraph are joined, and heading lines become units of their own.
+    """
+    units = []
+    for page_number, page in enumerate(pages, start=1):
+        page_label = page_number if paginated else None
+        for block in _BLANK_LINE_RE.split(page):
+            paragraph = []
+            lines = [" ".join(line.split()) for line in block.splitlines()]
+            for line in [line for line in lines if line] + [None]:
+                after_break = not paragraph or paragraph[-1][-1] in _SENTENCE_ENDINGS
+                if line is not None and not is_heading(line, after_break):
+                    paragraph.append(line)
+                    continue
+                for i, sentence in enumerate(split_sentences(" ".join(paragraph), max_tokens, count) if paragraph else []):
+                    units.append(Unit(sentence, page_label, count(sentence), False, i == 0))
+                paragraph = []
+                if line is not None:
+                    title = line.lstrip("#").strip()
+                    units.append(Unit(title, page_label, count(title), True, True))
+    return units
+
+
+def join_units(units: Sequence[Unit]) -> str:
+    text = ""
+    for unit in units:
+        if text:
+            text += "\n" if unit.starts_paragraph else " "
+        text += unit.text
+    return text
+
+
+def chunk_pages(pages: Sequence[str], chunk_size: int = 400, overlap: int = 50,
+                paginated: bool = True, count: Callable[[str], int] = count_tokens) -> List[Dict[str, object]]:
+    """
+    Packs the sentences of a document into chunks of at most chunk_size
+    tokens, as counted by `count` (the embedding model's tokenizer; cl100k by
+    default). Chunk boundaries fall between sentences, a heading starts a new
+    chunk (once the current one holds a quarter of chunk_size), and a chunk
+    split inside a section repeats up to `overlap` tokens of trailing
+    sentences. Returns dicts with 'text', 'page' and 'page_end'; pages are
+    None for documents without pages (paginated=False).
+    """
+    chunks = []
+    current: List[Unit] = []
+    fresh = 0  # units of `current` not repeated from the previous chunk
+
+    def emit(units):
+        chunks.append({"text": join_units(units), "page": units[0].page, "page_end": units[-1].page})
+
+    for unit in split_units(pages, chunk_size, paginated, count):
+        current_tokens = sum(u.tokens for u in current)
+        if unit.heading and fresh and current_tokens >= chunk_size // 4 and not current[-1].heading:
+            emit(current)
+            current, fresh = [], 0
+        elif fresh and current_tokens + unit.tokens > chunk_size:
+            # Headings at the end of a full chunk move on with the text they introduce
+            carried = []
+            while current and current[-1].heading and len(current) > 1:
+                carried.insert(0, current.pop())
+            emit(current)
+            if carried:
+                current, fresh = carried, len(carried)
+            else:
+                while current and (sum(u.tokens for u in current) > overlap
+                                   or sum(u.tokens for u in current) + unit.tokens > chunk_size):
+                    current.pop(0)
+                fresh = 0
+        current.append(unit)
+        fresh += 1
+    if fresh:
+        emit(current)
+    return chunks
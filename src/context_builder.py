@@ -0,0 +1,91 @@
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from src.tokens import count_tokens, truncate_to_tokens
+
+# Blocks that would only fit with fewer tokens than this are left out instead of truncated
+MIN_BLOCK_TOKENS = 50
+
+
+def chunk_body(record: Dict[str, Any]) -> str:
+    """Chunk text without the "Document: <title>. " prefix added by prepare_documents.py."""
+    prefix = f"Document: {record.get('filename', '')}. "
+    text = record["chunk_text"]
+    return text[len(prefix):] if text.startswith(prefix) else text
+
+
+def splice(left: List[str], right: List[str]) -> List[str]:
+    """
+    Joins two word lists, dropping the longest suffix of `left` that `right`
+    starts with, so the overlap between neighbouring chunks appears once.
+    """
+    for size in range(min(len(left), len(right)), 0, -1):
+        if left[-size] == right[0] and left[-size:] == right[:size]:
+            return left + right[size:]
+    return left + right
+
+
+def page_label(first: Optional[int], last: Optional[int]) -> str:
+    if first is None:
+        return ""
+    if last is None or last == first:
+        return f"p. {first}"
+    return f"pp. {first}-{last}"
+
+
+def merge_hits(hits: Sequence[Tuple[Dict[str, Any], float]]) -> List[Tuple[str, str, str]]:
+    """
+    Groups ranked (record, distance) hits into blocks of consecutive chunks of
+    the same file and splices each block's overlapping text. Returns
+    (filename, page label, text) blocks ordered by their best-ranked chunk.
+    """
+    by_file = {}
+    for rank, (record, _) in enumerate(hits):
+        by_file.setdefault(record.get("filename", ""), []).append((record.get("chunk_index"), rank, record))
+
+    blocks = []
+    for filename, entries in by_file.items():
+        entries.sort(key=lambda entry: (entry[0] is None, entry[0] if entry[0] is not None else entry[1]))
+        current = None
+        for chunk_index, rank, record in entries:
+            words = chunk_body(record).split()
+            if current is not None and chunk_index is not None and current["last"] is not None \
+                    and chunk_index - current["last"] <= 1:
+                current["words"] = splice(current["words"], words)
+                current["last"] = chunk_index
+                current["rank"] = min(current["rank"], rank)
+                current["page_end"] = record.get("page_end", current["page_end"])
+                continue
+            current = {"filename": filename, "words": words, "last": chunk_index, "rank": rank,
+                       "page": record.get("page"), "page_end": record.get("page_end")}
+            blocks.append(current)
+
+    blocks.sort(key=lambda block: block["rank"])
+    return [(block["filename"], page_label(block["page"], block["page_end"]), " ".join(block["words"]))
+            for block in blocks]
+
+
+def build_context(hits: Sequence[Tuple[Dict[str, Any], float]], max_tokens: int) -> str:
+    """
+    Prompt context from ranked search hits: neighbouring chunks are merged,
+    text already included (e.g. the same passage in two files) is skipped,
+    and blocks are added best first until max_tokens is reached.
+    """
+    parts = []
+    seen = []
+    remaining = max_tokens
+    for filename, pages, body in merge_hits(hits):
+        key = re.sub(r"\s+", " ", body).strip().casefold()
+        if not key or any(key in other for other in seen):
+            continue
+        source = ", ".join(part for part in (filename, pages) if part)
+        block = f"Document: {source}. {body}" if source else body
+        tokens = count_tokens(block)
+        if tokens > remaining:
+            if remaining >= MIN_BLOCK_TOKENS:
+                parts.append(truncate_to_tokens(block, remaining))
+            break
+        parts.append(block)
+        seen.append(key)
+        remaining -= tokens + 1  # the blank line between blocks
+    return "\n\n".join(parts)
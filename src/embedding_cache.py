@@ -0,0 +1,104 @@
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """Cache key normalization: case-folded with whitespace collapsed."""
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+class EmbeddingCache:
+    """
+    Thread-safe LRU cache of query embeddings keyed by model name and
+    normalized text. With a sqlite_path the entries are also written to a
+    local SQLite file, so they survive worker restarts and are shared by all
+    workers on the machine; the in-memory LRU stays bounded by max_size.
+    """
+
+    def __init__(self, max_size: int = 10000, sqlite_path: str = None):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.sqlite_path = sqlite_path
+        self._db = None
+        self._db_pid = None
+
+    def _connection(self):
+        """
+        SQLite connection of the current process. It is opened lazily and
+        reopened after a fork, since connections must not cross fork()
+        (e.g. when gunicorn preloads the app in its master process).
+        """
+        if self.sqlite_path is None:
+            return None
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.sqlite_path, check_same_thread=False, timeout=5.0)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._db.commit()
+            self._db_pid = os.getpid()
+        return self._db
+
+    @staticmethod
+    def _key(model: str, text: str) -> str:
+        return f"{model}\x00{normalize_text(text)}"
+
+    def get(self, model: str, text: str):
+        """Returns the cached float32 vector, or None on a miss."""
+        key = self._key(model, text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            db = self._connection()
+            if db is not None:
+                row = db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vector)
+                    self.hits += 1
+                    return vector
+            self.misses += 1
+            return None
+
+    def put(self, model: str, text: str, vector) -> None:
+        key = self._key(model, text)
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            db = self._connection()
+            if db is not None:
+                db.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    (key, vector.tobytes()),
+                )
+                db.commit()
+
+    def _remember(self, key, vector):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "persistent": self.sqlite_path is not None,
+            }
@@ -0,0 +1,137 @@
+import threading
+from typing import Awaitable, Callable, List, Optional
+
+import numpy as np
+import openai
+
+from src.tokens import count_tokens
+
+# Output dimensions of the OpenAI embedding models, so the index can be checked without an API call
+OPENAI_EMBEDDING_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+
+
+class OpenAIEmbedder:
+    """Embeds texts with the OpenAI embeddings API."""
+
+    def __init__(self, model: str = "text-embedding-ada-002"):
+        self.model = model
+        self.name = f"openai:{model}"
+
+    @property
+    def dimension(self) -> int:
+        if self.model in OPENAI_EMBEDDING_DIMENSIONS:
+            return OPENAI_EMBEDDING_DIMENSIONS[self.model]
+        return len(self.embed(["dimension probe"])[0])
+
+    # The embeddings endpoint accepts at most 2048 inputs per request
+    max_inputs_per_request = 2048
+    # Input limit of the OpenAI embedding models, in cl100k tokens
+    max_tokens = 8191
+
+    def count_tokens(self, text: str) -> int:
+        return count_tokens(text)
+
+    def embed(self, texts: List[str], create: Optional[Callable] = None) -> np.ndarray:
+        """`create` replaces openai.embeddings.create, e.g. to send the requests through a shared client."""
+        create = create or openai.embeddings.create
+        texts = list(texts)
+        vectors = []
+        for start in range(0, len(texts), self.max_inputs_per_request):
+            response = create(model=self.model, input=texts[start:start + self.max_inputs_per_request])
+            vectors.extend(item.embedding for item in response.data)
+        return np.array(vectors, dtype=np.float32)
+
+    async def aembed(self, texts: List[str], create: Callable[..., Awaitable]) -> np.ndarray:
+        """embed() with an async `create`, such as AsyncOpenAI's embeddings.create."""
+        texts = list(texts)
+        vectors = []
+        for start in range(0, len(texts), self.max_inputs_per_request):
+            response = await create(model=self.model, input=texts[start:start + self.max_inputs_per_request])
+            vectors.extend(item.embedding for item in response.data)
+        return np.array(vectors, dtype=np.float32)
+
+
+class SentenceTransformerEmbedder:
+    """
+    Embeds texts locally on the CPU with sentence-transformers. The model is
+    loaded on first use and shared by every caller in the process; vectors are
+    L2-normalized so distances behave like those of the OpenAI embeddings.
+    """
+
+    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2", batch_size: int = 64):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.name = f"sentence-transformers:{model_name}"
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model_name, device="cpu")
+        return self._model
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    @property
+    def max_tokens(self) -> int:
+        """Word-pieces of a text the model reads (the rest is truncated); [CLS] and [SEP] take two."""
+        return self.model.max_seq_length - 2
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.model.tokenizer.tokenize(text))
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = self.model.encode(
+            list(texts),
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+        return np.asarray(vectors, dtype=np.float32)
+
+
+_embedders = {}
+_embedders_lock = threading.Lock()
+
+def get_embedder(settings: dict):
+    """
+    Returns the embedding backend selected by settings.txt ("embedding_method"
+    is "openai" or "sentence-transformers"). One instance is kept per
+    configuration, so a local model is loaded only once per process.
+    """
+    method = settings.get("embedding_method", "openai").lower()
+    if method == "openai":
+        key = (method, settings.get("openai_embedding_model", "text-embedding-ada-002"))
+    elif method == "sentence-transformers":
+        key = (
+            method,
+            settings.get("sentence_transformer_model", "sentence-transformers/all-MiniLM-L6-v2"),
+            int(settings.get("embedding_batch_size", "64")),
+        )
+    else:
+        raise ValueError(f"Unknown embedding_method: {method}")
+
+    with _embedders_lock:
+        if key not in _embedders:
+            _embedders[key] = OpenAIEmbedder(*key[1:]) if method == "openai" else SentenceTransformerEmbedder(*key[1:])
+        return _embedders[key]
+
+
+def check_index_dimension(index_dimension: int, embedder) -> None:
+    """Raises ValueError if the stored index was built with a different embedding size."""
+    if index_dimension != embedder.dimension:
+        raise ValueError(
+            f"FAISS index has dimension {index_dimension} but {embedder.name} produces "
+            f"{embedder.dimension}-dimensional embeddings. Re-run the indexing scripts."
+        )
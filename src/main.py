@@ -1,6 +1,9 @@
 import os
 import sys
 import json
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import openai
 import faiss
 import numpy as np
@@ -10,29 +13,33 @@ from dotenv import load_dotenv
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.insert(0, project_root)
 
+from src.answer_cache import AnswerCache
+from src.bm25 import BM25Index
+from src.chunk_store import ChunkStore, InMemoryChunkStore, chunk_store_exists
+from src.context_builder import build_context
+from src.embedding_cache import EmbeddingCache
+from src.embeddings import OpenAIEmbedder, check_index_dimension, get_embedder
+from src.metrics import Tracer, note, stage
+from src.openai_clients import OpenAIClients
+from src.reranker import CrossEncoderReranker
+from src.session_store import SessionStore
+from src.settings import data_dir, read_settings, settings_path
+from src.single_flight import ABANDONED, SingleFlight, normalize_question
+from src.tokens import truncate_to_tokens
+from src.vector_index import index_config_from_settings, normalize_queries, set_search_params
+
 # Load environment variables and configure OpenAI API key
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
-if not openai.api_key:
-    print("OPENAI_API_KEY not found. Exiting.")
-    sys.exit(1)
-
-# Read simple key=value settings from settings.txt
-def read_settings(file_path):
-    settings = {}
-    with open(file_path, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line or "=" not in line:
-                continue
-            key, value = line.split("=", 1)
-            settings[key.strip()] = value.strip()
-    return settings
+
+logger = logging.getLogger(__name__)
 
 # Read settings from settings.txt at the project root.
-settings_path = os.path.join(project_root, "settings.txt")
 settings = read_settings(settings_path)
 
+def _setting_enabled(name, default):
+    return settings.get(name, default).lower() in ("yes", "true", "1")
+
 # Extract course metadata if available
 classname = settings.get("classname", "")
 professor = settings.get("professor", "")
@@ -41,131 +48,413 @@ classdescription = settings.get("classdescription", "")
 instructions = settings.get("instructions", "")
 assistant_name = settings.get("assistantname", "AI Assistant")
 
-# Load FAISS index and metadata
+# "parallel" runs the classifiers and the query embedding concurrently; "serial" runs them one after another
+execution_mode = settings.get("execution_mode", "parallel").lower()
+# "combined" asks one JSON routing call instead of separate syllabus/follow-up classifiers
+classifier_mode = settings.get("classifier_mode", "combined").lower()
+# "self_assessment" folds verification into the answer as a JSON field; "separate" uses verify_answer
+verification_mode = settings.get("verification_mode", "self_assessment").lower()
+
+# Chunks retrieved per question and the token budgets of the prompt context and the saved session
+num_chunks = int(settings.get("num_chunks", "8"))
+context_max_tokens = int(settings.get("context_max_tokens", "1500"))
+session_max_tokens = int(settings.get("session_max_tokens", "1000"))
+
+# OpenAI clients shared by all requests of the process: keep-alive connection pool, per-call
+# timeout and retries, and at most openai_max_concurrency upstream calls in flight
+openai_clients = OpenAIClients(
+    timeout=float(settings.get("openai_timeout", "30")),
+    max_retries=int(settings.get("openai_max_retries", "2")),
+    max_connections=int(settings.get("openai_max_connections", "100")),
+    max_concurrency=int(settings.get("openai_max_concurrency", "64")),
+)
+
+# Embedding backend chosen by embedding_method in settings.txt (OpenAI or local sentence-transformers)
+embedder = get_embedder(settings)
+
+# Query embedding cache; embedding_cache_persist=yes also keeps it in data/embedding_cache.sqlite
+embedding_cache = EmbeddingCache(
+    max_size=int(settings.get("embedding_cache_size", "10000")),
+    sqlite_path=(
+        os.path.join(data_dir, "embedding_cache.sqlite")
+        if _setting_enabled("embedding_cache_persist", "no")
+        else None
+    ),
+)
+
+# Semantic cache of verified replies, keyed on query embedding similarity
+answer_cache_enabled = _setting_enabled("answer_cache", "yes")
+answer_cache = AnswerCache(
+    max_distance=float(settings.get("answer_cache_distance", "0.05")),
+    max_size=int(settings.get("answer_cache_size", "1000")),
+    ttl=float(settings.get("answer_cache_ttl", "86400")),
+)
+
+# Per-user session context for follow-ups and answer-checks; session_store_persist=yes keeps it in
+# data/sessions.sqlite so all gunicorn workers on the machine share it
+sessions = SessionStore(
+    max_sessions=int(settings.get("session_store_size", "10000")),
+    ttl=float(settings.get("session_ttl", "3600")),
+    max_tokens=session_max_tokens,
+    sqlite_path=(
+        os.path.join(data_dir, "sessions.sqlite")
+        if _setting_enabled("session_store_persist", "no")
+        else None
+    ),
+)
+# Follow-ups are answered from the session's saved context, without embedding or searching again
+followup_reuse_context = _setting_enabled("followup_reuse_context", "yes")
+
+# Identical questions arriving while one is being answered wait for that answer instead of
+# running their own embedding, search and completions
+coalesce_requests = _setting_enabled("coalesce_requests", "yes")
+coalesce_wait_timeout = float(settings.get("coalesce_wait_timeout", "60"))
+flights = SingleFlight(on_shared=lambda: note(coalesced=True), timeout=coalesce_wait_timeout)
+
+# Per-request stage timings, token counts and outcomes; request_log=yes appends one JSON line per
+# request to data/request_log.jsonl, with the question text only if request_log_queries=yes
+tracer = Tracer(
+    log_path=(
+        os.path.join(data_dir, "request_log.jsonl")
+        if _setting_enabled("request_log", "yes")
+        else None
+    ),
+    log_queries=_setting_enabled("request_log_queries", "no"),
+)
+
+faiss_index_path = os.path.join(data_dir, "faiss_index.bin")
+
+# Hybrid retrieval fuses the FAISS ranking with a BM25 ranking of data/bm25_index.npz;
+# each retriever contributes hybrid_candidates results to reciprocal rank fusion
+hybrid_search = _setting_enabled("hybrid_search", "yes")
+hybrid_candidates = int(settings.get("hybrid_candidates", "30"))
+rrf_k = int(settings.get("rrf_k", "60"))
+bm25_index_path = os.path.join(data_dir, "bm25_index.npz")
+
+# Version of the course index on disk; changes whenever faiss_index.bin is rebuilt
+def index_version():
+    try:
+        stat = os.stat(faiss_index_path)
+    except OSError:
+        return None
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+# Build information written next to the index by create_final_data.py
+def load_index_info():
+    index_info_path = os.path.join(data_dir, "index_info.json")
+    if not os.path.exists(index_info_path):
+        return {}
+    with open(index_info_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def check_index_model(embedder, index_info):
+    built_with = index_info.get("embedding_model")
+    if built_with and built_with != embedder.name:
+        raise ValueError(
+            f"FAISS index was built with {built_with} but settings.txt selects {embedder.name}. "
+            "Re-run the indexing scripts."
+        )
+
+# With index_mmap=yes the vectors are memory-mapped instead of copied into each worker's heap,
+# so every process serving the same faiss_index.bin shares one copy through the OS page cache.
+index_mmap = _setting_enabled("index_mmap", "yes")
+
+def read_faiss_index(path):
+    if not index_mmap:
+        return faiss.read_index(path)
+    # IO_FLAG_MMAP_IFC (faiss >= 1.9) maps flat vector storage; older versions only map IVF lists
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    try:
+        return faiss.read_index(path, flags)
+    except RuntimeError as e:
+        logger.warning("Cannot memory-map %s (%s); loading it into memory.", path, e)
+        return faiss.read_index(path)
+
+# Load FAISS index and chunk metadata
 def load_faiss_resources():
-    data_dir = os.path.join(project_root, "data")
-    faiss_index_path = os.path.join(data_dir, "faiss_index.bin")
+    chunk_store_prefix = os.path.join(data_dir, "chunk_store")
     metadata_path = os.path.join(data_dir, "faiss_metadata.json")
-    if not os.path.exists(faiss_index_path) or not os.path.exists(metadata_path):
-        print("FAISS resources not found. Please run index creation script.")
-        sys.exit(1)
-    index = faiss.read_index(faiss_index_path)
-    with open(metadata_path, "r", encoding="utf-8") as f:
-        metadata = json.load(f)
-    return index, metadata
+    if not os.path.exists(faiss_index_path):
+        raise FileNotFoundError("FAISS resources not found. Please run index creation script.")
+    if chunk_store_exists(chunk_store_prefix):
+        chunk_store = ChunkStore(chunk_store_prefix)
+    elif os.path.exists(metadata_path):
+        # Indexes built before the chunk store kept all metadata in one JSON file
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            chunk_store = InMemoryChunkStore(json.load(f))
+    else:
+        raise FileNotFoundError("FAISS resources not found. Please run index creation script.")
+    index = read_faiss_index(faiss_index_path)
+    return index, chunk_store
+
+# Local cross-encoder that reorders the top rerank_candidates hits before the best num_chunks are sent
+reranker = None
+rerank_candidates = int(settings.get("rerank_candidates", "30"))
+if _setting_enabled("reranker", "yes"):
+    reranker = CrossEncoderReranker(
+        model_name=settings.get("reranker_model", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"),
+        batch_size=int(settings.get("reranker_batch_size", "32")),
+        cache_size=int(settings.get("reranker_cache_size", "10000")),
+    )
+
+# BM25 index for hybrid retrieval, or None when it is disabled or has not been built
+def load_bm25_index():
+    if not hybrid_search:
+        return None
+    if not os.path.exists(bm25_index_path):
+        logger.warning("No BM25 index at %s; using vector search only. Re-run create_final_data.py.", bm25_index_path)
+        return None
+    return BM25Index(bm25_index_path)
 
-faiss_index, faiss_metadata = load_faiss_resources()
+# Reciprocal rank fusion: merges rankings of chunk ids, best first
+def reciprocal_rank_fusion(rankings, k=60):
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
 
-# Embedding query using OpenAI embeddings
+# Embedding texts with the configured backend; OpenAI calls go through the shared client
+def embed_texts(texts):
+    if isinstance(embedder, OpenAIEmbedder):
+        return embedder.embed(texts, create=openai_clients.embeddings)
+    return embedder.embed(texts)
+
+# Embedding several queries in one backend call, skipping cached ones
+def embed_queries(queries):
+    queries = list(queries)
+    vectors = [embedding_cache.get(embedder.name, q) for q in queries]
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if missing:
+        with stage("embed"):
+            new_vectors = embed_texts([queries[i] for i in missing])
+        for i, vector in zip(missing, new_vectors):
+            vectors[i] = vector
+            embedding_cache.put(embedder.name, queries[i], vector)
+    return np.vstack(vectors)
+
+# Embedding a single query
 def embed_query(query):
-    response = openai.embeddings.create(model="text-embedding-ada-002", input=[query])
-    embedding = response.data[0].embedding
-    return np.array(embedding, dtype=np.float32)
-
-# Retrieve top-k context chunks from FAISS
-def get_context_from_query(query, k=3):
-    query_embedding = embed_query(query)
-    query_embedding = np.expand_dims(query_embedding, axis=0)
-    distances, indices = faiss_index.search(query_embedding, k)
-    chunks = []
-    for idx in indices[0]:
-        if idx < len(faiss_metadata):
-            chunks.append(faiss_metadata[idx]["chunk_text"])
-    return "\n\n".join(chunks)
-
-# Global variable to store context from last session
-last_session = None
-
-# Verify if the assistant's answer correctly addresses the question
+    return embed_queries([query])[0]
+
+# The LLM calls are split into a request builder and a response parser, so the
+# synchronous engine and the async app (src/async_engine.py) send identical requests
+
+def is_yes(response):
+    return response.choices[0].message.content.strip().lower().startswith("y")
+
+# Ask if the assistant's answer correctly addresses the question
+def verify_request(original_question, answer):
+    return dict(
+        model="gpt-4o-mini",
+        max_tokens=5,
+        temperature=0.0,
+        messages=[
+            {"role": "system", "content": "Just say 'Yes' or 'No'. Do not give any other answer."},
+            {"role": "user", "content":
+                f"User: {original_question}\nAttendant: {answer}\n"
+                "Was the Attendant able to answer the user's question?"
+            }
+        ]
+    )
+
 def verify_answer(original_question, answer):
-    prompt = [
-        {"role": "system", "content": "Just say 'Yes' or 'No'. Do not give any other answer."},
-        {"role": "user", "content":
-            f"User: {original_question}\nAttendant: {answer}\n"
-            "Was the Attendant able to answer the user's question?"
-        }
-    ]
-    response = openai.chat.completions.create(
+    return is_yes(openai_clients.chat(**verify_request(original_question, answer)))
+
+# Ask if a question relates to the syllabus
+def syllabus_request(question):
+    return dict(
         model="gpt-4o-mini",
         max_tokens=5,
         temperature=0.0,
-        messages=prompt
+        messages=[
+            {"role": "user", "content":
+                f"This question is from a student in {classname} taught by {professor} "
+                f"with the help of {assistants}. The class is {classdescription}. "
+                "Is this question likely about syllabus details? Answer Yes or No: "
+                f"{question}"
+            }
+        ]
     )
-    verdict = response.choices[0].message.content.strip().lower()
-    return verdict.startswith("y")
 
-# Determine if a question relates to the syllabus
 def check_syllabus(question):
-    prompt = [
-        {"role": "user", "content":
-            f"This question is from a student in {classname} taught by {professor} "
-            f"with the help of {assistants}. The class is {classdescription}. "
-            "Is this question likely about syllabus details? Answer Yes or No: "
-            f"{question}"
-        }
-    ]
-    response = openai.chat.completions.create(
+    return is_yes(openai_clients.chat(**syllabus_request(question)))
+
+# Ask if a new question is a follow-up
+def followup_request(new_question, previous_context):
+    return dict(
         model="gpt-4o-mini",
         max_tokens=5,
         temperature=0.0,
-        messages=prompt
+        messages=[
+            {"role": "user", "content":
+                f"Consider this new question: {new_question}. The previous question and response was: "
+                f"{previous_context}. Would it be helpful to include the previous context? Answer Yes or No."
+            }
+        ]
     )
-    result = response.choices[0].message.content.strip().lower()
-    return result.startswith("y")
 
-# Determine if a new question is a follow-up
 def check_followup(new_question, previous_context):
-    prompt = [
-        {"role": "user", "content":
-            f"Consider this new question: {new_question}. The previous question and response was: "
-            f"{previous_context}. Would it be helpful to include the previous context? Answer Yes or No."
-        }
-    ]
-    response = openai.chat.completions.create(
+    return is_yes(openai_clients.chat(**followup_request(new_question, previous_context)))
+
+# Ask in one call whether a question is syllabus-related and/or a follow-up
+def route_request(question, previous_context):
+    return dict(
         model="gpt-4o-mini",
-        max_tokens=5,
+        max_tokens=30,
         temperature=0.0,
-        messages=prompt
+        response_format={"type": "json_object"},
+        messages=[
+            {"role": "system", "content":
+                "Reply only with a JSON object with the boolean fields \"is_syllabus\" and \"is_followup\"."
+            },
+            {"role": "user", "content":
+                f"This question is from a student in {classname} taught by {professor} "
+                f"with the help of {assistants}. The class is {classdescription}.\n"
+                f"Question: {question}\n"
+                f"Previous question and response: {previous_context or 'none'}\n"
+                "is_syllabus: is this question likely about syllabus details?\n"
+                "is_followup: would it be helpful to include the previous context?"
+            }
+        ]
     )
-    result = response.choices[0].message.content.strip().lower()
-    return result.startswith("y")
 
-# Main interactive loop
-def main():
-    global last_session
+# (is_syllabus, is_followup) from a routing reply, or None if it is malformed
+def parse_route(response, previous_context):
+    try:
+        verdict = json.loads(response.choices[0].message.content)
+        return bool(verdict["is_syllabus"]), bool(verdict["is_followup"]) and bool(previous_context)
+    except (ValueError, KeyError, TypeError):
+        logger.warning("Malformed routing verdict; falling back to separate classifiers.")
+        return None
 
-    user_input = input("Enter your prompt: ").strip()
+def route_question(question, previous_context):
+    verdict = parse_route(openai_clients.chat(**route_request(question, previous_context)), previous_context)
+    if verdict is None:
+        is_syllabus = check_syllabus(question)
+        is_followup = bool(previous_context) and check_followup(question, previous_context)
+        verdict = is_syllabus, is_followup
+    return verdict
+
+SELF_ASSESSMENT_INSTRUCTIONS = (
+    "Reply only with a JSON object with two fields: \"answer\", your full reply to the user, and "
+    "\"answered\", a boolean that is true only if your reply actually answers the user's question."
+)
+
+# Chat completion request; with self-assessment the model also returns its own verdict
+def completion_request(messages, self_assessment=False):
+    if not self_assessment:
+        return dict(model="gpt-4o-mini", messages=messages)
+    messages = [dict(messages[0], content=messages[0]["content"] + "\n\n" + SELF_ASSESSMENT_INSTRUCTIONS)] + messages[1:]
+    return dict(model="gpt-4o-mini", response_format={"type": "json_object"}, messages=messages)
+
+# (reply, verdict) from a completion; the verdict is None without a usable self-assessment
+def parse_completion(response, self_assessment=False):
+    content = response.choices[0].message.content.strip()
+    if not self_assessment:
+        return content, None
+    try:
+        result = json.loads(content)
+        return str(result["answer"]).strip(), bool(result["answered"])
+    except (ValueError, KeyError, TypeError):
+        logger.warning("Malformed self-assessment; verifying separately.")
+        return content, None
+
+def complete(messages, self_assessment=False):
+    return parse_completion(openai_clients.chat(**completion_request(messages, self_assessment)), self_assessment)
+
+def stream_request(messages):
+    # include_usage adds a final chunk with the token counts for the metrics
+    return dict(model="gpt-4o-mini", messages=messages, stream=True, stream_options={"include_usage": True})
 
-    # Detect question type
-    question_type = "normal"
+def build_messages(prompt_instructions, context, final_query):
+    return [
+        {"role": "system", "content": prompt_instructions + "\n\nContext:\n" + context},
+        {"role": "user", "content": final_query}
+    ]
+
+CANNOT_ANSWER = "I'm sorry but I cannot answer that question. Can you rephrase or ask an alternative?"
+
+QUESTION_TYPES = ("normal", "multiple_choice", "answer_check")
+
+# Question rewrites applied when the classifiers say Yes
+def syllabus_question(question):
+    return f"I may be asking about the syllabus for {classname}. {question}"
+
+def followup_question(question, previous_context):
+    return f"I have a follow-up. Previous context:\n{previous_context}\nMy question: {question}"
+
+# Split the "m:" / "a:" prefix off a raw prompt
+def parse_question_type(user_input):
+    user_input = user_input.strip()
     if user_input.lower().startswith("m:"):
-        question_type = "multiple_choice"
-        user_input = user_input[2:].strip()
-    elif user_input.lower().startswith("a:"):
-        question_type = "answer_check"
-        user_input = user_input[2:].strip()
-
-    original_question = user_input
-
-    # Adjust question for syllabus-related or follow-up (normal only)
-    if question_type == "normal":
-        if check_syllabus(user_input):
-            print("Detected syllabus-related question; modifying query.")
-            original_question = f"I may be asking about the syllabus for {classname}. {user_input}"
-        if last_session and check_followup(user_input, last_session):
-            print("Detected follow-up question; incorporating previous context.")
-            original_question = f"I have a follow-up. Previous context:\n{last_session}\nMy question: {user_input}"
-
-    # Retrieve context
-    context = ""
-    if question_type != "answer_check":
-        context = get_context_from_query(original_question, k=3)
-        print("Retrieved context from course materials.")
-    else:
-        if last_session:
-            context = last_session
+        return "multiple_choice", user_input[2:].strip()
+    if user_input.lower().startswith("a:"):
+        return "answer_check", user_input[2:].strip()
+    return "normal", user_input
+
+# Every rewrite of a question the router can pick; _route_parallel embeds them all speculatively
+def route_candidates(user_input, previous_context):
+    candidates = [user_input, syllabus_question(user_input)]
+    # A follow-up that reuses the saved context needs no embedding
+    if previous_context and not followup_reuse_context:
+        candidates.append(followup_question(user_input, previous_context))
+    return candidates
+
+# Index of the routed question in route_candidates(), or None for a follow-up answered from the saved context
+def route_choice(is_syllabus, is_followup):
+    choice = 0
+    if is_syllabus:
+        logger.info("Detected syllabus-related question; modifying query.")
+        choice = 1
+    if is_followup:
+        logger.info("Detected follow-up question; incorporating previous context.")
+        choice = None if followup_reuse_context else 2
+    return choice
+
+# Answer-checks and follow-ups that reuse the saved context skip embedding and search
+def needs_retrieval(question_type, is_followup):
+    return question_type != "answer_check" and not (is_followup and followup_reuse_context)
+
+# Answer-checks depend on the previous session; multiple-choice replies are never verified, so never stored
+def answer_cacheable(question_type):
+    return answer_cache_enabled and question_type not in ("answer_check", "multiple_choice")
+
+# Embedding of the question as asked, when routing kept it and embedded it (parallel mode), else None
+def own_embedding(user_input, routed):
+    return routed[1] if routed[0] == user_input else None
+
+# Single-flight key: the same question, of the same type, against the same course index.
+# "question" keys cover a whole pipeline run, "routed" keys the part after per-user routing.
+def flight_key(stage, question, question_type):
+    return stage, normalize_question(question), question_type, index_version()
+
+# Questions without previous context do not depend on the user, so identical ones can share a whole run
+def coalesce_question(question_type, previous_context):
+    return coalesce_requests and question_type != "answer_check" and not previous_context
+
+# After routing only follow-ups and answer-checks still depend on the user's session
+def coalesce_routed(question_type, is_followup):
+    return coalesce_requests and question_type != "answer_check" and not is_followup
+
+def finish_prepare(user_input, question_type, previous_context, original_question, is_followup, context):
+    """
+    Second half of RAGEngine._prepare(), after retrieval: takes the session
+    context when nothing was retrieved (context is None) and builds the prompt.
+    """
+    if is_followup:
+        note(followup=True)
+    final_query = original_question
+    if context is None:
+        if question_type == "answer_check":
+            context = previous_context or ""
+            if not previous_context:
+                logger.info("No previous context for answer-check.")
         else:
-            print("No previous context for answer-check.")
+            # The saved context is already the prompt context, so the question need not repeat it
+            context = previous_context
+            final_query = f"I have a follow-up. My question: {user_input}"
+            logger.info("Reusing the session context for the follow-up.")
 
     # Build system prompt based on question type
     if question_type == "multiple_choice":
@@ -180,58 +469,446 @@ def main():
             f"You are a precise TA in {classname}. Using only the context, tell me if the provided answer is correct. "
             "Just state the answer and rationale."
         )
-        final_query = original_question
     else:
         prompt_instructions = (
             f"You are {assistant_name}, a TA for {classname} ({classdescription}). "
             "Answer step-by-step in up to three paragraphs if found in context; otherwise say \"I don't know.\""
         )
-        final_query = original_question
 
-    system_message = prompt_instructions + "\n\nContext:\n" + context
-    messages = [
-        {"role": "system", "content": system_message},
-        {"role": "user", "content": final_query}
-    ]
+    return original_question, context, prompt_instructions, final_query, is_followup
 
-    # Send initial query
-    print("Sending query to OpenAI...")
-    response = openai.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages
-    )
-    reply = response.choices[0].message.content.strip()
-
-    # Save context for follow-up or answer-check
-    if question_type != "answer_check":
-        last_session = context[:3900]
-
-    # For non-multiple_choice, verify and possibly retry
-    if question_type != "multiple_choice":
-        verified = verify_answer(original_question, reply)
-        print("Answer verification:", "Yes" if verified else "No")
-        if not verified and question_type != "answer_check":
-            print("Attempting follow-up query with extended context.")
-            alt_context = get_context_from_query(original_question + " " + context, k=5)
-            followup_system = prompt_instructions + "\n\nContext:\n" + alt_context
-            followup_messages = [
-                {"role": "system", "content": followup_system},
-                {"role": "user", "content": final_query}
-            ]
-            followup_response = openai.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=followup_messages
+
+class RAGEngine:
+    """
+    Answers course questions against the FAISS index.
+    The index and chunk store are opened once when the engine is created, so a
+    long-lived process (e.g. a gunicorn worker) pays for them only at startup.
+    """
+
+    def __init__(self, index=None, chunk_store=None, index_info=None, bm25_index=None):
+        if index is None or chunk_store is None:
+            index, chunk_store = load_faiss_resources()
+            index_info = load_index_info()
+            bm25_index = load_bm25_index()
+        elif isinstance(chunk_store, list):
+            chunk_store = InMemoryChunkStore(chunk_store)
+        index_info = index_info or {}
+        check_index_dimension(index.d, embedder)
+        check_index_model(embedder, index_info)
+        # Queries must be normalized like the indexed vectors; nprobe/efSearch come from settings.txt
+        self.index_metric = index_info.get("index", {}).get("metric", "l2")
+        set_search_params(index, index_config_from_settings(settings))
+        self.faiss_index = index
+        # Chunk metadata by id; only the records of search hits are ever decoded
+        self.chunk_store = chunk_store
+        # Lexical index fused with the vector ranking; None means vector search only
+        self.bm25_index = bm25_index
+        self._executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="rag")
+
+    def search(self, query_embeddings, k, queries=None):
+        """
+        Runs one FAISS search over a matrix of query embeddings and returns, per
+        query, a list of (chunk record, distance) pairs for the top-k hits.
+        Given the query texts and a BM25 index, the vector and BM25 rankings
+        are fused; chunks found only by BM25 have a distance of None.
+        """
+        fused = self.bm25_index is not None and queries is not None
+        depth = max(k, hybrid_candidates) if fused else k
+        query_embeddings = normalize_queries(np.atleast_2d(query_embeddings), self.index_metric)
+        distances, indices = self.faiss_index.search(query_embeddings, depth)
+        results = []
+        for i, (row_distances, row_indices) in enumerate(zip(distances, indices)):
+            vector_hits = {int(idx): float(distance) for distance, idx in zip(row_distances, row_indices) if idx >= 0}
+            ranking = list(vector_hits)
+            if fused:
+                lexical_ids, _ = self.bm25_index.search(queries[i], depth)
+                ranking = reciprocal_rank_fusion([ranking, lexical_ids.tolist()], rrf_k)
+            top = ranking[:k]
+            results.append([
+                (record, vector_hits.get(chunk_id))
+                for chunk_id, record in zip(top, self.chunk_store.get_many(top))
+                if record is not None
+            ])
+        return results
+
+    # Retrieve the top-k chunks from FAISS and assemble them into a context of at most max_tokens
+    def get_context_from_query(self, query, k=None, query_embedding=None, max_tokens=None):
+        if query_embedding is None:
+            query_embedding = embed_query(query)
+        hits = self.retrieve([query], np.atleast_2d(query_embedding), k or num_chunks)[0]
+        return build_context(hits, max_tokens or context_max_tokens)
+
+    def retrieve(self, queries, query_embeddings, k):
+        """
+        Top-k (record, distance) hits per query. With the reranker enabled,
+        rerank_candidates hits are fetched and the cross-encoder picks the best k.
+        """
+        if reranker is None:
+            with stage("search"):
+                return self.search(query_embeddings, k, queries)
+        with stage("search"):
+            candidates = self.search(query_embeddings, max(k, rerank_candidates), queries)
+        with stage("rerank"):
+            return [reranker.rerank(query, hits, k) for query, hits in zip(queries, candidates)]
+
+    def retrieve_batch(self, queries, k=None):
+        """
+        Retrieves the top-k chunks for many queries at once: one embedding call
+        (cached queries are skipped) and one FAISS search over all of them.
+        """
+        if not queries:
+            return []
+        return self.retrieve(queries, embed_queries(queries), k or num_chunks)
+
+    def _submit(self, fn, *args):
+        # Runs fn in the engine's thread pool within the caller's request trace and stage
+        return self._executor.submit(contextvars.copy_context().run, fn, *args)
+
+    def _route_serial(self, user_input, previous_context):
+        original_question = user_input
+        with stage("classify"):
+            if classifier_mode == "combined":
+                is_syllabus, is_followup = route_question(user_input, previous_context)
+            else:
+                is_syllabus = check_syllabus(user_input)
+                is_followup = bool(previous_context) and check_followup(user_input, previous_context)
+        if is_syllabus:
+            logger.info("Detected syllabus-related question; modifying query.")
+            original_question = syllabus_question(user_input)
+        if is_followup:
+            logger.info("Detected follow-up question; incorporating previous context.")
+            original_question = followup_question(user_input, previous_context)
+        return original_question, None, is_followup
+
+    def _route_parallel(self, user_input, previous_context, lookup=None):
+        """
+        Runs the classifier(s) concurrently with a single embeddings call that
+        speculatively covers every possible rewrite of the question, so the
+        embedding for whichever rewrite wins is ready without another round-trip.
+        Returns (hit, routed). With a lookup function, it is called with the
+        embedding of the question as asked as soon as that arrives; a result
+        other than None is returned as hit without waiting for the classifiers.
+        """
+        candidates = route_candidates(user_input, previous_context)
+        embeddings_future = self._submit(embed_queries, candidates)
+        with stage("classify"):
+            if classifier_mode == "combined":
+                classifiers = [self._submit(route_question, user_input, previous_context)]
+            else:
+                classifiers = [self._submit(check_syllabus, user_input)]
+                if previous_context:
+                    classifiers.append(self._submit(check_followup, user_input, previous_context))
+            if lookup is not None:
+                hit = lookup(embeddings_future.result()[0])
+                if hit is not None:
+                    # Classifiers that have not started are dropped; a running one's verdict is ignored
+                    for future in classifiers:
+                        future.cancel()
+                    return hit, None
+            verdicts = [future.result() for future in classifiers]
+        if classifier_mode == "combined":
+            is_syllabus, is_followup = verdicts[0]
+        else:
+            is_syllabus, is_followup = verdicts[0], len(verdicts) > 1 and verdicts[1]
+
+        choice = route_choice(is_syllabus, is_followup)
+        if choice is None:
+            return None, (followup_question(user_input, previous_context), None, True)
+        return None, (candidates[choice], embeddings_future.result()[choice], is_followup)
+
+    def _route(self, user_input, question_type, previous_context):
+        """(original_question, query_embedding, is_followup); only normal questions are routed."""
+        if question_type != "normal":
+            return user_input, None, False
+        if execution_mode == "parallel":
+            return self._route_parallel(user_input, previous_context)[1]
+        return self._route_serial(user_input, previous_context)
+
+    def _route_new(self, user_input, question_type):
+        """
+        (cached, routed) for a question asked without previous context: cached
+        is the (reply, context) of an answer-cache hit, otherwise None and routed
+        is _route()'s result. Such a question cannot be a follow-up, so the cache
+        is consulted before routing finishes: in parallel mode with the question's
+        embedding from routing as soon as it arrives, and a miss retrieves with
+        the same embeddings.
+        """
+        if not answer_cacheable(question_type):
+            return None, self._route(user_input, question_type, None)
+        if execution_mode == "parallel" and question_type == "normal":
+            return self._route_parallel(
+                user_input, None, lambda embedding: self._cached_answer(user_input, question_type, embedding)
             )
-            followup_reply = followup_response.choices[0].message.content.strip()
-            if verify_answer(original_question, followup_reply):
-                reply = followup_reply
+        cached = self._cached_answer(user_input, question_type)
+        if cached is not None:
+            return cached, None
+        return None, self._route(user_input, question_type, None)
+
+    def _prepare(self, user_input, question_type, previous_context, routed):
+        """
+        Retrieves context for a routed question and builds the prompt. Returns
+        (original_question, context, prompt_instructions, final_query, is_followup).
+        """
+        original_question, query_embedding, is_followup = routed
+        context = None
+        if needs_retrieval(question_type, is_followup):
+            context = self.get_context_from_query(original_question, query_embedding=query_embedding)
+            logger.info("Retrieved context from course materials.")
+        return finish_prepare(user_input, question_type, previous_context, original_question, is_followup, context)
+
+    def _cached_answer(self, user_input, question_type, query_embedding=None):
+        """
+        Returns (reply, context) cached for a question close enough to one answered
+        before, if answer_cacheable(question_type).
+        """
+        if not answer_cacheable(question_type):
+            return None
+        if query_embedding is None:
+            query_embedding = embed_query(user_input)
+        hit = answer_cache.lookup(query_embedding, question_type, index_version())
+        if hit is not None:
+            logger.info("Answered from the semantic answer cache.")
+            note(answer_cache_hit=True)
+        return hit
+
+    def _cache_answer(self, user_input, question_type, reply, context, query_embedding=None):
+        if answer_cacheable(question_type):
+            if query_embedding is None:
+                query_embedding = embed_query(user_input)
+            answer_cache.store(query_embedding, question_type, reply, truncate_to_tokens(context, session_max_tokens), index_version())
+
+    def _retry(self, original_question, context, prompt_instructions, final_query, self_assessment=False):
+        """
+        Asks again with a wider context; returns the new reply or an apology if it
+        still fails verification. With the reranker the first context already
+        holds the best candidates, so there is no second attempt.
+        """
+        if reranker is not None:
+            return CANNOT_ANSWER
+        logger.info("Attempting follow-up query with extended context.")
+        alt_context = self.get_context_from_query(
+            original_question + " " + context, k=2 * num_chunks, max_tokens=2 * context_max_tokens
+        )
+        followup_reply, followup_verified = complete(build_messages(prompt_instructions, alt_context, final_query), self_assessment)
+        if followup_verified is None:
+            followup_verified = verify_answer(original_question, followup_reply)
+        if followup_verified:
+            return followup_reply
+        return CANNOT_ANSWER
+
+    def _complete_answer(self, user_input, question_type, previous_context, routed):
+        """Retrieval, completion, verification and caching of a routed question. Returns (reply, context)."""
+        original_question, context, prompt_instructions, final_query, is_followup = self._prepare(
+            user_input, question_type, previous_context, routed
+        )
+
+        # Multiple-choice answers are not verified, so they never need a self-assessment
+        self_assessment = verification_mode == "self_assessment" and question_type != "multiple_choice"
+
+        # Send initial query
+        logger.info("Sending query to OpenAI...")
+        with stage("completion"):
+            reply, verified = complete(build_messages(prompt_instructions, context, final_query), self_assessment)
+
+        # For non-multiple_choice, verify and possibly retry
+        if question_type != "multiple_choice":
+            if verified is None:
+                with stage("verify"):
+                    verified = verify_answer(original_question, reply)
+            logger.info("Answer verification: %s", "Yes" if verified else "No")
+            note(verified=verified)
+            if not verified and question_type != "answer_check":
+                note(retried=True)
+                with stage("retry"):
+                    reply = self._retry(original_question, context, prompt_instructions, final_query, self_assessment)
+                verified = reply != CANNOT_ANSWER
+            # Only verified replies to self-contained questions are reused for later students
+            if verified and not is_followup:
+                self._cache_answer(user_input, question_type, reply, context, own_embedding(user_input, routed))
+
+        return reply, context
+
+    def _answer_new(self, user_input, question_type):
+        """(reply, context) for a question asked without previous context."""
+        cached, routed = self._route_new(user_input, question_type)
+        if cached is not None:
+            return cached
+        return self._complete_answer(user_input, question_type, None, routed)
+
+    def _answer_in_session(self, user_input, question_type, previous_context):
+        """
+        (reply, context) for a question asked after an earlier one. Routing sees
+        the user's own context; what follows is shared unless it is a follow-up.
+        """
+        routed = self._route(user_input, question_type, previous_context)
+        is_followup = routed[2]
+
+        def run():
+            cached = None if is_followup else self._cached_answer(
+                user_input, question_type, own_embedding(user_input, routed)
+            )
+            return cached or self._complete_answer(user_input, question_type, previous_context, routed)
+
+        if not coalesce_routed(question_type, is_followup):
+            return run()
+        return flights.run(flight_key("routed", routed[0], question_type), run)
+
+    def answer(self, query, question_type="normal", session_id=None):
+        """
+        Runs the full pipeline for one question and returns the final reply.
+        question_type is one of "normal", "multiple_choice" or "answer_check";
+        session_id identifies the user whose previous context follow-ups and
+        answer-checks see (None: no session). Identical questions asked while
+        one is in progress share its answer.
+        """
+        user_input = query.strip()
+        with tracer.request(question_type, user_input):
+            previous_context = sessions.get(session_id)
+            if previous_context:
+                reply, context = self._answer_in_session(user_input, question_type, previous_context)
+            elif coalesce_question(question_type, previous_context):
+                reply, context = flights.run(
+                    flight_key("question", user_input, question_type), lambda: self._answer_new(user_input, question_type)
+                )
             else:
-                reply = "I'm sorry but I cannot answer that question. Can you rephrase or ask an alternative?"
+                reply, context = self._answer_new(user_input, question_type)
 
-    print("\nFinal Answer:\n", reply)
+            # Save context for follow-up or answer-check
+            if question_type != "answer_check":
+                sessions.put(session_id, context)
+        return reply
 
-if __name__ == "__main__":
-    main()
+    def _stream_answer(self, user_input, question_type, previous_context, routed):
+        """
+        Streaming _complete_answer(): yields the (event, data) pairs of
+        answer_stream() except "done", and returns (reply, context).
+        """
+        original_question, context, prompt_instructions, final_query, is_followup = self._prepare(
+            user_input, question_type, previous_context, routed
+        )
+
+        logger.info("Streaming query to OpenAI...")
+        pieces = []
+        with stage("completion"):
+            stream = openai_clients.chat(**stream_request(build_messages(prompt_instructions, context, final_query)))
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content
+                if token:
+                    pieces.append(token)
+                    yield "token", token
+        reply = "".join(pieces).strip()
+
+        # Verification runs once the student already has the streamed answer
+        if question_type != "multiple_choice":
+            with stage("verify"):
+                verified = verify_answer(original_question, reply)
+            logger.info("Answer verification: %s", "Yes" if verified else "No")
+            note(verified=verified)
+            if not verified and question_type != "answer_check":
+                note(retried=True)
+                with stage("retry"):
+                    reply = self._retry(original_question, context, prompt_instructions, final_query)
+                verified = reply != CANNOT_ANSWER
+                yield "correction", reply
+            if verified and not is_followup:
+                self._cache_answer(user_input, question_type, reply, context, own_embedding(user_input, routed))
+
+        return reply, context
+
+    def _stream_coalesced(self, key, make_stream):
+        """
+        Runs the stream of make_stream() as the leader of `key`, or, if an
+        identical request is already streaming, yields its final reply as one
+        token. Returns (reply, context) like _stream_answer().
+        """
+        flight, leader = flights.join(key)
+        if not leader:
+            result = flights.wait(flight)
+            if result is not None:
+                yield "token", result[0]
+                return result
+            # The leader was abandoned (its client went away) or is taking too long; answer this request directly
+            return (yield from make_stream())
+        try:
+            result = yield from make_stream()
+        except ABANDONED:
+            flights.finish(key, flight, abandoned=True)
+            raise
+        except BaseException as e:
+            flights.finish(key, flight, error=e)
+            raise
+        flights.finish(key, flight, result=result)
+        return result
+
+    def _stream_new(self, user_input, question_type):
+        cached, routed = self._route_new(user_input, question_type)
+        if cached is not None:
+            yield "token", cached[0]
+            return cached
+        return (yield from self._stream_answer(user_input, question_type, None, routed))
+
+    def _stream_in_session(self, user_input, question_type, previous_context):
+        routed = self._route(user_input, question_type, previous_context)
+        is_followup = routed[2]
+
+        def make_stream():
+            cached = None if is_followup else self._cached_answer(
+                user_input, question_type, own_embedding(user_input, routed)
+            )
+            if cached is not None:
+                yield "token", cached[0]
+                return cached
+            return (yield from self._stream_answer(user_input, question_type, previous_context, routed))
 
+        if not coalesce_routed(question_type, is_followup):
+            return (yield from make_stream())
+        return (yield from self._stream_coalesced(flight_key("routed", routed[0], question_type), make_stream))
 
+    def answer_stream(self, query, question_type="normal", session_id=None):
+        """
+        Like answer(), but yields (event, data) pairs as the reply is generated:
+        "token" for each piece of the answer, then "correction" with a replacement
+        reply if verification fails, and finally "done". A request joining an
+        identical one in progress gets the final reply as a single token.
+        """
+        user_input = query.strip()
+        with tracer.request(question_type, user_input):
+            previous_context = sessions.get(session_id)
+            if previous_context:
+                reply, context = yield from self._stream_in_session(user_input, question_type, previous_context)
+            elif coalesce_question(question_type, previous_context):
+                reply, context = yield from self._stream_coalesced(
+                    flight_key("question", user_input, question_type), lambda: self._stream_new(user_input, question_type)
+                )
+            else:
+                reply, context = yield from self._stream_new(user_input, question_type)
+
+            if question_type != "answer_check":
+                sessions.put(session_id, context)
+        yield "done", None
+
+
+# Main interactive loop
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if not openai.api_key:
+        print("OPENAI_API_KEY not found. Exiting.")
+        sys.exit(1)
 
+    try:
+        engine = RAGEngine()
+    except (FileNotFoundError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+
+    user_input = input("Enter your prompt: ").strip()
+    question_type, user_input = parse_question_type(user_input)
+    reply = engine.answer(user_input, question_type, session_id="cli")
+
+    print("\nFinal Answer:\n", reply)
+
+if __name__ == "__main__":
+    main()
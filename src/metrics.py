@@ -0,0 +1,283 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Request tracing and Prometheus-style metrics of one process. Code on the hot
+# path wraps each stage in `with stage(...)`; the OpenAI clients record every
+# LLM call with its token usage against the innermost stage. Both feed the
+# process-wide histograms and counters rendered at /metrics and the trace of
+# the current request, which Tracer writes to the JSONL request log.
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+logger = logging.getLogger(__name__)
+
+_current_trace = contextvars.ContextVar("rag_trace", default=None)
+_current_stage = contextvars.ContextVar("rag_stage", default=None)
+
+
+def _reset(var: contextvars.ContextVar, token: contextvars.Token) -> None:
+    # A streaming generator may be closed from another context (e.g. when it is garbage collected)
+    try:
+        var.reset(token)
+    except ValueError:
+        var.set(None)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def family(name: str, kind: str, help_text: str, samples: Iterable[Tuple[Dict[str, object], float]]) -> List[str]:
+    """Exposition lines of one metric family given as (labels, value) samples."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+    return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return family(self.name, "counter", self.help_text,
+                      ((dict(zip(self.label_names, labels)), value) for labels, value in items))
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((labels, list(entry)) for labels, entry in self._values.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, entry in items:
+            for bound, count in zip(self.buckets + (float("inf"),), entry[:len(self.buckets)] + [entry[-1]]):
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names + ('le',), labels + (le,))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {entry[-2]!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {entry[-1]}")
+        return lines
+
+
+REQUESTS = Counter("rag_requests_total", "Chat requests by question type and outcome.", ("question_type", "outcome"))
+REQUEST_SECONDS = Histogram("rag_request_seconds", "Chat request latency.", ("question_type",))
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Time spent per pipeline stage.", ("stage",))
+LLM_CALLS = Counter("rag_llm_calls_total", "OpenAI calls by stage and model.", ("stage", "model"))
+LLM_SECONDS = Histogram("rag_llm_call_seconds", "OpenAI call latency by stage.", ("stage",))
+LLM_TOKENS = Counter("rag_llm_tokens_total", "OpenAI tokens by stage, model and kind (prompt or completion).",
+                     ("stage", "model", "kind"))
+RETRIES = Counter("rag_retries_total", "Answers that failed verification and were retried with a wider context.")
+
+METRICS = (REQUESTS, REQUEST_SECONDS, STAGE_SECONDS, LLM_CALLS, LLM_SECONDS, LLM_TOKENS, RETRIES)
+
+
+def render_metrics(extra_lines: Sequence[str] = ()) -> str:
+    """The Prometheus text exposition of this process's metrics."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.extend(extra_lines)
+    return "\n".join(lines) + "\n"
+
+
+class RequestTrace:
+    """What one request did: stage timings, LLM calls with their token usage, and outcome flags."""
+
+    def __init__(self, question_type: str, query: Optional[str] = None):
+        self.request_id = uuid.uuid4().hex[:16]
+        self.question_type = question_type
+        self.query = query
+        self.started = time.time()
+        self.seconds = 0.0
+        self.stages = {}  # stage -> total seconds
+        self.llm_calls = []
+        self.answer_cache_hit = False
+        self.coalesced = False
+        self.followup = False
+        self.retried = False
+        self.verified = None
+        self.outcome = None
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_llm_call(self, call: dict) -> None:
+        with self._lock:
+            self.llm_calls.append(call)
+
+    def record(self) -> dict:
+        with self._lock:
+            calls = list(self.llm_calls)
+            stages = {name: round(seconds, 4) for name, seconds in self.stages.items()}
+        record = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(self.started)) + "Z",
+            "request_id": self.request_id,
+            "question_type": self.question_type,
+            "outcome": self.outcome,
+            "seconds": round(self.seconds, 4),
+            "stages": stages,
+            "llm_calls": calls,
+            "prompt_tokens": sum(call["prompt_tokens"] for call in calls),
+            "completion_tokens": sum(call["completion_tokens"] for call in calls),
+            "answer_cache_hit": self.answer_cache_hit,
+            "coalesced": self.coalesced,
+            "followup": self.followup,
+            "retried": self.retried,
+            "verified": self.verified,
+        }
+        if self.query is not None:
+            record["query"] = self.query
+        return record
+
+
+def note(**fields) -> None:
+    """Sets outcome flags (e.g. retried=True) on the current request's trace, if any."""
+    trace = _current_trace.get()
+    if trace is not None:
+        for name, value in fields.items():
+            setattr(trace, name, value)
+    if fields.get("retried"):
+        RETRIES.inc()
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Times a pipeline stage; LLM calls made inside it are attributed to it."""
+    token = _current_stage.set(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _reset(_current_stage, token)
+        STAGE_SECONDS.observe(seconds, name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_stage(name, seconds)
+
+
+def record_llm_call(model: str, seconds: float, usage) -> None:
+    """Counts one OpenAI call and its token usage (None when the response had none)."""
+    stage_name = _current_stage.get() or "other"
+    prompt_tokens = (getattr(usage, "prompt_tokens", 0) or 0) if usage is not None else 0
+    completion_tokens = (getattr(usage, "completion_tokens", 0) or 0) if usage is not None else 0
+    LLM_CALLS.inc(stage_name, model)
+    LLM_SECONDS.observe(seconds, stage_name)
+    LLM_TOKENS.inc(stage_name, model, "prompt", amount=prompt_tokens)
+    LLM_TOKENS.inc(stage_name, model, "completion", amount=completion_tokens)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_llm_call({
+            "stage": stage_name,
+            "model": model,
+            "seconds": round(seconds, 4),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+        })
+
+
+class Tracer:
+    """
+    Opens a trace per chat request. When it ends, the request is counted in
+    the metrics and, with a log_path, appended as one JSON line to the request
+    log. Every worker appends whole lines to the same file.
+    """
+
+    def __init__(self, log_path: Optional[str] = None, log_queries: bool = False):
+        self.log_path = log_path
+        self.log_queries = log_queries
+
+    @contextlib.contextmanager
+    def request(self, question_type: str, query: str, log: bool = True):
+        """Traces one request; with log=False the caller writes the log line (see arequest())."""
+        trace = RequestTrace(question_type, query if self.log_queries else None)
+        token = _current_trace.set(trace)
+        start = time.perf_counter()
+        try:
+            yield trace
+        except (GeneratorExit, asyncio.CancelledError, KeyboardInterrupt):
+            # The client went away or the server is shutting down
+            trace.outcome = "abandoned"
+            raise
+        except BaseException:
+            trace.outcome = "error"
+            raise
+        finally:
+            _reset(_current_trace, token)
+            trace.seconds = time.perf_counter() - start
+            if trace.outcome is None:
+                trace.outcome = "cached" if trace.answer_cache_hit else "coalesced" if trace.coalesced else "answered"
+            REQUESTS.inc(question_type, trace.outcome)
+            REQUEST_SECONDS.observe(trace.seconds, question_type)
+            if log:
+                self._log(trace)
+
+    @contextlib.asynccontextmanager
+    async def arequest(self, question_type: str, query: str):
+        """request() for the event loop: the log line is appended in a thread, not on the loop."""
+        trace = None
+        try:
+            with self.request(question_type, query, log=False) as trace:
+                yield trace
+        finally:
+            if trace is not None and self.log_path is not None:
+                await asyncio.to_thread(self._log, trace)
+
+    def _log(self, trace: RequestTrace) -> None:
+        if self.log_path is None:
+            return
+        line = json.dumps(trace.record(), ensure_ascii=False) + "\n"
+        try:
+            # One write per line on a file opened for appending, so lines from different workers do not interleave
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            logger.warning("Cannot write the request log %s: %s", self.log_path, e)
@@ -0,0 +1,175 @@
+import asyncio
+import os
+import threading
+import time
+
+import httpx
+import openai
+
+from src.metrics import record_llm_call
+
+
+class OpenAIClients:
+    """
+    The OpenAI clients of one process: a synchronous client for the Flask app,
+    the CLI and worker threads, and an AsyncOpenAI client for the async app.
+    Both keep a keep-alive connection pool of max_connections, give every
+    upstream call `timeout` seconds and max_retries retries, and let at most
+    max_concurrency calls be in flight at once; further calls wait for a slot.
+    Clients are created on first use and again after a fork, since pooled
+    connections must not be shared between processes.
+    """
+
+    def __init__(self, timeout: float = 30.0, max_retries: int = 2, max_connections: int = 100,
+                 max_concurrency: int = 64):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._client = None
+        self._async_client = None
+        self._slots = None
+        self._async_slots = None
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+
+    def _check_pid(self) -> None:
+        if self._pid != os.getpid():
+            self._client = None
+            self._async_client = None
+            self._slots = threading.BoundedSemaphore(self.max_concurrency)
+            self._async_slots = None
+            self._pid = os.getpid()
+
+    @property
+    def client(self) -> openai.OpenAI:
+        with self._lock:
+            self._check_pid()
+            if self._client is None:
+                self._client = openai.OpenAI(
+                    api_key=openai.api_key,
+                    timeout=self.timeout,
+                    max_retries=self.max_retries,
+                    http_client=openai.DefaultHttpxClient(limits=self._limits()),
+                )
+            return self._client
+
+    @property
+    def async_client(self) -> openai.AsyncOpenAI:
+        # Only used from the event loop thread of the async app
+        with self._lock:
+            self._check_pid()
+            if self._async_client is None:
+                self._async_client = openai.AsyncOpenAI(
+                    api_key=openai.api_key,
+                    timeout=self.timeout,
+                    max_retries=self.max_retries,
+                    http_client=openai.DefaultAsyncHttpxClient(limits=self._limits()),
+                )
+                self._async_slots = asyncio.Semaphore(self.max_concurrency)
+            return self._async_client
+
+    def _started(self) -> None:
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+
+    def _finished(self, failed: bool) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            if failed:
+                self.errors += 1
+
+    @staticmethod
+    def _recorded_stream(stream, model, start):
+        # Streams are recorded in the metrics once consumed; the usage arrives in the last chunk when the request sets stream_options={"include_usage": True}
+        usage = None
+        try:
+            for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                yield chunk
+        finally:
+            record_llm_call(model, time.perf_counter() - start, usage)
+
+    @staticmethod
+    async def _arecorded_stream(stream, model, start):
+        usage = None
+        try:
+            async for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                yield chunk
+        finally:
+            record_llm_call(model, time.perf_counter() - start, usage)
+
+    def _call(self, create, kwargs):
+        client = self.client
+        with self._slots:
+            self._started()
+            failed = True
+            start = time.perf_counter()
+            try:
+                response = create(client)(**kwargs)
+                failed = False
+            finally:
+                self._finished(failed)
+        if kwargs.get("stream"):
+            return self._recorded_stream(response, kwargs.get("model", ""), start)
+        record_llm_call(kwargs.get("model", ""), time.perf_counter() - start, getattr(response, "usage", None))
+        return response
+
+    async def _acall(self, create, kwargs):
+        client = self.async_client
+        async with self._async_slots:
+            self._started()
+            failed = True
+            start = time.perf_counter()
+            try:
+                response = await create(client)(**kwargs)
+                failed = False
+            except asyncio.CancelledError:
+                # A request the caller no longer needs (e.g. a speculative embedding) is not an error
+                failed = False
+                raise
+            finally:
+                self._finished(failed)
+        if kwargs.get("stream"):
+            return self._arecorded_stream(response, kwargs.get("model", ""), start)
+        record_llm_call(kwargs.get("model", ""), time.perf_counter() - start, getattr(response, "usage", None))
+        return response
+
+    def chat(self, **kwargs):
+        """
+        chat.completions.create on the shared client. Streams are opened, not
+        consumed, within the limit; every call is recorded in src/metrics.py.
+        """
+        return self._call(lambda client: client.chat.completions.create, kwargs)
+
+    def embeddings(self, **kwargs):
+        return self._call(lambda client: client.embeddings.create, kwargs)
+
+    async def achat(self, **kwargs):
+        return await self._acall(lambda client: client.chat.completions.create, kwargs)
+
+    async def aembeddings(self, **kwargs):
+        return await self._acall(lambda client: client.embeddings.create, kwargs)
+
+    async def aclose(self) -> None:
+        if self._async_client is not None and self._pid == os.getpid():
+            await self._async_client.close()
+            self._async_client = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "in_flight": self.in_flight,
+                "max_concurrency": self.max_concurrency,
+                "timeout": self.timeout,
+            }
@@ -0,0 +1,82 @@
+import csv
+import json
+import os
+from typing import Any, Dict, Iterator, Tuple
+
+import numpy as np
+
+# embed_documents.py stores the embeddings of data/chopped_text.csv in three files:
+#   embeddings.npy        float32 (n, dimension); row i is the vector of CSV row i
+#   embeddings_ids.npy    int64 chunk id of each row, to check that the CSV and vectors line up
+#   embeddings_info.json  embedding model, dimension and number of rows
+EMBEDDINGS_FILE = "embeddings.npy"
+EMBEDDING_IDS_FILE = "embeddings_ids.npy"
+EMBEDDINGS_INFO_FILE = "embeddings_info.json"
+
+
+def iter_chunks(csv_path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Streams the chunks of chopped_text.csv as dicts with 'chunk_id',
+    'filename', 'chunk_index', 'chunk_text', 'page' and 'page_end' (the pages
+    the chunk spans, None for documents without pages).
+    """
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            yield {
+                'chunk_id': int(row['chunk_id']),
+                'filename': row['filename'],
+                'chunk_index': int(row['chunk_index']),
+                'chunk_text': row['chunk_text'],
+                'page': int(row['page']) if row.get('page') else None,
+                'page_end': int(row['page_end']) if row.get('page_end') else None,
+            }
+
+
+def count_chunks(csv_path: str) -> int:
+    return sum(1 for _ in iter_chunks(csv_path))
+
+
+class EmbeddingsWriter:
+    """
+    Writes embeddings row by row into memory-mapped temporary files, so only
+    the block being written is in memory; close() renames them into place.
+    """
+
+    def __init__(self, data_dir: str, count: int, dimension: int):
+        self.data_dir = data_dir
+        self.count = count
+        self.dimension = dimension
+        self.vectors = np.lib.format.open_memmap(
+            self._tmp(EMBEDDINGS_FILE), mode='w+', dtype=np.float32, shape=(count, dimension))
+        self.ids = np.lib.format.open_memmap(
+            self._tmp(EMBEDDING_IDS_FILE), mode='w+', dtype=np.int64, shape=(count,))
+
+    def _tmp(self, name: str) -> str:
+        return os.path.join(self.data_dir, name[:-len(".npy")] + ".tmp.npy")
+
+    def write(self, start: int, vectors: np.ndarray, ids) -> None:
+        self.vectors[start:start + len(vectors)] = vectors
+        self.ids[start:start + len(vectors)] = ids
+
+    def close(self, embedding_model: str) -> None:
+        self.vectors.flush()
+        self.ids.flush()
+        del self.vectors, self.ids
+        os.replace(self._tmp(EMBEDDINGS_FILE), os.path.join(self.data_dir, EMBEDDINGS_FILE))
+        os.replace(self._tmp(EMBEDDING_IDS_FILE), os.path.join(self.data_dir, EMBEDDING_IDS_FILE))
+        with open(os.path.join(self.data_dir, EMBEDDINGS_INFO_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'embedding_model': embedding_model, 'dimension': self.dimension, 'count': self.count}, f, indent=2)
+
+
+def embeddings_exist(data_dir: str) -> bool:
+    return all(os.path.exists(os.path.join(data_dir, name))
+               for name in (EMBEDDINGS_FILE, EMBEDDING_IDS_FILE, EMBEDDINGS_INFO_FILE))
+
+
+def open_embeddings(data_dir: str) -> Tuple[np.ndarray, np.ndarray, Dict[str, Any]]:
+    """Returns the memory-mapped (vectors, chunk ids) and the info written by EmbeddingsWriter."""
+    with open(os.path.join(data_dir, EMBEDDINGS_INFO_FILE), 'r', encoding='utf-8') as f:
+        info = json.load(f)
+    vectors = np.load(os.path.join(data_dir, EMBEDDINGS_FILE), mmap_mode='r')
+    ids = np.load(os.path.join(data_dir, EMBEDDING_IDS_FILE), mmap_mode='r')
+    return vectors, ids, info
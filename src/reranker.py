@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Sequence, Tuple
+
+from src.context_builder import chunk_body
+from src.embedding_cache import normalize_text
+
+
+class CrossEncoderReranker:
+    """
+    Reorders search hits with a local sentence-transformers cross-encoder on
+    the CPU. All (query, chunk) pairs of a call that are not cached are
+    scored in one batched predict(); scores are cached by normalized query
+    and chunk id, which is derived from the chunk's content. The model is
+    loaded on first use and shared by every caller in the process.
+    """
+
+    def __init__(self, model_name: str = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1",
+                 batch_size: int = 32, cache_size: int = 10000):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.name = f"cross-encoder:{model_name}"
+        self._model = None
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.pairs_scored = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.total_ms = 0.0
+        self.last_ms = 0.0
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    def rerank(self, query: str, hits: Sequence[Tuple[Dict[str, Any], Any]], top_n: int) -> List[Tuple[Dict[str, Any], Any]]:
+        """Returns the top_n of the (record, distance) hits, most relevant first."""
+        if not hits:
+            return []
+        start = time.perf_counter()
+        query_key = normalize_text(query)
+        keys = [(query_key, record.get("chunk_id", id(record))) for record, _ in hits]
+        with self._lock:
+            scores = [self._scores.get(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            pairs = [(query, chunk_body(hits[i][0])) for i in missing]
+            predicted = self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+            for i, score in zip(missing, predicted):
+                scores[i] = float(score)
+
+        order = sorted(range(len(hits)), key=lambda i: scores[i], reverse=True)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            for i in missing:
+                self._scores[keys[i]] = scores[i]
+            for key in keys:
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+            while len(self._scores) > self.cache_size:
+                self._scores.popitem(last=False)
+            self.calls += 1
+            self.pairs_scored += len(missing)
+            self.cache_hits += len(hits) - len(missing)
+            self.cache_misses += len(missing)
+            self.total_ms += elapsed_ms
+            self.last_ms = elapsed_ms
+        return [hits[i] for i in order[:top_n]]
+
+    def stats(self) -> dict:
+        with self._lock:
+            pairs = self.cache_hits + self.cache_misses
+            return {
+                "model": self.model_name,
+                "calls": self.calls,
+                "pairs_scored": self.pairs_scored,
+                "cache_hits": self.cache_hits,
+                "cache_misses": self.cache_misses,
+                "cache_hit_rate": self.cache_hits / pairs if pairs else 0.0,
+                "cache_size": len(self._scores),
+                "avg_ms": self.total_ms / self.calls if self.calls else 0.0,
+                "last_ms": self.last_ms,
+            }
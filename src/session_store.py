@@ -0,0 +1,116 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from src.tokens import truncate_to_tokens
+
+
+class SessionStore:
+    """
+    Per-user conversation state: the context of each session's last question,
+    used for follow-ups and answer-checks. Entries are truncated to
+    max_tokens, expire ttl seconds after their last update and, beyond
+    max_sessions, the least recently used ones are evicted.
+
+    Without a sqlite_path sessions live in this process only. With one they
+    are kept in a local SQLite file instead, so every gunicorn worker on the
+    machine sees the same sessions.
+    """
+
+    # Expired SQLite rows are pruned at most this often (seconds)
+    prune_interval = 60.0
+
+    def __init__(self, max_sessions: int = 10000, ttl: float = 3600.0, max_tokens: int = 1000,
+                 sqlite_path: Optional[str] = None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_tokens = max_tokens
+        self.sqlite_path = sqlite_path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # session id -> (context, updated_at)
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self._last_prune = 0.0
+
+    def _connection(self):
+        """
+        SQLite connection of the current process, opened lazily and reopened
+        after a fork (connections must not cross fork()).
+        """
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.sqlite_path, check_same_thread=False, timeout=5.0)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, context TEXT NOT NULL, updated REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+            self._db.commit()
+            self._db_pid = os.getpid()
+        return self._db
+
+    def get(self, session_id: Optional[str]) -> Optional[str]:
+        """The session's saved context, or None if it is unknown or expired."""
+        if not session_id:
+            return None
+        now = time.time()
+        with self._lock:
+            if self.sqlite_path is not None:
+                row = self._connection().execute(
+                    "SELECT context FROM sessions WHERE id = ? AND updated >= ?", (session_id, now - self.ttl)
+                ).fetchone()
+                context = row[0] if row is not None else None
+            else:
+                context = None
+                entry = self._entries.get(session_id)
+                if entry is not None and entry[1] >= now - self.ttl:
+                    self._entries.move_to_end(session_id)
+                    context = entry[0]
+                elif entry is not None:
+                    del self._entries[session_id]
+            if context is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return context
+
+    def put(self, session_id: Optional[str], context: str) -> None:
+        if not session_id:
+            return
+        context = truncate_to_tokens(context, self.max_tokens)
+        now = time.time()
+        with self._lock:
+            if self.sqlite_path is None:
+                self._entries[session_id] = (context, now)
+                self._entries.move_to_end(session_id)
+                while len(self._entries) > self.max_sessions:
+                    self._entries.popitem(last=False)
+                return
+            db = self._connection()
+            db.execute("INSERT OR REPLACE INTO sessions (id, context, updated) VALUES (?, ?, ?)", (session_id, context, now))
+            if now - self._last_prune >= self.prune_interval:
+                self._last_prune = now
+                db.execute("DELETE FROM sessions WHERE updated < ?", (now - self.ttl,))
+                db.execute(
+                    "DELETE FROM sessions WHERE id NOT IN (SELECT id FROM sessions ORDER BY updated DESC LIMIT ?)",
+                    (self.max_sessions,),
+                )
+            db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self.sqlite_path is not None:
+                size = self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            else:
+                size = len(self._entries)
+            return {
+                "size": size,
+                "max_sessions": self.max_sessions,
+                "hits": self.hits,
+                "misses": self.misses,
+                "persistent": self.sqlite_path is not None,
+            }
@@ -0,0 +1,19 @@
+import os
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+# RAG_SETTINGS and RAG_DATA_DIR point a process at another settings file and data folder,
+# e.g. a benchmark workspace (see bench/)
+settings_path = os.environ.get("RAG_SETTINGS") or os.path.join(project_root, "settings.txt")
+data_dir = os.environ.get("RAG_DATA_DIR") or os.path.join(project_root, "data")
+
+# Read simple key=value settings from settings.txt
+def read_settings(file_path=settings_path):
+    settings = {}
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            settings[key.strip()] = value.strip()
+    return settings
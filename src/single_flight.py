@@ -0,0 +1,154 @@
+import asyncio
+import re
+import threading
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+_SPACE_RE = re.compile(r"\s+")
+
+# A leader interrupted by these was given up on (cancelled, client gone); its followers redo the work
+ABANDONED = (asyncio.CancelledError, GeneratorExit)
+
+
+def normalize_question(text: str) -> str:
+    """Case, spacing and trailing punctuation do not make two questions different."""
+    return _SPACE_RE.sub(" ", text).strip().casefold().rstrip("?!.… ")
+
+
+class Flight:
+    """
+    One in-progress computation. The leader ends it with a result, an error,
+    or by abandoning it (e.g. its client disconnected); followers then run the
+    work themselves.
+    """
+
+    def __init__(self, event):
+        self.result = None
+        self.error = None
+        self.abandoned = False
+        self.followers = 0
+        self._event = event
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical work between threads. The first caller of
+    a key becomes the leader and does the work; callers arriving with the same
+    key while it runs wait for the leader's result instead of repeating it.
+    A key is forgotten as soon as its leader finishes, so nothing outlives the
+    flight (completed answers are the answer cache's job). on_shared, if
+    given, is called in every follower that receives a leader's result.
+    Followers wait at most timeout seconds (None: no limit) and then do the
+    work themselves, so a stuck leader holds up no one for longer than that.
+    """
+
+    def __init__(self, on_shared: Optional[Callable[[], None]] = None, timeout: Optional[float] = None):
+        self.on_shared = on_shared
+        self.timeout = timeout
+        self.leaders = 0
+        self.followers = 0
+        self.timeouts = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _new_event(self):
+        return threading.Event()
+
+    def join(self, key: Hashable) -> Tuple[Flight, bool]:
+        """Returns (flight, is_leader) for the key."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.followers += 1
+                return flight, False
+            flight = Flight(self._new_event())
+            self._flights[key] = flight
+            self.leaders += 1
+            return flight, True
+
+    def finish(self, key: Hashable, flight: Flight, result: Any = None, error: Optional[BaseException] = None,
+               abandoned: bool = False) -> None:
+        """Ends the leader's flight and wakes its followers."""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.result = result
+        flight.error = error
+        flight.abandoned = abandoned
+        flight._event.set()
+
+    def wait(self, flight: Flight) -> Optional[Any]:
+        """
+        The leader's result; raises the leader's error and returns None if the
+        flight was abandoned or the leader did not finish within the timeout.
+        """
+        if not flight._event.wait(self.timeout):
+            return self._timed_out()
+        return self._outcome(flight)
+
+    def _timed_out(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+        return None
+
+    def _outcome(self, flight: Flight) -> Optional[Any]:
+        if flight.error is not None:
+            raise flight.error
+        if flight.abandoned:
+            return None
+        if self.on_shared is not None:
+            self.on_shared()
+        return flight.result
+
+    def run(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """fn(), or the result of the identical call already in flight. fn must not return None."""
+        flight, leader = self.join(key)
+        if not leader:
+            result = self.wait(flight)
+            return fn() if result is None else result
+        try:
+            result = fn()
+        except ABANDONED:
+            self.finish(key, flight, abandoned=True)
+            raise
+        except BaseException as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result=result)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"in_flight": len(self._flights), "leaders": self.leaders, "followers": self.followers,
+                    "timeouts": self.timeouts}
+
+
+class AsyncSingleFlight(SingleFlight):
+    """SingleFlight for coroutines on one event loop; followers wait without holding a thread."""
+
+    def _new_event(self):
+        return asyncio.Event()
+
+    async def wait(self, flight: Flight) -> Optional[Any]:
+        try:
+            await asyncio.wait_for(flight._event.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            return self._timed_out()
+        return self._outcome(flight)
+
+    async def run(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """await fn(), or the result of the identical call already in flight. fn must not return None."""
+        flight, leader = self.join(key)
+        if not leader:
+            result = await self.wait(flight)
+            return await fn() if result is None else result
+        try:
+            result = await fn()
+        except ABANDONED:
+            self.finish(key, flight, abandoned=True)
+            raise
+        except BaseException as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result=result)
+        return result
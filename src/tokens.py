@@ -0,0 +1,58 @@
+import logging
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# cl100k_base is the tokenizer of text-embedding-ada-002; close enough to the chat model's for budgeting
+ENCODING_NAME = "cl100k_base"
+
+_encoding = None
+_encoding_failed = False
+_lock = threading.Lock()
+
+# Rough fallback when tiktoken or its encoding file is unavailable (e.g. offline builds)
+_APPROX_TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]")
+
+
+def get_encoding():
+    """Returns the shared tiktoken encoding, or None if it cannot be loaded."""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        with _lock:
+            if _encoding is None and not _encoding_failed:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(ENCODING_NAME)
+                except Exception as e:
+                    logger.warning("tiktoken unavailable (%s); approximating token counts.", e)
+                    _encoding_failed = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Number of model tokens in text."""
+    encoding = get_encoding()
+    if encoding is None:
+        return len(_APPROX_TOKEN_RE.findall(text))
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """The longest prefix of text with at most max_tokens tokens, cut back to a word boundary."""
+    if max_tokens <= 0:
+        return ""
+    encoding = get_encoding()
+    if encoding is None:
+        matches = list(_APPROX_TOKEN_RE.finditer(text))
+        if len(matches) <= max_tokens:
+            return text
+        prefix = text[:matches[max_tokens].start()]
+    else:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        prefix = encoding.decode(tokens[:max_tokens])
+    # Drop the word that was cut in half (and any partial multi-byte character)
+    cut = prefix.rfind(" ")
+    return (prefix[:cut] if cut > 0 else prefix).rstrip().replace("\ufffd", "")
@@ -0,0 +1,140 @@
+import logging
+import math
+from typing import Dict, Optional
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+METRICS = ("l2", "cosine")
+
+
+def index_config_from_settings(settings: Dict[str, str]) -> Dict[str, object]:
+    """
+    FAISS index parameters from settings.txt. Build parameters (type, metric,
+    nlist, pq_m, hnsw_m, ef_construction) are fixed when the index is built;
+    nprobe and ef_search only affect searching and can be changed at any time.
+    """
+    config = {
+        "type": settings.get("index_type", "flat").lower(),
+        "metric": settings.get("index_metric", "l2").lower(),
+        "nlist": int(settings.get("index_nlist", "0")),
+        "pq_m": int(settings.get("index_pq_m", "16")),
+        "hnsw_m": int(settings.get("index_hnsw_m", "32")),
+        "ef_construction": int(settings.get("index_ef_construction", "200")),
+        "train_sample": int(settings.get("index_train_sample", "100000")),
+        "nprobe": int(settings.get("index_nprobe", "16")),
+        "ef_search": int(settings.get("index_ef_search", "64")),
+    }
+    if config["type"] not in INDEX_TYPES:
+        raise ValueError(f"Unknown index_type: {config['type']} (expected one of {', '.join(INDEX_TYPES)})")
+    if config["metric"] not in METRICS:
+        raise ValueError(f"Unknown index_metric: {config['metric']} (expected one of {', '.join(METRICS)})")
+    return config
+
+
+def build_params(config: Dict[str, object]) -> Dict[str, object]:
+    """The part of the config that is baked into a built index."""
+    return {key: config[key] for key in ("type", "metric", "nlist", "pq_m", "hnsw_m", "ef_construction")}
+
+
+def prepare_vectors(vectors: np.ndarray, metric: str) -> np.ndarray:
+    """float32, C-contiguous copy of the vectors, L2-normalized for the cosine metric."""
+    vectors = np.array(vectors, dtype=np.float32, order="C")
+    if metric == "cosine":
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+def default_nlist(num_vectors: int) -> int:
+    """About 4 * sqrt(n) inverted lists, with at least 39 training points per list."""
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+
+
+def new_flat_index(dimension: int, metric: int):
+    if metric == faiss.METRIC_INNER_PRODUCT:
+        return faiss.IndexFlatIP(dimension)
+    return faiss.IndexFlatL2(dimension)
+
+
+def new_index(dimension: int, num_vectors: int, config: Dict[str, object]):
+    """
+    Creates an empty (untrained) index of the configured type. All types accept
+    add_with_ids; flat and IVF indexes also support remove_ids, HNSW does not.
+    Indexes too small to train fall back to flat.
+    """
+    index_type = config["type"]
+    metric = faiss.METRIC_INNER_PRODUCT if config["metric"] == "cosine" else faiss.METRIC_L2
+    nlist = config["nlist"] or default_nlist(num_vectors)
+
+    if index_type in ("ivf_flat", "ivf_pq") and num_vectors < 39 * nlist:
+        logger.warning("Only %d vectors for %d lists; building a flat index instead.", num_vectors, nlist)
+        index_type = "flat"
+    if index_type == "ivf_pq" and (dimension % config["pq_m"] or num_vectors < 256):
+        logger.warning("Cannot train PQ%d on %d vectors of dimension %d; using ivf_flat.",
+                       config["pq_m"], num_vectors, dimension)
+        index_type = "ivf_flat"
+
+    if index_type == "flat":
+        return faiss.IndexIDMap(new_flat_index(dimension, metric))
+    if index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dimension, config["hnsw_m"], metric)
+        hnsw.hnsw.efConstruction = config["ef_construction"]
+        return faiss.IndexIDMap(hnsw)
+    # The faiss Python wrappers keep a reference to the quantizer for the lifetime of the index
+    quantizer = new_flat_index(dimension, metric)
+    if index_type == "ivf_flat":
+        return faiss.IndexIVFFlat(quantizer, dimension, nlist, metric)
+    return faiss.IndexIVFPQ(quantizer, dimension, nlist, config["pq_m"], 8, metric)
+
+
+def build_index(vectors: np.ndarray, ids: np.ndarray, config: Dict[str, object],
+                rows: Optional[np.ndarray] = None, block_size: int = 65536):
+    """
+    Builds and fills an index of the configured type, training it on a random
+    sample if needed. `rows` selects the rows of `vectors` to index (ids are
+    given per selected row); vectors are added in blocks, so a memory-mapped
+    matrix is never copied into memory as a whole.
+    """
+    num_vectors = len(ids)
+    index = new_index(vectors.shape[1], num_vectors, config)
+    if not index.is_trained:
+        sample = np.arange(num_vectors)
+        if num_vectors > config["train_sample"]:
+            sample = np.sort(np.random.default_rng(0).choice(num_vectors, config["train_sample"], replace=False))
+        index.train(prepare_vectors(vectors[sample if rows is None else rows[sample]], config["metric"]))
+    add_vectors(index, vectors, ids, config["metric"], rows, block_size)
+    set_search_params(index, config)
+    return index
+
+
+def add_vectors(index, vectors: np.ndarray, ids: np.ndarray, metric: str,
+                rows: Optional[np.ndarray] = None, block_size: int = 65536) -> None:
+    """Adds vectors (or the selected rows of them) with their ids, block_size rows at a time."""
+    ids = np.asarray(ids, dtype=np.int64)
+    for start in range(0, len(ids), block_size):
+        block = vectors[start:start + block_size] if rows is None else vectors[rows[start:start + block_size]]
+        index.add_with_ids(prepare_vectors(block, metric), ids[start:start + block_size])
+
+
+def set_search_params(index, config: Dict[str, object]) -> None:
+    """Applies nprobe (IVF) and ef_search (HNSW) to an index, including id-mapped ones."""
+    try:
+        faiss.extract_index_ivf(index).nprobe = config["nprobe"]
+        return
+    except RuntimeError:
+        pass
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = config["ef_search"]
+
+
+def index_size_bytes(index) -> int:
+    return int(faiss.serialize_index(index).size)
+
+
+def normalize_queries(queries: np.ndarray, metric: Optional[str]) -> np.ndarray:
+    """Query vectors prepared for an index built with the given metric."""
+    return prepare_vectors(queries, metric or "l2")
@@ -0,0 +1,180 @@
+import json
+import os
+import re
+import secrets
+
+from src.metrics import family, render_metrics
+from src.main import (
+    QUESTION_TYPES, answer_cache, embedding_cache, flights, num_chunks, openai_clients, parse_question_type, reranker,
+    sessions,
+)
+
+# Request parsing and responses shared by the Flask app (src/app.py) and the async app (src/asgi.py)
+
+# Cookie naming the user's session; API clients without cookies may send "session_id" in the body instead
+SESSION_COOKIE = 'rag_session'
+SESSION_ID_RE = re.compile(r'^[A-Za-z0-9_-]{16,128}$')
+
+# Upper bounds on queries per batch retrieval request and on chunks per query; every query
+# fills a row of k distances and ids and then loads k chunk texts
+MAX_BATCH_QUERIES = 5000
+MAX_K = 100
+
+# A query must be a string with something in it besides whitespace
+def is_query(value):
+    return isinstance(value, str) and bool(value.strip())
+
+# Request bodies are JSON objects; a list or a string in their place is a client error
+def check_body(data):
+    if not isinstance(data, dict):
+        raise ValueError('The request body must be a JSON object')
+
+def parse_chat_request(data):
+    """
+    Returns (query, question_type) from a chat request body. An explicit
+    question_type wins, otherwise the "m:" / "a:" prefixes are honoured.
+    """
+    check_body(data)
+    query = data.get('query')
+    if query is None or query == '':
+        raise ValueError('No query provided')
+    if not is_query(query):
+        raise ValueError('query must be a non-empty string')
+    question_type = data.get('question_type')
+    if not question_type:
+        question_type, query = parse_question_type(query)
+        if not query:
+            raise ValueError('No query provided')
+        return query, question_type
+    if question_type not in QUESTION_TYPES:
+        raise ValueError(f'Unknown question_type: {question_type}')
+    return query.strip(), question_type
+
+def session_id_for(data, cookie):
+    """
+    Returns (session_id, is_new): the id sent in the body or the session
+    cookie, or a fresh random one when neither is a valid id.
+    """
+    for candidate in (data.get('session_id'), cookie):
+        if isinstance(candidate, str) and SESSION_ID_RE.match(candidate):
+            return candidate, False
+    return secrets.token_urlsafe(24), True
+
+def with_session_cookie(response, session_id, is_new, secure=False):
+    # Flask and Starlette responses share this set_cookie signature
+    if is_new:
+        response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite='Lax', secure=secure)
+    return response
+
+def parse_batch_request(data):
+    """Returns (queries, k) from a batch retrieval request body; k defaults to num_chunks."""
+    check_body(data)
+    queries = data.get('queries')
+    if not isinstance(queries, list) or not queries or not all(is_query(q) for q in queries):
+        raise ValueError('queries must be a non-empty list of strings')
+    if len(queries) > MAX_BATCH_QUERIES:
+        raise ValueError(f'At most {MAX_BATCH_QUERIES} queries per request')
+    try:
+        k = int(data.get('k', num_chunks))
+    except (TypeError, ValueError):
+        raise ValueError('k must be an integer')
+    if k < 1:
+        raise ValueError('k must be positive')
+    if k > MAX_K:
+        raise ValueError(f'k must be at most {MAX_K}')
+    return [q.strip() for q in queries], k
+
+def batch_results(queries, results):
+    return {'results': [
+        {
+            'query': query,
+            'chunks': [
+                {
+                    'chunk_id': record.get('chunk_id'),
+                    'filename': record.get('filename'),
+                    'chunk_index': record.get('chunk_index'),
+                    'page': record.get('page'),
+                    'chunk_text': record['chunk_text'],
+                    'distance': distance,
+                }
+                for record, distance in hits
+            ],
+        }
+        for query, hits in zip(queries, results)
+    ]}
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def process_memory():
+    """
+    Resident memory of this worker in bytes. On Linux, rss_file and rss_shmem are
+    the parts backed by shared mappings (the memory-mapped index and chunk store),
+    while rss_anon is private to the worker.
+    """
+    memory = {'pid': os.getpid()}
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('VmRSS', 'RssAnon', 'RssFile', 'RssShmem'):
+                    name = 'rss' if key == 'VmRSS' else 'rss_' + key[3:].lower()
+                    memory[name] = int(value.split()[0]) * 1024
+    except OSError:
+        import resource
+        # ru_maxrss is the peak, in kilobytes on Linux and bytes on macOS
+        memory['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return memory
+
+def server_stats():
+    return {
+        'worker': process_memory(),
+        'embedding_cache': embedding_cache.stats(),
+        'answer_cache': answer_cache.stats(),
+        'reranker': reranker.stats() if reranker is not None else None,
+        'sessions': sessions.stats(),
+        'openai': openai_clients.stats(),
+        'single_flight': flights.stats(),
+    }
+
+# Content type of the Prometheus text exposition format
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def metrics_text(single_flight=None):
+    """
+    The /metrics page of this worker: request, stage and LLM metrics from
+    src/metrics.py plus gauges and counters read from the caches and clients.
+    single_flight overrides the stats of the synchronous single-flight.
+    """
+    embedding = embedding_cache.stats()
+    answers = answer_cache.stats()
+    caches = [('embedding', embedding['hits'], embedding['misses']), ('answer', answers['hits'], answers['misses'])]
+    rerank = reranker.stats() if reranker is not None else None
+    if rerank is not None:
+        caches.append(('reranker', rerank['cache_hits'], rerank['cache_misses']))
+    session = sessions.stats()
+    openai_stats = openai_clients.stats()
+    flight = single_flight or flights.stats()
+    lines = []
+    lines += family('rag_cache_hits_total', 'counter', 'Cache lookups that hit.',
+                    (({'cache': name}, hits) for name, hits, _ in caches))
+    lines += family('rag_cache_misses_total', 'counter', 'Cache lookups that missed.',
+                    (({'cache': name}, misses) for name, _, misses in caches))
+    if rerank is not None:
+        lines += family('rag_reranker_pairs_scored_total', 'counter', 'Query-chunk pairs scored by the cross-encoder.',
+                        [({}, rerank['pairs_scored'])])
+    lines += family('rag_sessions', 'gauge', 'Sessions in the session store.', [({}, session['size'])])
+    lines += family('rag_session_lookups_total', 'counter', 'Session store lookups by result.',
+                    [({'result': 'hit'}, session['hits']), ({'result': 'miss'}, session['misses'])])
+    lines += family('rag_openai_calls_total', 'counter', 'Calls made through the shared OpenAI clients.',
+                    [({}, openai_stats['calls'])])
+    lines += family('rag_openai_errors_total', 'counter', 'OpenAI calls that failed.', [({}, openai_stats['errors'])])
+    lines += family('rag_openai_in_flight', 'gauge', 'OpenAI calls in progress.', [({}, openai_stats['in_flight'])])
+    lines += family('rag_single_flight_requests_total', 'counter', 'Coalesced requests by role.',
+                    [({'role': 'leader'}, flight['leaders']), ({'role': 'follower'}, flight['followers'])])
+    lines += family('rag_single_flight_timeouts_total', 'counter',
+                    'Coalesced requests that stopped waiting for the leader and answered on their own.',
+                    [({}, flight['timeouts'])])
+    lines += family('rag_single_flight_in_flight', 'gauge', 'Distinct questions being answered.',
+                    [({}, flight['in_flight'])])
+    return render_metrics(lines)
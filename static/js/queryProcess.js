@@ -1,30 +1,84 @@
+// Parse one server-sent event block ("event: ...\ndata: ...") into {event, data}.
+function parseSseEvent(block) {
+  let event = 'message';
+  const dataLines = [];
+  block.split('\n').forEach(function(line) {
+      if (line.startsWith('event:')) {
+          event = line.slice(6).trim();
+      } else if (line.startsWith('data:')) {
+          dataLines.push(line.slice(5).trim());
+      }
+  });
+  const data = dataLines.length ? JSON.parse(dataLines.join('\n')) : null;
+  return { event: event, data: data };
+}
+
+function addBubble(responseDiv, role, html) {
+  const bubble = document.createElement('div');
+  bubble.classList.add('chat-bubble', role);
+  bubble.innerHTML = `<div class="message">${html}</div>`;
+  responseDiv.appendChild(bubble);
+  return bubble;
+}
+
 document.getElementById('chat-form').addEventListener('submit', async function(event) {
   event.preventDefault();
   const query = document.getElementById('query').value.trim();
   const responseDiv = document.getElementById('response');
   responseDiv.textContent = 'Loading...';
-  
+
   try {
-      const res = await fetch('/api/chat', {
+      const res = await fetch('/api/chat/stream', {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({ query: query })
       });
-      const data = await res.json();
-      if (data.error) {
+      if (!res.ok) {
+          const data = await res.json();
           responseDiv.textContent = 'Error: ' + data.error;
-      } else {
-          // Create a new AI chat bubble
-          const aiBubble = document.createElement('div');
-          aiBubble.classList.add('chat-bubble', 'ai');
-          aiBubble.innerHTML = `<div class="message">${data.response}</div>`;
-          responseDiv.appendChild(aiBubble);
+          return;
+      }
+
+      let aiBubble = null;
+      let answer = '';
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+
+      // Render each token as soon as it arrives instead of waiting for the full reply.
+      const handleEvent = function(sse) {
+          if (sse.event === 'error') {
+              responseDiv.textContent = 'Error: ' + sse.data;
+              return;
+          }
+          if (!aiBubble && (sse.event === 'token' || sse.event === 'correction')) {
+              responseDiv.textContent = '';
+              addBubble(responseDiv, 'user', query);
+              aiBubble = addBubble(responseDiv, 'ai', '');
+          }
+          if (sse.event === 'token') {
+              answer += sse.data;
+              aiBubble.querySelector('.message').innerHTML = answer;
+          } else if (sse.event === 'correction') {
+              // The streamed answer failed verification; show the corrected reply after it.
+              aiBubble.classList.add('superseded');
+              addBubble(responseDiv, 'ai', sse.data).classList.add('correction');
+          }
+          responseDiv.scrollTop = responseDiv.scrollHeight;
+      };
 
-          // Optionally, add user bubble
-          const userBubble = document.createElement('div');
-          userBubble.classList.add('chat-bubble', 'user');
-          userBubble.innerHTML = `<div class="message">${query}</div>`;
-          responseDiv.insertBefore(userBubble, responseDiv.firstChild);
+      while (true) {
+          const { value, done } = await reader.read();
+          if (done) {
+              break;
+          }
+          buffer += decoder.decode(value, { stream: true });
+          let boundary = buffer.indexOf('\n\n');
+          while (boundary !== -1) {
+              handleEvent(parseSseEvent(buffer.slice(0, boundary)));
+              buffer = buffer.slice(boundary + 2);
+              boundary = buffer.indexOf('\n\n');
+          }
       }
   } catch (error) {
       responseDiv.textContent = 'Error: ' + error;
@@ -0,0 +1,53 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# Make the project root importable so the shared "src", "scripts" and "bench" modules resolve.
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+# The tests run offline in a workspace of their own (see bench/workspace.py): src.settings
+# reads RAG_SETTINGS and RAG_DATA_DIR when it is first imported, and every OpenAI call goes
+# to the fake API, so both are set up here, before any test module imports src.
+workspace = tempfile.mkdtemp(prefix="rag-tests-")
+os.environ["RAG_SETTINGS"] = os.path.join(workspace, "settings.txt")
+os.environ["RAG_DATA_DIR"] = os.path.join(workspace, "data")
+
+from bench.fake_openai import start_server
+
+fake_api = start_server()
+os.environ["OPENAI_BASE_URL"] = fake_api.base_url
+os.environ["OPENAI_API_KEY"] = "test"
+
+from bench.workspace import build_data, write_settings
+
+settings = write_settings(workspace)
+
+
+@pytest.fixture(scope="session")
+def course_index():
+    """A synthetic course index in the workspace data folder, for tests that run the engine."""
+    build_data(workspace, settings, num_chunks=300, dimension=fake_api.dimension)
+    return settings
+
+
+@pytest.fixture
+def openai_api():
+    """The fake OpenAI API every test talks to; its `requests` attribute counts the calls."""
+    return fake_api
+
+
+@pytest.fixture
+def failing_verification():
+    """Makes every answer of the fake API fail verification for the duration of a test."""
+    fake_api.answered = False
+    yield
+    fake_api.answered = True
+
+
+def pytest_sessionfinish(session, exitstatus):
+    fake_api.shutdown()
+    shutil.rmtree(workspace, ignore_errors=True)
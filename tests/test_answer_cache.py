@@ -0,0 +1,81 @@
+import numpy as np
+
+import src.answer_cache
+from src.answer_cache import AnswerCache
+
+
+def unit(seed, dimension=8):
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def test_hit_needs_a_close_question_of_the_same_type():
+    cache = AnswerCache(max_distance=0.05)
+    cache.store(unit(1), "normal", "reply", "context", "v1")
+    assert cache.lookup(unit(1), "normal", "v1") == ("reply", "context")
+    assert cache.lookup(unit(1) + 0.01, "normal", "v1") == ("reply", "context")
+    assert cache.lookup(unit(2), "normal", "v1") is None
+    assert cache.lookup(unit(1), "multiple_choice", "v1") is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 2
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(src.answer_cache.time, "time", clock.time)
+    cache = AnswerCache(ttl=60)
+    cache.store(unit(1), "normal", "reply", "context", "v1")
+    clock.now += 59
+    assert cache.lookup(unit(1), "normal", "v1") == ("reply", "context")
+    clock.now += 2
+    assert cache.lookup(unit(1), "normal", "v1") is None
+    # The expired entry was dropped from the cache, not just skipped
+    assert cache.stats()["size"] == 0
+
+
+def test_fresh_entry_is_found_behind_an_expired_one(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(src.answer_cache.time, "time", clock.time)
+    cache = AnswerCache(ttl=60)
+    cache.store(unit(1), "normal", "old reply", "context", "v1")
+    clock.now += 61
+    cache.store(unit(1) + 0.001, "normal", "new reply", "context", "v1")
+    assert cache.lookup(unit(1), "normal", "v1") == ("new reply", "context")
+    assert cache.stats()["size"] == 1
+
+
+def test_new_index_version_invalidates_every_entry():
+    cache = AnswerCache()
+    cache.store(unit(1), "normal", "reply 1", "context", "v1")
+    cache.store(unit(2), "normal", "reply 2", "context", "v1")
+    assert cache.lookup(unit(1), "normal", "v2") is None
+    assert cache.stats()["size"] == 0
+    # Going back to the old version does not bring the entries back
+    assert cache.lookup(unit(2), "normal", "v1") is None
+
+
+def test_store_under_a_new_index_version_drops_older_entries():
+    cache = AnswerCache()
+    cache.store(unit(1), "normal", "reply 1", "context", "v1")
+    cache.store(unit(2), "normal", "reply 2", "context", "v2")
+    assert cache.lookup(unit(1), "normal", "v2") is None
+    assert cache.lookup(unit(2), "normal", "v2") == ("reply 2", "context")
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = AnswerCache(max_size=2)
+    cache.store(unit(1), "normal", "reply 1", "context", "v1")
+    cache.store(unit(2), "normal", "reply 2", "context", "v1")
+    assert cache.lookup(unit(1), "normal", "v1") is not None
+    cache.store(unit(3), "normal", "reply 3", "context", "v1")
+    assert cache.lookup(unit(2), "normal", "v1") is None
+    assert cache.lookup(unit(1), "normal", "v1") == ("reply 1", "context")
+    assert cache.lookup(unit(3), "normal", "v1") == ("reply 3", "context")
@@ -0,0 +1,16 @@
+import pytest
+
+from src.app import app
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.mark.parametrize("path", ["/api/chat", "/api/chat/stream", "/api/retrieve/batch"])
+@pytest.mark.parametrize("body", [["What is risk?"], "What is risk?", 42])
+def test_non_object_json_body_is_a_client_error(client, path, body):
+    response = client.post(path, json=body)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
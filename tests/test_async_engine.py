@@ -0,0 +1,76 @@
+import asyncio
+import threading
+
+import pytest
+
+from src import async_engine
+from src import main as rag
+
+
+@pytest.fixture(scope="module")
+def engine(course_index):
+    return async_engine.AsyncRAGEngine()
+
+
+def run(coroutine):
+    """Runs a coroutine on a fresh event loop; the async OpenAI client is closed with the loop."""
+    async def scenario():
+        try:
+            return await coroutine
+        finally:
+            await rag.openai_clients.aclose()
+    return asyncio.run(scenario())
+
+
+async def collect(stream):
+    return [event async for event in stream]
+
+
+def test_repeated_question_is_answered_from_the_cache(engine, openai_api):
+    question = "What is hindsight bias, briefly?"
+    reply = run(engine.aanswer(question))
+    assert reply
+    requests = openai_api.requests
+    assert run(engine.aanswer(question.lower())) == reply
+    assert openai_api.requests - requests <= 1
+
+
+def test_concurrent_identical_questions_share_one_answer(engine):
+    async def ask_twice():
+        return await asyncio.gather(*(engine.aanswer("What is the sunk cost fallacy?") for _ in range(2)))
+
+    first, second = run(ask_twice())
+    assert first == second
+
+
+def test_stream_ends_with_done(engine):
+    events = run(collect(engine.aanswer_stream("What is the planning fallacy?")))
+    assert events[0][0] == "token"
+    assert events[-1] == ("done", None)
+
+
+def test_failed_verification_is_declined(engine, failing_verification):
+    assert run(engine.aanswer("When is the midterm exam held?")) == rag.CANNOT_ANSWER
+
+
+def test_stream_sends_a_correction_when_verification_fails(engine, failing_verification):
+    events = run(collect(engine.aanswer_stream("Which chapters does the exam cover?")))
+    assert events[-2:] == [("correction", rag.CANNOT_ANSWER), ("done", None)]
+
+
+def test_followup_uses_the_session(engine):
+    session_id = "async-session-000001"
+    assert run(engine.aanswer("What is anchoring?", session_id=session_id))
+    assert rag.sessions.get(session_id)
+    assert run(engine.aanswer("Can you give an example?", session_id=session_id))
+
+
+class Store:
+    def __init__(self, sqlite_path):
+        self.sqlite_path = sqlite_path
+
+
+def test_sqlite_stores_are_called_in_a_thread():
+    loop_thread = threading.get_ident()
+    assert run(async_engine.on_store(Store(None), threading.get_ident)) == loop_thread
+    assert run(async_engine.on_store(Store("sessions.sqlite"), threading.get_ident)) != loop_thread
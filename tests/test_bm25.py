@@ -0,0 +1,57 @@
+import pytest
+
+from src.bm25 import BM25Index, tokenize, write_bm25_index
+from src.main import reciprocal_rank_fusion
+
+DOCUMENTS = [
+    (101, "Anchoring is the tendency to rely on the first number."),
+    (102, "Loss aversion: losses loom larger than gains."),
+    (103, "Anchoring and adjustment: estimates stay close to the anchor, the anchoring number."),
+    (104, "Вземане на решения в условия на риск."),
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = str(tmp_path / "bm25.npz")
+    assert write_bm25_index(path, iter(DOCUMENTS)) == len(DOCUMENTS)
+    return BM25Index(path)
+
+
+def test_tokens_are_case_folded_words_in_any_script():
+    assert tokenize("Вземане на РЕШЕНИЯ, 2024!") == ["вземане", "на", "решения", "2024"]
+
+
+def test_more_matches_rank_higher(index):
+    ids, scores = index.search("anchoring number", k=10)
+    assert ids.tolist() == [103, 101]
+    assert scores[0] > scores[1] > 0
+
+
+def test_search_returns_at_most_k(index):
+    ids, _ = index.search("anchoring losses number", k=1)
+    assert len(ids) == 1
+
+
+def test_cyrillic_query_matches(index):
+    ids, _ = index.search("риск", k=5)
+    assert ids.tolist() == [104]
+
+
+def test_unknown_terms_match_nothing(index):
+    ids, scores = index.search("syllabus", k=5)
+    assert len(ids) == 0 and len(scores) == 0
+
+
+def test_empty_index(tmp_path):
+    path = str(tmp_path / "empty.npz")
+    assert write_bm25_index(path, []) == 0
+    index = BM25Index(path)
+    assert len(index) == 0
+    assert len(index.search("anchoring", k=5)[0]) == 0
+
+
+def test_fusion_favours_ids_ranked_high_in_both_lists():
+    assert reciprocal_rank_fusion([[1, 2, 3], [3, 1]]) == [1, 3, 2]
+    assert reciprocal_rank_fusion([[5], []]) == [5]
+    assert reciprocal_rank_fusion([]) == []
@@ -0,0 +1,57 @@
+import pytest
+
+from src.chunk_store import ChunkStore, InMemoryChunkStore, chunk_store_exists, write_chunk_store
+
+
+def record(chunk_id, text):
+    return {"chunk_id": chunk_id, "filename": "lecture.pdf", "chunk_text": text}
+
+
+@pytest.fixture
+def prefix(tmp_path):
+    return str(tmp_path / "chunk_store")
+
+
+def test_records_come_back_by_id(prefix):
+    # Multi-byte text makes byte offsets differ from character offsets
+    records = [record(30, "Риск и несигурност"), record(10, "Anchoring"), record(20, "Framing — ефект")]
+    assert write_chunk_store(prefix, iter(records)) == 3
+    assert chunk_store_exists(prefix)
+    store = ChunkStore(prefix)
+    assert len(store) == 3
+    assert store.ids.tolist() == [10, 20, 30]
+    assert store.get(30) == records[0]
+    assert store.get(20) == records[2]
+    assert [r["chunk_id"] for r in store] == [10, 20, 30]
+
+
+def test_missing_ids_are_none(prefix):
+    write_chunk_store(prefix, [record(10, "a"), record(20, "b")])
+    store = ChunkStore(prefix)
+    assert store.get(5) is None
+    assert store.get(15) is None
+    assert store.get(25) is None
+    assert store.get_many([20, 99, 10, 1]) == [record(20, "b"), None, record(10, "a"), None]
+
+
+def test_empty_store(prefix):
+    assert write_chunk_store(prefix, []) == 0
+    store = ChunkStore(prefix)
+    assert len(store) == 0
+    assert store.get(1) is None
+    assert store.get_many([1, 2]) == [None, None]
+    assert list(store) == []
+
+
+def test_rewriting_replaces_the_store(prefix):
+    write_chunk_store(prefix, [record(1, "old")])
+    write_chunk_store(prefix, [record(2, "new")])
+    store = ChunkStore(prefix)
+    assert store.get(1) is None
+    assert store.get(2)["chunk_text"] == "new"
+
+
+def test_in_memory_store_without_ids_uses_positions():
+    store = InMemoryChunkStore([{"chunk_text": "a"}, {"chunk_text": "b"}])
+    assert store.get(1) == {"chunk_text": "b"}
+    assert store.get_many([0, 5]) == [{"chunk_text": "a"}, None]
@@ -0,0 +1,111 @@
+import pytest
+
+from src.chunking import chunk_pages, is_heading, split_units
+from src.tokens import count_tokens
+
+
+@pytest.mark.parametrize("line", [
+    "# Decision making",
+    "## 2.1 Expected utility",
+    "2.1 Expected utility theory",
+    "3. Prospect Theory",
+    "4 Вземане на решения в условия на риск",
+    "BOUNDED RATIONALITY",
+    "ГЛАВА 3",
+])
+def test_section_titles_are_headings(line):
+    assert is_heading(line)
+
+
+@pytest.mark.parametrize("line", [
+    # Wrapped lines of a paragraph that happen to start with a number
+    "2 основни подхода за вземане на решения, които",
+    "3 years later the company changed its",
+    "The company changed its strategy.",
+    "2.1 Expected utility is defined as follows:",
+    "A sentence that ends with a comma,",
+])
+def test_ordinary_lines_are_not_headings(line):
+    assert not is_heading(line)
+
+
+def test_numbered_line_inside_a_sentence_is_not_a_heading():
+    # "3 Years" is capitalised, but it continues the unfinished sentence on the line before
+    assert not is_heading("3 Years of data were collected", after_break=False)
+    assert is_heading("3 Years of data", after_break=True)
+
+
+def test_wrapped_numbered_lines_stay_in_their_sentence():
+    page = ("Managers often compare options. There are\n"
+            "2 основни подхода за вземане на решения, които\n"
+            "се използват в практиката. After\n"
+            "3 Years the company changed its strategy.")
+    units = split_units([page], max_tokens=400)
+    assert not any(unit.heading for unit in units)
+    assert [unit.text for unit in units] == [
+        "Managers often compare options.",
+        "There are 2 основни подхода за вземане на решения, които се използват в практиката.",
+        "After 3 Years the company changed its strategy.",
+    ]
+
+
+def test_heading_after_a_finished_sentence_is_a_unit_of_its_own():
+    units = split_units(["The first section ends here.\n2.1 Expected utility\nUtility is a number."], 400)
+    assert [(unit.text, unit.heading) for unit in units] == [
+        ("The first section ends here.", False), ("2.1 Expected utility", True), ("Utility is a number.", False),
+    ]
+
+
+def sentences(count, word):
+    return " ".join(f"This is sentence {i} about {word} and its effect on decisions." for i in range(count))
+
+
+def test_chunks_respect_the_size_and_end_between_sentences():
+    text = sentences(60, "anchoring")
+    chunks = chunk_pages([text], chunk_size=100, overlap=20, paginated=False)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert count_tokens(chunk["text"]) <= 100
+        assert chunk["text"].startswith("This is sentence")
+        assert chunk["text"].endswith("decisions.")
+        assert chunk["page"] is None
+
+
+def test_chunks_repeat_trailing_sentences_as_overlap():
+    chunks = chunk_pages([sentences(60, "framing")], chunk_size=100, overlap=20, paginated=False)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        first_sentence = chunk["text"].split(". ")[0] + "."
+        assert first_sentence in previous["text"]
+
+
+def test_heading_starts_a_new_chunk():
+    page = sentences(6, "risk") + "\n\n# Uncertainty\n\n" + sentences(6, "uncertainty")
+    chunks = chunk_pages([page], chunk_size=400, overlap=0, paginated=False)
+    assert len(chunks) == 2
+    assert chunks[1]["text"].startswith("Uncertainty\n")
+
+
+def test_chunks_record_their_pages():
+    pages = [sentences(8, "risk"), sentences(8, "biases")]
+    chunks = chunk_pages(pages, chunk_size=60, overlap=0)
+    assert chunks[0]["page"] == 1
+    assert chunks[-1]["page_end"] == 2
+    assert all(chunk["page"] <= chunk["page_end"] for chunk in chunks)
+
+
+def test_overlong_sentence_is_cut_into_windows():
+    word_salad = " ".join(["heuristics"] * 500)
+    chunks = chunk_pages([word_salad], chunk_size=50, overlap=0, paginated=False)
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk["text"]) <= 50 for chunk in chunks)
+
+
+def test_chunks_are_measured_with_the_given_tokenizer():
+    # A tokenizer with one token per character, far longer counts than cl100k's
+    def count(text):
+        return len(text)
+
+    text = sentences(60, "anchoring")
+    chunks = chunk_pages([text], chunk_size=100, overlap=20, paginated=False, count=count)
+    assert all(count(chunk["text"]) <= 100 for chunk in chunks)
+    assert len(chunks) > len(chunk_pages([text], chunk_size=100, overlap=20, paginated=False))
@@ -0,0 +1,65 @@
+from src.context_builder import MIN_BLOCK_TOKENS, build_context, chunk_body, merge_hits, page_label, splice
+from src.tokens import count_tokens
+
+
+def record(filename, chunk_index, text, page=None, page_end=None):
+    return {"filename": filename, "chunk_index": chunk_index, "chunk_text": f"Document: {filename}. {text}",
+            "page": page, "page_end": page_end if page_end is not None else page}
+
+
+def test_chunk_body_drops_the_title_prefix():
+    assert chunk_body(record("risk.pdf", 0, "Risk is measurable.")) == "Risk is measurable."
+    assert chunk_body({"filename": "risk.pdf", "chunk_text": "No prefix here."}) == "No prefix here."
+
+
+def test_splice_keeps_the_overlap_once():
+    assert splice("a b c d".split(), "c d e".split()) == "a b c d e".split()
+    assert splice("a b".split(), "c d".split()) == "a b c d".split()
+
+
+def test_page_labels():
+    assert page_label(None, None) == ""
+    assert page_label(3, 3) == "p. 3"
+    assert page_label(3, 5) == "pp. 3-5"
+
+
+def test_neighbouring_chunks_merge_into_one_block():
+    hits = [
+        (record("b.pdf", 7, "Framing changes choices.", 9), 0.1),
+        (record("a.pdf", 2, "of the options. Then the decision follows.", 2), 0.2),
+        (record("a.pdf", 1, "Managers compare all of the options.", 1), 0.3),
+    ]
+    assert merge_hits(hits) == [
+        ("b.pdf", "p. 9", "Framing changes choices."),
+        ("a.pdf", "pp. 1-2", "Managers compare all of the options. Then the decision follows."),
+    ]
+
+
+def test_distant_chunks_of_a_file_stay_separate():
+    hits = [(record("a.pdf", 1, "First passage.", 1), 0.1), (record("a.pdf", 5, "Later passage.", 4), 0.2)]
+    assert [body for _, _, body in merge_hits(hits)] == ["First passage.", "Later passage."]
+
+
+def test_context_skips_text_it_already_holds():
+    hits = [(record("a.pdf", 0, "Loss aversion weighs losses more than gains."), 0.1),
+            (record("copy.pdf", 3, "Loss aversion weighs losses more than gains."), 0.2),
+            (record("b.pdf", 0, "Anchoring biases estimates."), 0.3)]
+    context = build_context(hits, max_tokens=500)
+    assert context == ("Document: a.pdf. Loss aversion weighs losses more than gains.\n\n"
+                       "Document: b.pdf. Anchoring biases estimates.")
+
+
+def test_context_fits_the_token_budget():
+    long_text = " ".join(f"Sentence {i} about heuristics and biases." for i in range(200))
+    hits = [(record("a.pdf", 0, "Short first block."), 0.1), (record("b.pdf", 0, long_text), 0.2)]
+    context = build_context(hits, max_tokens=300)
+    assert context.startswith("Document: a.pdf. Short first block.\n\nDocument: b.pdf. Sentence 0")
+    assert count_tokens(context) <= 300
+
+
+def test_block_that_would_be_cut_too_short_is_left_out():
+    long_text = " ".join(f"Sentence {i} about heuristics and biases." for i in range(200))
+    first = " ".join(["word"] * 100)
+    hits = [(record("a.pdf", 0, first), 0.1), (record("b.pdf", 0, long_text), 0.2)]
+    budget = count_tokens(f"Document: a.pdf. {first}") + MIN_BLOCK_TOKENS // 2
+    assert "b.pdf" not in build_context(hits, max_tokens=budget)
@@ -0,0 +1,77 @@
+import faiss
+import numpy as np
+import pytest
+
+from bench.corpus import make_vectors
+from scripts.create_final_data import build_faiss_index, collapse_duplicates, content_id, update_faiss_index
+from src.vector_index import index_config_from_settings, new_index
+
+DIMENSION = 16
+
+
+def record(chunk_id, text, filename="lecture.txt", chunk_index=0):
+    return {"chunk_id": chunk_id, "filename": filename, "chunk_index": chunk_index,
+            "chunk_text": f"Document: {filename}. {text}", "page": "", "page_end": ""}
+
+
+def test_duplicates_share_the_first_occurrence():
+    chunks = [
+        record(11, "anchoring", "a.txt", 0),
+        record(12, "framing", "a.txt", 1),
+        # The same text in another document, under its own title prefix
+        record(13, "anchoring", "b.txt", 0),
+        record(14, "anchoring", "c.txt", 4),
+    ]
+    first_rows, ids, duplicates = collapse_duplicates(chunks, np.array([11, 12, 13, 14]))
+    assert first_rows.tolist() == [0, 1]
+    assert ids.tolist() == [content_id("anchoring"), content_id("framing")]
+    assert [source["chunk_id"] for source in duplicates[content_id("anchoring")]] == [13, 14]
+    assert content_id("framing") not in duplicates
+
+
+@pytest.mark.parametrize("embedding_ids", [[11, 12], [11, 99, 13], [11, 12, 13, 14]])
+def test_chunks_that_no_longer_match_the_embeddings_are_rejected(embedding_ids):
+    chunks = [record(11, "a"), record(12, "b"), record(13, "c")]
+    with pytest.raises(ValueError):
+        collapse_duplicates(chunks, np.array(embedding_ids))
+
+
+def build(vectors, ids):
+    config = index_config_from_settings({})
+    return build_faiss_index(vectors, np.arange(len(ids), dtype=np.int64), np.asarray(ids, dtype=np.int64),
+                             config, block_size=2), config
+
+
+def test_update_adds_new_and_removes_stale_vectors():
+    vectors = make_vectors(6, DIMENSION)
+    index, config = build(vectors[:4], [101, 102, 103, 104])
+
+    # 102 and 104 disappeared, 105 and 106 are new, 101 and 103 are kept
+    ids = np.array([101, 103, 105, 106], dtype=np.int64)
+    kept = vectors[[0, 2, 4, 5]]
+    index = update_faiss_index(index, np.array([101, 102, 103, 104]), kept, np.arange(4, dtype=np.int64), ids,
+                               config, block_size=2)
+
+    assert index.ntotal == 4
+    _, found = index.search(kept, 1)
+    assert found[:, 0].tolist() == ids.tolist()
+    rebuilt, _ = build(kept, ids)
+    assert rebuilt.ntotal == index.ntotal
+
+
+def test_update_without_changes_keeps_the_index():
+    vectors = make_vectors(3, DIMENSION)
+    ids = np.array([7, 8, 9], dtype=np.int64)
+    index, config = build(vectors, ids)
+    index = update_faiss_index(index, ids, vectors, np.arange(3, dtype=np.int64), ids, config, block_size=2)
+    assert index.ntotal == 3
+    _, found = index.search(vectors, 1)
+    assert found[:, 0].tolist() == ids.tolist()
+
+
+def test_too_few_vectors_for_ivf_fall_back_to_flat_with_a_warning(caplog):
+    config = index_config_from_settings({"index_type": "ivf_flat", "index_nlist": "16"})
+    with caplog.at_level("WARNING", logger="src.vector_index"):
+        index = new_index(DIMENSION, 10, config)
+    assert isinstance(faiss.downcast_index(index.index), faiss.IndexFlat)
+    assert "building a flat index instead" in caplog.text
@@ -0,0 +1,36 @@
+import numpy as np
+
+from src.embedding_cache import EmbeddingCache, normalize_text
+
+
+def test_keys_ignore_case_and_spacing():
+    assert normalize_text("  What  is\nANCHORING ") == "what is anchoring"
+    cache = EmbeddingCache()
+    cache.put("m", "What is anchoring?", [1.0, 2.0])
+    assert cache.get("m", "what   is anchoring?").tolist() == [1.0, 2.0]
+    assert cache.get("other-model", "What is anchoring?") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_vectors_are_float32():
+    cache = EmbeddingCache()
+    cache.put("m", "q", np.array([0.5, 0.25], dtype=np.float64))
+    assert cache.get("m", "q").dtype == np.float32
+
+
+def test_memory_is_bounded():
+    cache = EmbeddingCache(max_size=2)
+    for i in range(3):
+        cache.put("m", f"q{i}", [float(i)])
+    assert cache.get("m", "q0") is None
+    assert cache.stats()["size"] == 2
+
+
+def test_sqlite_entries_survive_a_new_cache(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    EmbeddingCache(sqlite_path=path).put("m", "What is risk?", [0.1, 0.2, 0.3])
+    # A restarted worker starts with an empty memory but reads the file
+    cache = EmbeddingCache(max_size=1, sqlite_path=path)
+    assert np.allclose(cache.get("m", "what is risk?"), [0.1, 0.2, 0.3])
+    assert cache.stats()["size"] == 1
+    assert cache.stats()["persistent"]
@@ -0,0 +1,55 @@
+import pytest
+
+from src import main as rag
+
+
+@pytest.fixture(scope="module")
+def engine(course_index):
+    return rag.RAGEngine()
+
+
+def test_repeated_question_is_answered_from_the_cache(engine, openai_api):
+    question = "What is loss aversion, in a few words?"
+    reply = engine.answer(question)
+    assert reply
+    requests = openai_api.requests
+    assert engine.answer(question.upper()) == reply
+    # At most the classifier call started alongside the cache lookup went out, never a completion
+    assert openai_api.requests - requests <= 1
+
+
+def test_multiple_choice_is_never_looked_up(engine):
+    lookups = rag.answer_cache.stats()["hits"] + rag.answer_cache.stats()["misses"]
+    engine.answer("framing", question_type="multiple_choice")
+    engine.answer("framing", question_type="multiple_choice")
+    assert rag.answer_cache.stats()["hits"] + rag.answer_cache.stats()["misses"] == lookups
+
+
+def test_followup_in_a_session_is_answered(engine):
+    session_id = "test-session-0000001"
+    assert engine.answer("What is anchoring?", session_id=session_id)
+    assert rag.sessions.get(session_id)
+    assert engine.answer("Can you give an example?", session_id=session_id)
+
+
+def test_answer_that_fails_verification_is_retried_then_declined(engine, openai_api, failing_verification):
+    question = "What does the syllabus say about the final essay?"
+    requests = openai_api.requests
+    assert engine.answer(question) == rag.CANNOT_ANSWER
+    # At least the first completion and the retry with a wider context went out
+    assert openai_api.requests - requests >= 2
+    # A declined answer is not cached for later students
+    assert engine._cached_answer(question, "normal") is None
+
+
+def test_stream_sends_a_correction_when_verification_fails(engine, failing_verification):
+    events = list(engine.answer_stream("How are group projects graded this term?"))
+    kinds = [kind for kind, _ in events]
+    assert kinds[0] == "token"
+    assert kinds[-2:] == ["correction", "done"]
+    assert events[-2][1] == rag.CANNOT_ANSWER
+
+
+def test_stream_without_failure_has_no_correction(engine):
+    events = list(engine.answer_stream("What is the availability heuristic?"))
+    assert [kind for kind, _ in events if kind != "token"] == ["done"]
@@ -0,0 +1,96 @@
+import re
+
+from src.metrics import REQUESTS, Counter, Histogram, Tracer, family, note, render_metrics, stage
+from src.web import metrics_text
+
+SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{([a-zA-Z_][a-zA-Z0-9_]*="(\\.|[^"\\])*",?)*\})? (\S+)$')
+
+
+def check_exposition(text):
+    """Checks the Prometheus text format: every sample follows the HELP and TYPE lines of its family."""
+    assert text.endswith("\n")
+    families = {}
+    current = None
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            current = line.split()[2]
+            assert current not in families, f"{current} is exposed twice"
+            families[current] = None
+        elif line.startswith("# TYPE "):
+            name, kind = line.split()[2:4]
+            assert name == current
+            families[name] = kind
+        else:
+            match = SAMPLE_RE.match(line)
+            assert match, line
+            name = match.group(1)
+            if families[current] == "histogram":
+                assert name in (current + "_bucket", current + "_sum", current + "_count"), line
+            else:
+                assert name == current, line
+            float(match.group(5))
+    return families
+
+
+def test_family_escapes_label_values():
+    lines = family("rag_test_total", "counter", "A test counter.", [({"path": 'a "b"\\c\nd'}, 3), ({}, 2.5)])
+    assert lines == [
+        "# HELP rag_test_total A test counter.",
+        "# TYPE rag_test_total counter",
+        'rag_test_total{path="a \\"b\\"\\\\c\\nd"} 3',
+        "rag_test_total 2.5",
+    ]
+
+
+def test_counter_sums_per_label_set():
+    counter = Counter("rag_test_total", "Test.", ("stage", "model"))
+    counter.inc("embed", "m1")
+    counter.inc("embed", "m1", amount=2)
+    counter.inc("classify", "m1")
+    assert counter.render()[2:] == [
+        'rag_test_total{stage="classify",model="m1"} 1',
+        'rag_test_total{stage="embed",model="m1"} 3',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("rag_test_seconds", "Test.", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value, "search")
+    assert histogram.render()[2:] == [
+        'rag_test_seconds_bucket{stage="search",le="0.1"} 1',
+        'rag_test_seconds_bucket{stage="search",le="1.0"} 3',
+        'rag_test_seconds_bucket{stage="search",le="+Inf"} 4',
+        'rag_test_seconds_sum{stage="search"} 4.05',
+        'rag_test_seconds_count{stage="search"} 4',
+    ]
+
+
+def test_traced_request_is_counted_by_outcome():
+    tracer = Tracer()
+    before = dict(REQUESTS._values)
+    with tracer.request("normal", "What is risk?") as trace:
+        with stage("search"):
+            pass
+        note(answer_cache_hit=True)
+    assert trace.outcome == "cached"
+    assert "search" in trace.stages
+    key = ("normal", "cached")
+    assert REQUESTS._values[key] == before.get(key, 0) + 1
+
+
+def test_render_metrics_is_valid_exposition():
+    with Tracer().request("normal", "What is risk?"):
+        with stage("search"):
+            pass
+    families = check_exposition(render_metrics(family("rag_extra", "gauge", "Extra.", [({}, 1)])))
+    assert families["rag_requests_total"] == "counter"
+    assert families["rag_stage_seconds"] == "histogram"
+    assert families["rag_extra"] == "gauge"
+
+
+def test_metrics_page_is_valid_exposition():
+    families = check_exposition(metrics_text())
+    for name in ("rag_cache_hits_total", "rag_cache_misses_total", "rag_sessions", "rag_openai_calls_total",
+                 "rag_single_flight_requests_total", "rag_single_flight_timeouts_total"):
+        assert name in families
@@ -0,0 +1,40 @@
+import os
+
+from scripts import prepare_documents
+from scripts.prepare_documents import extract_documents
+
+
+def write_documents(tmp_path, names):
+    paths = []
+    for name in names:
+        path = tmp_path / name
+        path.write_text(f"The text of {name}.", encoding="utf-8")
+        paths.append(str(path))
+    return paths
+
+
+def test_documents_are_extracted_in_worker_processes(tmp_path):
+    paths = write_documents(tmp_path, ["a.txt", "b.txt", "c.txt"])
+    extracted = {}
+    errors = extract_documents(paths, workers=2, pages_per_task=50, on_document=extracted.__setitem__)
+    assert errors == {}
+    assert extracted == {path: [f"The text of {os.path.basename(path)}."] for path in paths}
+
+
+def test_a_dying_worker_fails_only_its_own_document(tmp_path, monkeypatch):
+    extract_pages = prepare_documents.extract_pages
+
+    def crash_on_some_files(fpath, start=0, end=None):
+        if "crash" in fpath:
+            os._exit(1)
+        return extract_pages(fpath, start, end)
+
+    # Worker processes are forked, so they see the patched function
+    monkeypatch.setattr(prepare_documents, "extract_pages", crash_on_some_files)
+    paths = write_documents(tmp_path, ["a.txt", "crash.txt", "b.txt", "c.txt", "d.txt"])
+    extracted = {}
+    errors = extract_documents(paths, workers=2, pages_per_task=50, on_document=extracted.__setitem__)
+    crashed = str(tmp_path / "crash.txt")
+    assert list(errors) == [crashed]
+    assert "BrokenProcessPool" in errors[crashed]
+    assert sorted(extracted) == sorted(path for path in paths if path != crashed)
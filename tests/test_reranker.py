@@ -0,0 +1,57 @@
+from src.reranker import CrossEncoderReranker
+
+
+class FakeCrossEncoder:
+    """Scores a pair by how many query words the text contains; records the pairs it scored."""
+
+    def __init__(self):
+        self.pairs = []
+
+    def predict(self, pairs, batch_size, show_progress_bar):
+        self.pairs.extend(pairs)
+        return [sum(word in text.lower() for word in query.lower().split()) for query, text in pairs]
+
+
+def hit(chunk_id, text):
+    return {"chunk_id": chunk_id, "filename": "a.pdf", "chunk_text": f"Document: a.pdf. {text}"}, 0.5
+
+
+def reranker():
+    reranker = CrossEncoderReranker()
+    reranker._model = FakeCrossEncoder()
+    return reranker
+
+
+HITS = [hit(1, "Framing effects."), hit(2, "Anchoring and adjustment."), hit(3, "Anchoring biases adjustment.")]
+
+
+def test_hits_are_reordered_by_score():
+    ranked = reranker().rerank("anchoring adjustment biases", HITS, top_n=2)
+    assert [record["chunk_id"] for record, _ in ranked] == [3, 2]
+
+
+def test_the_model_sees_chunks_without_the_title_prefix():
+    model_reranker = reranker()
+    model_reranker.rerank("framing", HITS[:1], top_n=1)
+    assert model_reranker.model.pairs == [("framing", "Framing effects.")]
+
+
+def test_scores_are_cached_per_query_and_chunk():
+    model_reranker = reranker()
+    model_reranker.rerank("Anchoring", HITS[:2], top_n=2)
+    model_reranker.rerank("  anchoring ", HITS, top_n=2)
+    # The second call only scores the chunk it has not seen with this query
+    assert len(model_reranker.model.pairs) == 3
+    stats = model_reranker.stats()
+    assert (stats["pairs_scored"], stats["cache_hits"], stats["cache_misses"]) == (3, 2, 3)
+
+
+def test_score_cache_is_bounded():
+    model_reranker = CrossEncoderReranker(cache_size=2)
+    model_reranker._model = FakeCrossEncoder()
+    model_reranker.rerank("anchoring", HITS, top_n=3)
+    assert model_reranker.stats()["cache_size"] == 2
+
+
+def test_no_hits():
+    assert reranker().rerank("anchoring", [], top_n=3) == []
@@ -0,0 +1,66 @@
+import time
+
+from src.session_store import SessionStore
+from src.tokens import count_tokens
+
+
+def test_sessions_are_kept_per_id():
+    store = SessionStore()
+    store.put("s1", "context one")
+    store.put("s2", "context two")
+    assert store.get("s1") == "context one"
+    assert store.get("s2") == "context two"
+    assert store.get("unknown") is None
+    assert store.get(None) is None
+    assert store.stats()["hits"] == 2
+
+
+def test_sessions_expire_after_the_ttl():
+    store = SessionStore(ttl=0.05)
+    store.put("s1", "context")
+    time.sleep(0.1)
+    assert store.get("s1") is None
+    assert store.stats()["size"] == 0
+
+
+def test_least_recently_used_session_is_evicted():
+    store = SessionStore(max_sessions=2)
+    store.put("s1", "one")
+    store.put("s2", "two")
+    store.get("s1")
+    store.put("s3", "three")
+    assert store.get("s2") is None
+    assert store.get("s1") == "one"
+
+
+def test_context_is_truncated():
+    store = SessionStore(max_tokens=20)
+    store.put("s1", "word " * 500)
+    assert count_tokens(store.get("s1")) <= 20
+
+
+def test_sqlite_sessions_are_shared_between_stores(tmp_path):
+    path = str(tmp_path / "sessions.sqlite")
+    # Two stores on one file, like two gunicorn workers
+    SessionStore(sqlite_path=path).put("s1", "shared context")
+    other = SessionStore(sqlite_path=path)
+    assert other.get("s1") == "shared context"
+    assert other.stats()["persistent"]
+
+
+def test_sqlite_sessions_expire_after_the_ttl(tmp_path):
+    store = SessionStore(ttl=0.05, sqlite_path=str(tmp_path / "sessions.sqlite"))
+    store.put("s1", "context")
+    time.sleep(0.1)
+    assert store.get("s1") is None
+
+
+def test_sqlite_prune_keeps_the_newest_sessions(tmp_path):
+    store = SessionStore(max_sessions=2, sqlite_path=str(tmp_path / "sessions.sqlite"))
+    store.prune_interval = 0.0
+    for session_id in ("s1", "s2", "s3"):
+        store.put(session_id, session_id)
+        time.sleep(0.01)
+    assert store.stats()["size"] == 2
+    assert store.get("s1") is None
+    assert store.get("s3") == "s3"
@@ -0,0 +1,167 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src.single_flight import AsyncSingleFlight, SingleFlight, normalize_question
+
+
+def run_in_thread(flights, key, fn):
+    """Starts flights.run(key, fn) in a thread; returns the thread and a list that receives its result or error."""
+    outcome = []
+
+    def lead():
+        try:
+            outcome.append(flights.run(key, fn))
+        except BaseException as e:
+            outcome.append(e)
+
+    thread = threading.Thread(target=lead)
+    thread.start()
+    return thread, outcome
+
+
+def test_follower_gets_the_leader_result():
+    shared = []
+    flights = SingleFlight(on_shared=lambda: shared.append(True))
+    started, release = threading.Event(), threading.Event()
+
+    def work():
+        started.set()
+        release.wait()
+        return "answer"
+
+    thread, outcome = run_in_thread(flights, "key", work)
+    started.wait()
+    flight, leader = flights.join("key")
+    assert not leader
+    release.set()
+    assert flights.wait(flight) == "answer"
+    thread.join()
+    assert outcome == ["answer"]
+    assert shared == [True]
+    assert flights.stats() == {"in_flight": 0, "leaders": 1, "followers": 1, "timeouts": 0}
+
+
+def test_leader_failure_is_raised_in_followers():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def fail():
+        started.set()
+        release.wait()
+        raise RuntimeError("upstream failed")
+
+    thread, outcome = run_in_thread(flights, "key", fail)
+    started.wait()
+    follower, follower_outcome = run_in_thread(flights, "key", lambda: "follower ran")
+    while flights.stats()["followers"] == 0:
+        time.sleep(0.001)
+    release.set()
+    thread.join()
+    follower.join()
+    assert isinstance(outcome[0], RuntimeError)
+    assert follower_outcome == outcome
+    # The failed flight is forgotten, so the next caller leads a new one
+    assert flights.run("key", lambda: "retried") == "retried"
+
+
+def test_abandoned_leader_lets_followers_run_themselves():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def abandon():
+        started.set()
+        release.wait()
+        raise GeneratorExit
+
+    thread, outcome = run_in_thread(flights, "key", abandon)
+    started.wait()
+    flight, _ = flights.join("key")
+    release.set()
+    thread.join()
+    assert isinstance(outcome[0], GeneratorExit)
+    assert flights.wait(flight) is None
+
+
+def test_follower_stops_waiting_after_the_timeout():
+    flights = SingleFlight(timeout=0.05)
+    started, release = threading.Event(), threading.Event()
+
+    def hang():
+        started.set()
+        release.wait()
+        return "late"
+
+    thread, outcome = run_in_thread(flights, "key", hang)
+    started.wait()
+    assert flights.run("key", lambda: "own") == "own"
+    release.set()
+    thread.join()
+    assert outcome == ["late"]
+    assert flights.stats()["timeouts"] == 1
+
+
+def test_async_leader_cancellation_lets_followers_run_themselves():
+    async def scenario():
+        flights = AsyncSingleFlight()
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.Event().wait()
+
+        async def own():
+            return "own"
+
+        leader = asyncio.ensure_future(flights.run("key", hang))
+        await started.wait()
+        follower = asyncio.ensure_future(flights.run("key", own))
+        await asyncio.sleep(0)
+        leader.cancel()
+        assert await follower == "own"
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return flights.stats()
+
+    # The follower ran its own call outside the flight
+    assert asyncio.run(scenario()) == {"in_flight": 0, "leaders": 1, "followers": 1, "timeouts": 0}
+
+
+def test_async_leader_failure_is_raised_in_followers():
+    async def scenario():
+        flights = AsyncSingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream failed")
+
+        async def own():
+            return "own"
+
+        return await asyncio.gather(flights.run("key", fail), flights.run("key", own), return_exceptions=True)
+
+    leader, follower = asyncio.run(scenario())
+    assert isinstance(leader, RuntimeError)
+    assert follower is leader
+
+
+def test_async_follower_stops_waiting_after_the_timeout():
+    async def scenario():
+        flights = AsyncSingleFlight(timeout=0.05)
+
+        async def slow():
+            await asyncio.sleep(0.5)
+            return "late"
+
+        async def own():
+            return "own"
+
+        return await asyncio.gather(flights.run("key", slow), flights.run("key", own)), flights.stats()["timeouts"]
+
+    assert asyncio.run(scenario()) == (["late", "own"], 1)
+
+
+def test_normalized_questions_share_a_key():
+    assert normalize_question("  What is  Anchoring?? ") == normalize_question("what is anchoring")
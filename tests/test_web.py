@@ -0,0 +1,73 @@
+import pytest
+
+from src.web import MAX_K, parse_batch_request, parse_chat_request, session_id_for
+
+
+def test_chat_request_prefixes_set_the_question_type():
+    assert parse_chat_request({"query": "  What is anchoring?  "}) == ("What is anchoring?", "normal")
+    assert parse_chat_request({"query": "m: framing"}) == ("framing", "multiple_choice")
+    assert parse_chat_request({"query": "A: it is B"}) == ("it is B", "answer_check")
+
+
+def test_explicit_question_type_wins_over_prefix():
+    assert parse_chat_request({"query": "m: framing ", "question_type": "normal"}) == ("m: framing", "normal")
+
+
+@pytest.mark.parametrize("data", [{}, {"query": ""}, {"query": "   "}, {"query": "m:"}])
+def test_chat_request_without_query_is_rejected(data):
+    with pytest.raises(ValueError):
+        parse_chat_request(data)
+
+
+@pytest.mark.parametrize("query", [42, ["What is risk?"], {"text": "What is risk?"}, True])
+def test_chat_request_with_non_string_query_is_rejected(query):
+    with pytest.raises(ValueError):
+        parse_chat_request({"query": query})
+
+
+def test_chat_request_with_unknown_question_type_is_rejected():
+    with pytest.raises(ValueError):
+        parse_chat_request({"query": "What is risk?", "question_type": "essay"})
+
+
+@pytest.mark.parametrize("queries", [None, [], "What is risk?", ["What is risk?", 3], ["What is risk?", " "]])
+def test_batch_request_needs_non_empty_strings(queries):
+    with pytest.raises(ValueError):
+        parse_batch_request({"queries": queries})
+
+
+def test_batch_request_strips_queries_and_reads_k():
+    assert parse_batch_request({"queries": [" What is risk? "], "k": "3"}) == (["What is risk?"], 3)
+
+
+def test_session_id_from_body_wins_over_cookie():
+    body_id = "a" * 24
+    cookie_id = "b" * 24
+    assert session_id_for({"session_id": body_id}, cookie_id) == (body_id, False)
+    assert session_id_for({}, cookie_id) == (cookie_id, False)
+
+
+@pytest.mark.parametrize("candidate", [None, 12345, "short", "x" * 129, "has spaces in it ok?", "../../etc/passwd/xx"])
+def test_invalid_session_ids_get_a_fresh_one(candidate):
+    session_id, is_new = session_id_for({"session_id": candidate}, candidate if isinstance(candidate, str) else None)
+    assert is_new
+    assert session_id != candidate
+    assert session_id_for({"session_id": session_id}, None) == (session_id, False)
+
+
+@pytest.mark.parametrize("data", [["What is risk?"], "What is risk?", 42, None])
+def test_request_body_must_be_an_object(data):
+    with pytest.raises(ValueError):
+        parse_chat_request(data)
+    with pytest.raises(ValueError):
+        parse_batch_request(data)
+
+
+@pytest.mark.parametrize("k", [0, -1, "many", None, MAX_K + 1, 10 ** 12])
+def test_batch_request_k_must_be_in_range(k):
+    with pytest.raises(ValueError):
+        parse_batch_request({"queries": ["What is risk?"], "k": k})
+
+
+def test_batch_request_accepts_the_largest_k():
+    assert parse_batch_request({"queries": ["What is risk?"], "k": MAX_K})[1] == MAX_K